@@ -30,6 +30,7 @@
 #   Usage:                                                                    #
 #       ChapterChainer.py Title [option] [URL]                                #
 #       ChapterChainer.py URL                                                 #
+#       ChapterChainer.py --batch=FILE                                        #
 #   Invoke the script with one of the builtin titles (SICP, T5D, Unsong),     #
 #   one of the switches if applicable (see below),                            #
 #   your start URL if you don't want to start at the serial's first page.     #
@@ -48,6 +49,120 @@
 #   'ChapterChainer.py Unsong --omit'                                         #
 #   downloads 'Unsong' without the non-story pages to the working directory.  #
 #                                                                             #
+#   Run options for all serials, anywhere after the script name:              #
+#   [--pipeline] [--pipeline-depth=N]                                         #
+#   [--connect-timeout=SECONDS] [--read-timeout=SECONDS]                      #
+#   '--pipeline' downloads the next page while the current one is processed   #
+#   and written; '--pipeline-depth' is the number of pages the download may   #
+#   be ahead of processing (default: 2). The timeouts limit how long to wait  #
+#   for a connection (default: 15) and for data from the server (default:     #
+#   60) before giving up.                                                     #
+#   [--cache=DIRECTORY] [--cache-size=MEGABYTES]                              #
+#   '--cache' keeps the downloaded pages in a directory; later runs only ask  #
+#   the server whether a page has changed. The least recently used pages are  #
+#   dropped when the cache grows beyond '--cache-size' (default: 500).        #
+#   [--memo-size=MEGABYTES]                                                   #
+#   With '--cache', the headline, content and next link of each page are      #
+#   kept as well, up to '--memo-size' (default: 100; 0: not kept); a page     #
+#   that is unchanged since is not parsed or decluttered again.               #
+#   [--resume | --update]                                                     #
+#   '--resume' continues an interrupted download where it stopped; '--update' #
+#   adds the chapters published since the last complete download. Both use    #
+#   the checkpoints in the '.journal' file next to the downloaded HTML file.  #
+#   A page is not visited twice, by whatever url (compared without scheme,    #
+#   '#…', tracking parameters or trailing slash; also after redirects), nor   #
+#   the same chapter written twice, also across '--resume' and '--update'.    #
+#   [--raw-files]                                                             #
+#   '--raw-files' keeps each downloaded page as a file (for debugging).       #
+#   [--prefetch=N] [--host-connections=N]                                     #
+#   '--prefetch' guesses the urls of the next N pages (from numbers counting  #
+#   up in the url, or from dated links seen on the pages) and downloads them  #
+#   ahead, at most '--host-connections' (default: 2) at a time per host.      #
+#   Wrong guesses are dropped; the pages are processed in chapter order.      #
+#   [--bulk]                                                                  #
+#   '--bulk' takes the chapters of a WordPress site (T5D, Unsong, maybe any   #
+#   URL) from its REST API, 100 posts per request, or else from its RSS       #
+#   feed, in date order as its 'Next' links go, instead of page by page.      #
+#   Without either, the 'Next' links are followed as usual.                   #
+#   [--engine=soup|lxml]                                                      #
+#   '--engine=lxml' parses and searches pages with lxml alone, not building   #
+#   a Beautiful Soup tree: faster, with the same html (the default of T5D     #
+#   and Unsong); '--engine=soup' uses Beautiful Soup. SICP's pages are only   #
+#   parsed by Beautiful Soup (with html5lib).                                 #
+#   [--calibrate=N]                                                           #
+#   '--calibrate' renders the serial's first N pages with each parser (lxml,  #
+#   html.parser, html5lib) and keeps the fastest one whose pages show the     #
+#   same as with the serial's own parser, for later runs in this directory    #
+#   (in 'ChapterChainer.calibration.json'). Nothing is downloaded else. A     #
+#   page without content is parsed once more by html5lib, the most lenient.   #
+#                                                                             #
+#   Batch mode:                                                               #
+#       ChapterChainer.py --batch=FILE [run options]                          #
+#   downloads all serials listed in FILE at the same time, one per line with  #
+#   the arguments as above (e.g. 'Unsong --omit'; '#' starts a comment).      #
+#   Serials on the same host take turns, keeping that host's delay.           #
+#   [--delay=SECONDS] [--robots=off]                                          #
+#   Requests to a host go as fast as it answers well, slower when it answers  #
+#   slowly or with errors, and as late as it asks in 'Retry-After'.           #
+#   '--delay' sets the least time between them (default: 0), as does the      #
+#   'Crawl-delay' of the host's robots.txt, unless '--robots=off'.            #
+#   [--retries=N] [--retry-budget=N] [--backoff=SECONDS]                      #
+#   Pages that fail for now (connection errors, timeouts, status 5xx or 429)  #
+#   are tried again up to '--retries' times (default: 5), waiting about       #
+#   twice as long each time from '--backoff' (default: 1), and at most        #
+#   '--retry-budget' times in all (default: 50). If a page can't be had, the  #
+#   download stops with a closed HTML file, and '--resume' goes on later.     #
+#   [--output=FILE] [--spool-size=MEGABYTES]                                  #
+#   '--output' writes to FILE instead of the serial's file; '-' writes to     #
+#   standard output (feedback goes to standard error), a name ending in       #
+#   '.gz', '.bz2' or '.xz' writes compressed (both can't be resumed). Notes   #
+#   to append are kept in memory up to '--spool-size' (default: 16).          #
+#   [--format=html|split|epub]                                                #
+#   '--format=split' writes each chapter to its own HTML file in a directory  #
+#   (named like the HTML file), with an index page and links between the      #
+#   chapters; '--format=epub' writes an EPUB book. Both are written chapter   #
+#   by chapter while downloading, and can't be resumed.                       #
+#   [--assets=local|embed] [--asset-connections=N]                            #
+#   '--assets' downloads the images and stylesheets of the chapters, at most  #
+#   '--asset-connections' at a time (default: 8), and points the output to    #
+#   them: as files named by their content next to the output (in a '_files'   #
+#   folder, the directory or the book), or embedded in the html. With         #
+#   '--cache', assets are taken from the cache once downloaded.               #
+#   [--rerender] [--workers=N]                                                #
+#   '--rerender' rebuilds the last download of a serial from the page cache   #
+#   (give the same '--cache'), e.g. after changing its decluttering, parsing  #
+#   and decluttering the pages in '--workers' processes (default: one per     #
+#   core). It follows the pages listed in the '.journal' of the HTML file.    #
+#   [--metrics=FILE] [--profile=cpu|memory]                                   #
+#   '--metrics' writes timings of each request phase and page stage, and      #
+#   counts, to FILE at the end (JSON if it ends in '.json', else Prometheus   #
+#   text). '--profile' shows where the run spends time (cProfile, also saved  #
+#   to 'ChapterChainer.prof') or memory (tracemalloc).                        #
+#                                                                             #
+#   Work queue:                                                               #
+#       ChapterChainer.py --queue=FILE --enqueue=LIST                         #
+#       ChapterChainer.py --queue=FILE --work [--lease=SECONDS] [options]     #
+#       ChapterChainer.py --queue=FILE                                        #
+#   '--enqueue' adds the serials listed in LIST (as for '--batch') as jobs    #
+#   to the queue, an SQLite file; one done or stopped is queued again.        #
+#   '--work' runs a worker downloading the jobs one after another, until      #
+#   none are left. Start any number of workers, on any machine that reaches   #
+#   the file (with working file locks) and the outputs. A worker leases its   #
+#   job and the job's host, so no two download from one host at the same      #
+#   time, and renews both every third of '--lease' (default: 60), noting the  #
+#   pages done. A worker that is gone loses them once the lease runs out;     #
+#   another takes the job over and resumes its output (up to 3 tries). A job  #
+#   whose output has a complete download is updated ('--update'). Without     #
+#   either, the jobs are shown with their state and progress.                 #
+#                                                                             #
+#   Library use:                                                              #
+#       from ChapterChainer import iter_chapters                              #
+#       for chapter in iter_chapters('Unsong', notes='omit'): ...             #
+#   hands on each chapter (url, title, is_note, html, timings) as soon as it  #
+#   is decluttered, one page at a time, without writing or printing.          #
+#   Run options are keywords (e.g. 'pipeline=True'); 'aiter_chapters' is the  #
+#   same as an async iterator.                                                #
+#                                                                             #
 #   Known Issues:                                                             #
 #   Pages not published at the time of this script update may not be found    #
 #   if the 'Next' link has been changed.                                      #
@@ -85,554 +200,4814 @@
 """
 
 
+import base64
+import bz2
+import codecs
+import collections
+import concurrent.futures
+import contextlib
+import copy
+import datetime
+import email.utils
+import cProfile
+import gzip
+import hashlib
+import html
+import http.client
+import json
+import lzma
+import mimetypes
+import mmap
 import os
 import os.path
+import pstats
+import queue
+import random
 import re
+import shlex
 import shutil
+import socket
+import ssl
 import sys
+import tempfile
+import threading
 import time
+import tracemalloc
 import urllib.parse
 import urllib.request
-import bs4
-import html5lib  # is used, ignore code inspector's complaint
-import lxml  # is used, ignore code inspector's complaint
+import urllib.robotparser
+import uuid
+import xml.etree.ElementTree
+import zipfile
+import zlib
 
+# Parsers are imported on first use (see import_soup(), import_lxml()), so
+# a run pays only for what its serial and output need
+bs4 = None
+lxml = None
 
-def download_page(next_link, raw_html_file):
-    """Download page to temporary file"""
 
-    # Timing
-    down_start_time = time.time()  # Start download time
+# Run options for all serials ('--name' or '--name=value' on the command
+# line), with their defaults. The type of the default is the option's type.
+RUN_OPTIONS = {
+    'pipeline': False,      # Download next page while processing this one
+    'pipeline-depth': 2,    # Pages the download may be ahead of processing
+    'connect-timeout': 15.0,  # Seconds to connect (incl. TLS handshake)
+    'read-timeout': 60.0,   # Seconds to wait for data from the server
+    'cache': '',            # Directory of the page cache ('': no cache)
+    'cache-size': 500,      # Megabytes the page cache may hold
+    'memo-size': 100,       # Megabytes of rendered pages kept with the cache
+    'resume': False,        # Continue an interrupted download
+    'update': False,        # Add chapters published since the last download
+    'raw-files': False,     # Keep downloaded pages as files (debugging)
+    'prefetch': 0,          # Pages to guess and download ahead (0: none)
+    'host-connections': 2,  # Downloads at the same time from one host
+    'batch': '',            # File listing serials to download together
+    'delay': 0.0,           # Least seconds between requests to the same host
+    'robots': True,         # Keep the Crawl-delay of the hosts' robots.txt
+    'metrics': '',          # File to export metrics to ('': none)
+    'profile': '',          # Profile the run: 'cpu' or 'memory' ('': not)
+    'output': '',           # Output file ('-': stdout; '': serial's default)
+    'spool-size': 16,       # Megabytes of notes to append kept in memory
+    'format': 'html',       # Output as 'html' file, 'split' chapters, 'epub'
+    'rerender': False,      # Rebuild the last download from the page cache
+    'workers': 0,           # Processes to re-render with (0: one per core)
+    'assets': '',           # Images etc. as 'local' files or 'embed'ded
+    'asset-connections': 8,  # Assets downloaded at the same time
+    'retries': 5,           # Tries again of a page that failed to download
+    'retry-budget': 50,     # Tries again of all pages of the run together
+    'backoff': 1.0,         # Seconds to wait before the first try again
+    'bulk': False,          # Chapters from a WordPress site's API or feed
+    'engine': '',           # Parse engine: 'soup' or 'lxml' ('': serial's)
+    'calibrate': 0,         # Sample pages to choose the fastest parser by
+    'queue': '',            # SQLite file of a work queue ('': none)
+    'enqueue': '',          # File listing serials to add to the queue
+    'work': False,          # Download the queue's jobs, as one worker
+    'lease': 60.0,          # Seconds a worker holds a job without renewing
+}
 
-    # Save retrieved html to temp file
-    # (Keep the 'try..' and leave broad despite code inspector's complaint, in
-    # case a connection needs debugging)
-    try:
-        # Spoof the User-Agent, in case Python is a blacklisted agent and
-        # receives a 403. (Web search a list of valid user agents, pick one)
-        request = urllib.request.Request(next_link, headers={
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) \
-            AppleWebKit/537.36 (KHTML, like Gecko) Chrome/59.0.3071.115 \
-            Safari/537.36'})
-        with urllib.request.urlopen(request) as response:
-            with open(raw_html_file, 'wb') as out_file:
-                shutil.copyfileobj(response, out_file)
-    except Exception as this_exception:  # debug info & exit
-        print('\nCould not retrieve next page. Is this link broken?\n\'' +
-              next_link + '\'\n\n')
-        print(type(this_exception))
-        print(this_exception)
-        sys.exit()          # stop gracefully
-
-    return str(time.time() - down_start_time)  # Download time
-
-
-def find_next_link(soup):
-    """Identify and return a link to the next page"""
+# Run options for the whole process (read from RUN_OPTIONS), thus only on
+# the command line, not for one serial of a '--batch' or '--enqueue' list
+PROCESS_RUN_OPTIONS = frozenset([
+    'connect-timeout', 'read-timeout', 'cache', 'cache-size', 'memo-size',
+    'batch', 'robots', 'metrics', 'profile', 'retries', 'retry-budget',
+    'backoff', 'queue', 'enqueue', 'work', 'lease'])
 
-    maybe_link = None
-
-    # Various link texts in builtin serials
-    if WHICH_SERIAL in ('T5D', 'Unsong'):
-        if soup.find('a', {'rel': 'next'}) is not None:  # find by 'rel'='next'
-            maybe_link = soup.find('a', {'rel': 'next'})['href']
-        else:  # find by link text
-            this_re = re.compile(r'(Next)(( |0xC2A0|&nbsp;)+Chapter)?')
-            if soup.find('a', text=this_re) is not None:
-                maybe_link = soup.find('a', text=this_re)['href']
-
-    # Only 'next' as link text
-    if WHICH_SERIAL == 'SICP':
-        if soup.find('a', text='next') is not None:
-            maybe_link = soup.find('a', text='next')['href']
-            # Make the relative 'SICP' links absolute
-            maybe_link = REL_LINK_BASE + maybe_link
-
-    # Store url if found, replace broken links
-    if maybe_link is not None:
-        next_link = urllib.parse.quote(maybe_link, safe='/:%')
-    else:
-        next_link = ''
+# Spoof the User-Agent, in case Python is a blacklisted agent and receives a
+# 403. (Web search a list of valid user agents, pick one)
+USER_AGENT = ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) '
+              'AppleWebKit/537.36 (KHTML, like Gecko) '
+              'Chrome/59.0.3071.115 Safari/537.36')
 
-#    To work around links that slip detection or are broken,
-#    repeat for each link:
-#    1. duplicate commented explanation and 'if' block below,
-#    2. uncomment it, and
-#    3. insert page of broken link, broken link url, working url.
-#
-#     # Broken URL in The_broken_links_page
-#     if (next_link == 'Broken_link'):
-#        next_link = 'Working_link'
+# Status codes of redirects to follow, and how many in a row
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+MAX_REDIRECTS = 10
 
-    return next_link
 
+def split_run_options(arguments):
+    """Separate run options from serial arguments"""
 
-def get_wanted_content_tags(soup, chap_title_tag, chap_cont_tag):
-    """Get tags that hold headline and wanted content"""
+    run_options = dict(RUN_OPTIONS)
+    serial_arguments = []
 
-    # 'T5D'
-    if WHICH_SERIAL == 'T5D':
-        chap_title_tag = soup.find('h1', {'class': 'entry-title'})
-        chap_cont_tag = soup.find('div', {'class': 'entry-content'})
+    for this_arg in arguments:
+        option_name, has_value, option_value = this_arg[2:].partition('=')
 
-    # 'Unsong'
-    if WHICH_SERIAL == 'Unsong':
-        chap_title_tag = soup.find('h1', {'class': 'pjgm-posttitle'})
-        chap_cont_tag = soup.find('div', {'class': 'pjgm-postcontent'})
+        # Not a run option: leave to serial-specific argument handling
+        if not this_arg.startswith('--') or option_name not in RUN_OPTIONS:
+            serial_arguments.append(this_arg)
+            continue
 
-    # 'SICP'
-    if WHICH_SERIAL == 'SICP':
-        # Get a headline: try first h1, then try h2, then leave None
-        if soup.find('h1') is not None:
-            chap_title_tag = soup.find('h1')
-        elif soup.find('h2') is not None:
-            chap_title_tag = soup.find('h2')
+        # Switches need no value, others are converted to the default's type
+        if isinstance(RUN_OPTIONS[option_name], bool) and not has_value:
+            run_options[option_name] = True
+        elif isinstance(RUN_OPTIONS[option_name], bool):
+            run_options[option_name] = option_value not in ('0', 'no', 'off',
+                                                            'false')
+        else:
+            try:
+                run_options[option_name] = \
+                    type(RUN_OPTIONS[option_name])(option_value)
+            except ValueError:
+                print('\nInvalid value for option \'--' + option_name +
+                      '\': \'' + option_value + '\'\n')
+                sys.exit()
 
-        chap_cont_tag = soup.find('body')
+    return run_options, serial_arguments
 
-    return chap_title_tag, chap_cont_tag
 
+# Upper bounds (seconds) of the buckets that timings are counted in
+METRIC_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                  1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
 
-def check_note(chap_title):
-    """Check if downloaded page is a Notes page"""
+# What each metric means, for the export
+METRIC_HELP = {
+    'request_phase_seconds': 'Time of each phase of the HTTP requests '
+                             '(dns, connect, tls, ttfb, transfer)',
+    'requests_total': 'HTTP requests, by host and response status',
+    'response_bytes_total': 'Bytes of response bodies as sent (compressed)',
+    'stage_seconds': 'Time of each stage of the pages (download, parse, '
+                     'find_next_link, content_tags, declutter, assets, '
+                     'write)',
+    'pages_total': 'Pages processed',
+    'retries_total': 'Downloads tried again, by host and reason',
+    'memo_lookups_total': 'Pages looked up in the memo store, by result',
+    'parser_fallbacks_total': 'Pages parsed again by the lenient parser, '
+                              'no content found',
+    'duplicate_pages_total': 'Pages visited or written before under another '
+                             'url, by reason (redirect, content)',
+}
 
-    is_note = None
 
-    # Check title for Notes page
-    # 'Unsong'
-    if WHICH_SERIAL == 'Unsong':
-        this_re = re.compile(r'^(Author.s Note|Postscript)')
-        is_note = this_re.search(chap_title)
+class Metrics:
+    """Timings (as histograms) and counts of the run, for all serials"""
 
-    return is_note
+    def __init__(self):
+        self.histograms = {}  # (name, labels) -> [bucket counts, sum, max]
+        self.counters = {}    # (name, labels) -> value
+        self.lock = threading.Lock()  # pages may be fetched by several threads
 
+    def observe(self, name, seconds, **labels):
+        """Count a timing in its histogram"""
 
-def declutter_unsong(chap_title_tag, chap_cont_tag):
-    """Remove clutter from Unsong content, convert to strings"""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.setdefault(
+                key, [[0] * (len(METRIC_BUCKETS) + 1), 0.0, 0.0])
+            bucket = 0
+            while bucket < len(METRIC_BUCKETS) and \
+                    seconds > METRIC_BUCKETS[bucket]:
+                bucket += 1
+            histogram[0][bucket] += 1  # last bucket: above all bounds
+            histogram[1] += seconds
+            histogram[2] = max(histogram[2], seconds)
 
-    # Navigation links
-    this_re = re.compile(r'(prev|next)')
-    for i in chap_cont_tag.find_all('a', {'rel': this_re}):
-        i.decompose()
+    def count(self, name, amount=1, **labels):
+        """Add to a counter"""
 
-    # Social web
-    for i in chap_cont_tag.find_all(
-            'div', {'class': 'sharedaddy sd-sharing-enabled'}):
-        i.decompose()
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
 
-    # Tags to html string
-    out_title = str(chap_title_tag)
-    out_chap = str(chap_cont_tag)
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        """Time the block, count it in the histogram"""
 
-    # 'End of Book…' Season's greetings
-    this_re = re.compile(r'(<hr/>\n<p></p><center><b>End of Book [^<]+)'
-                         '<.+(</b></center>)', re.DOTALL
-                         )
-    out_chap = re.sub(this_re, r'\1\2', out_chap)
-
-    # Author's Note announcements
-    this_re = re.compile(  # find by '<hr/>\n<p> …'
-        r'<hr/>\n<p>(<font size="1">|<i>)+.+'
-        '(<a href="https?://unsongbook.com/authors-note-).+'
-        '((</i>|</font>)+</p>|((<br/>\n.?)+</center>))', re.DOTALL
-        )
-    out_chap = re.sub(this_re, '', out_chap)
-
-    this_re = re.compile(  # find by '<p>[ …' ;  '[^C]' b/c '[Content warning:'
-        r'<p>(<font size="1">|<i>)+\[[^C].+'
-        '(<a href="https?://unsongbook.com/authors-note-).+'
-        '((</i>|</font>)+</p>|((<br/>\n.?)+</center>))', re.DOTALL
-        )
-    out_chap = re.sub(this_re, '', out_chap)
-
-    this_re = re.compile(  # find by '<p></p><center>…'
-        r'<p></p><center><br/>\n\.<br/>.+'
-        '(<a href="https?://unsongbook.com/authors-note-).+'
-        '((</i>|</font>)+</p>|((<br/>\n.?)+</center>))', re.DOTALL
-        )
-    out_chap = re.sub(this_re, '', out_chap)
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start_time, **labels)
 
-    # Other announcements; not from Author's Notes
-    this_re = re.compile(r'(<p>Further information will be posted .+ '
-                         r'and with next week’s chapter\]</p>\n)|'
-                         r'(<p>— 2 PM on Sunday April 17 at the CFAR.+ '
-                         r'Stanford, time and exact location tbd</p>\n)|'
-                         r'(<p><i>\[If you like this story, please <a .+'
-                         r'spamming you with it every update\.\]</i></p>)|'
-                         r'(<p><b>Thank you for reading '
-                         r'<i>Unsong</i>\.</b></p>\n)|'
-                         r'(<p>I have a few extra things I need to .+'
-                         r'the box at the top right of the page\.</p>\n)|'
-                         r'(<p>I have gotten some very vague express.+ '
-                         r'thing, subscribe as mentioned above\.</p>\n)|'
-                         r'(<p>Thanks also to everyone who attended .+'
-                         r'ople who live there are very confused\.</p>\n)|'
-                         r'(<p>Most of you probably know this, but I.+'
-                         r'com/r/rational/.>r/rational</a>\.</p>\n)|'
-                         r'(<hr/>\n<p>The final chapter will be posted next .+'
-                         r'on the linked Facebook pages for details\.</p>)|'
-                         r'(<p>There.s a video of me reading the final.+'
-                         r'593197826365/.>here</a> \(thanks Ben.\)</p>\n)',
-                         re.DOTALL
-                         )
-    out_chap = re.sub(this_re, '', out_chap)
-
-    return out_title, out_chap
-
-
-def declutter_t5d(chap_title_tag, chap_cont_tag):
-    """Remove clutter from The Fifth Defiance content, convert to strings"""
+    def as_json(self):
+        """All metrics as a JSON-serializable dict"""
 
-    # Social web
-    chap_cont_tag.find('div',
-                       {'class': 'sharedaddy sd-sharing-enabled'}).decompose()
-    chap_cont_tag.find('div',
-                       {'class': 'sharedaddy sd-block sd-like '
-                                 'jetpack-likes-widget-wrapper '
-                                 'jetpack-likes-widget-unloaded'}).decompose()
+        with self.lock:
+            histograms = {}
+            for ((name, labels), (buckets, total, maximum)) \
+                    in sorted(self.histograms.items()):
+                histograms.setdefault(name, []).append({
+                    'labels': dict(labels),
+                    'count': sum(buckets),
+                    'sum': total,
+                    'max': maximum,
+                    'buckets': {str(upper_bound): count  # not cumulative
+                                for (upper_bound, count)
+                                in zip(METRIC_BUCKETS + ('+Inf',), buckets)
+                                if count}})
+            counters = {}
+            for ((name, labels), value) in sorted(self.counters.items()):
+                counters.setdefault(name, []).append({'labels': dict(labels),
+                                                      'value': value})
 
-    # Tags to html string
-    out_title = str(chap_title_tag)
-    out_chap = str(chap_cont_tag)
+        return {'histograms': histograms, 'counters': counters}
 
-    # Collapse 2 to 4 whitespace after punctuation, non-space entities,
-    # tags that format rendered text
-    this_re = re.compile(r'([,.;:!?&…’”a-zA-Z0-9]|'  # literals
-                         r'(&.{3,10}(?!sp);)|'  # entities not '&…sp;'
-                         r'(</?(b|i|em|del|strong|span)>))'  # tags
-                         r'(\s|&nbsp;){2,4}')
-    out_title = this_re.sub(r'\1 ', out_title)
-    out_chap = this_re.sub(r'\1 ', out_chap)
+    def as_prometheus(self):
+        """All metrics in Prometheus' text exposition format"""
 
-    # Whitespace not before AND after tags that format rendered text
-    this_re = re.compile(r'(\s|&nbsp;)'
-                         r'(</?(b|i|em|del|strong|span)>)'
-                         r'(\s|&nbsp;)')
-    out_title = this_re.sub(r'\2 ', out_title)
-    out_chap = this_re.sub(r'\2 ', out_chap)
+        def label_text(labels, *more_labels):
+            """Labels as '{name="value",…}'"""
+            all_labels = list(labels) + list(more_labels)
+            return '{' + ','.join(
+                name + '="' + str(value).replace('\\', '\\\\')
+                .replace('"', '\\"').replace('\n', '\\n') + '"'
+                for (name, value) in all_labels) + '}'
 
-    # No space after opening quotes
-    this_re = re.compile(r'(‘|“|&l[sd]quo;)(\s|&nbsp;)')
-    out_title = this_re.sub(r'\1', out_title)
-    out_chap = this_re.sub(r'\1', out_chap)
+        lines = []
+        metrics = self.as_json()
+        for (name, series) in metrics['histograms'].items():
+            lines += ['# HELP chapterchainer_' + name + ' ' +
+                      METRIC_HELP.get(name, name),
+                      '# TYPE chapterchainer_' + name + ' histogram']
+            for this_series in series:
+                labels = sorted(this_series['labels'].items())
+                cumulative = 0
+                for upper_bound in METRIC_BUCKETS + ('+Inf',):
+                    cumulative += this_series['buckets'].get(str(upper_bound),
+                                                             0)
+                    lines.append('chapterchainer_' + name + '_bucket' +
+                                 label_text(labels, ('le', upper_bound)) +
+                                 ' ' + str(cumulative))
+                lines += ['chapterchainer_' + name + '_sum' +
+                          label_text(labels) + ' ' + repr(this_series['sum']),
+                          'chapterchainer_' + name + '_count' +
+                          label_text(labels) + ' ' + str(this_series['count'])]
+        for (name, series) in metrics['counters'].items():
+            lines += ['# HELP chapterchainer_' + name + ' ' +
+                      METRIC_HELP.get(name, name),
+                      '# TYPE chapterchainer_' + name + ' counter']
+            for this_series in series:
+                lines.append('chapterchainer_' + name +
+                             label_text(sorted(this_series['labels'].items()))
+                             + ' ' + str(this_series['value']))
 
-    return out_title, out_chap
+        return '\n'.join(lines) + '\n'
 
+    def export(self, metrics_file):
+        """Write all metrics to a file, as JSON if it ends in '.json'"""
 
-def declutter_sicp(chap_cont_tag, next_link):
-    """Remove clutter from SICP content, convert to strings"""
+        with open(metrics_file, 'w', encoding='utf-8') as output:
+            if metrics_file.lower().endswith('.json'):
+                json.dump(self.as_json(), output, indent=1)
+            else:
+                output.write(self.as_prometheus())
 
-    # Navigation links
-    for i in chap_cont_tag.find_all('div', {'class': 'navigation'}):
-        i.decompose()
 
-    # Point relative text links to within output file
-    this_re = re.compile(r'^([^#]*)#(.+)$')
-    for link_tag in chap_cont_tag.find_all('a', href=True):  # <a href…>
-        if not link_tag.get('href').startswith('http'):  # relative
-            link_tag['href'] = this_re.sub(r'#\2', link_tag['href'])
+# Shared by all serials of this process
+METRICS = Metrics()
 
-    # Make relative image sources absolute
-    for link_tag in chap_cont_tag.find_all('img', src=True):  # <img src…>
-        if not link_tag.get('src').startswith('http'):  # relative
-            link_tag['src'] = REL_LINK_BASE + link_tag['src']
 
-    # Tags to html string
-    out_chap = str(chap_cont_tag)
+def start_profiling(kind):
+    """Start profiling the run's time ('cpu') or memory ('memory')"""
 
-    # No …</body><body>… at page borders
-    if next_link != ('https://mitpress.mit.edu/'
-                     'sicp/full-text/book/book.html'):
-        out_chap = out_chap.replace('<body>', '')  # not first: no <body>
-    if next_link != '':
-        out_chap = out_chap.replace('</body>', '')  # not last: no </body>
+    if kind == 'cpu':
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+    if kind == 'memory':
+        tracemalloc.start(10)  # frames per allocation
+        return None
+    if kind:
+        print('\nUnknown profile \'' + kind + '\' (cpu, memory)\n')
+        sys.exit()
+    return None
 
-    return out_chap
 
+def stop_profiling(kind, profiler):
+    """Stop profiling, print the biggest consumers"""
 
-def process_page(next_link, page_count, write_to_file):
-    """Download & process page, repeat until no next link"""
+    if kind == 'cpu':
+        profiler.disable()
+        profiler.dump_stats('ChapterChainer.prof')  # for other viewers
+        print('\nProfile (main thread; all of it in \'ChapterChainer.prof\'):')
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(25)
 
-    chap_title_tag, chap_cont_tag = None, None
-    out_title, out_chap = None, None
-    prev_links = []
+    if kind == 'memory':
+        snapshot = tracemalloc.take_snapshot()
+        (_, peak) = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print('\nMemory: peak {:.1f} MB; biggest allocations still held:'
+              .format(peak / 1024 ** 2))
+        for statistic in snapshot.statistics('lineno')[:25]:
+            print(statistic)
 
-    while next_link != '':
 
-        # Store link of this page for comparison
-        prev_links.append(next_link)
+# Response of an HTTP request: final url (after redirects), status code,
+# headers, and the decoded body as bytes
+HttpResponse = collections.namedtuple('HttpResponse',
+                                      'url status headers body')
 
-        # Set temporary file for downloaded html
-        raw_html_file = PAGE_TITLE + '-' + str(page_count) + '.html'
 
-        # Download page, time of download
-        down_time = download_page(next_link, raw_html_file)
+class ConnectionPool:
+    """Keep-alive HTTP(S) connections to reuse for every fetch, per host"""
 
-        # Start processing time
-        proc_start_time = time.time()
+    def __init__(self, connect_timeout, read_timeout, max_idle_per_host=4):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_idle_per_host = max_idle_per_host
+        self.idle_connections = {}  # (scheme, host:port) -> [connection, …]
+        self.ssl_context = ssl.create_default_context()
+        self.lock = threading.Lock()  # pages may be fetched by several threads
 
-        # Open temporary file with Beautiful Soup to process html
-        soup = bs4.BeautifulSoup(open(raw_html_file, encoding='utf-8'), PARS)
+    def new_connection(self, scheme, netloc):
+        """Open a connection to a host, through a proxy if one is set"""
 
-        # Get url of next chapter, keep last link
-        next_link = find_next_link(soup)
+        # Proxy from the environment, as urllib.request would use it
+        proxy = urllib.request.getproxies().get(scheme)
+        if proxy and urllib.request.proxy_bypass(netloc.split(':')[0]):
+            proxy = None
+        proxy_netloc = urllib.parse.urlsplit(proxy).netloc if proxy else None
 
-        # Get tags holding headline and content
-        (chap_title_tag, chap_cont_tag)\
-            = get_wanted_content_tags(soup, chap_title_tag, chap_cont_tag)
+        if scheme == 'https':
+            connection = http.client.HTTPSConnection(
+                proxy_netloc or netloc, timeout=self.connect_timeout,
+                context=self.ssl_context)
+            if proxy_netloc:
+                connection.set_tunnel(netloc)
+        else:
+            connection = http.client.HTTPConnection(
+                proxy_netloc or netloc, timeout=self.connect_timeout)
+        connection.via_http_proxy = bool(proxy_netloc and scheme == 'http')
 
-        # Get page title and clean some multiple whitespace
-        if chap_title_tag is not None:
-            chap_title = ''.join(chap_title_tag.get_text())
-            this_re = re.compile(r'(\s|&nbsp;)+')
-            chap_title = this_re.sub(r' ', chap_title).strip()
+        # Connect with the connect timeout, then wait for data with the other
+        if proxy_netloc:
+            with METRICS.timer('request_phase_seconds', host=netloc,
+                               phase='connect'):
+                connection.connect()
         else:
-            chap_title = '<No Page Headline>'
+            connection.sock = self.open_socket(connection.host,
+                                               connection.port, netloc)
+            if scheme == 'https':
+                with METRICS.timer('request_phase_seconds', host=netloc,
+                                   phase='tls'):
+                    connection.sock = self.ssl_context.wrap_socket(
+                        connection.sock, server_hostname=connection.host)
+        connection.sock.settimeout(self.read_timeout)
 
-        # Check if Notes page
-        if WHICH_SERIAL == 'Unsong':
-            is_note = check_note(chap_title)  # is_note = False
+        return connection
 
-        # Increment Chapter count
-        page_count += 1
+    def open_socket(self, host, port, netloc):
+        """Look up the host and connect to it, timing both"""
 
-        # If Notes page to omit: skip processing and appending to output
-        if GET_NOTES == 'omit' and is_note:
+        with METRICS.timer('request_phase_seconds', host=netloc, phase='dns'):
+            addresses = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
 
-            # Delete chapter file
-            os.remove(raw_html_file)
+        # First address that takes the connection, as http.client would
+        with METRICS.timer('request_phase_seconds', host=netloc,
+                           phase='connect'):
+            connect_error = OSError('No address for \'' + host + '\'')
+            for (family, sock_type, protocol, _, address) in addresses:
+                sock = socket.socket(family, sock_type, protocol)
+                try:
+                    sock.settimeout(self.connect_timeout)
+                    sock.connect(address)
+                except OSError as this_exception:
+                    sock.close()
+                    connect_error = this_exception
+                    continue
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                return sock
 
-            # User feedback, incl. processing time
-            trunc_title = ('<Skipping> ' + chap_title[:33] +
-                           (chap_title[33:] and '…')  # 'and', not '+' ==> bool
-                           )
-            print('{: >5}   {: <45}   {:.5} sec.   {:.5} sec.'
-                  .format(page_count, trunc_title[:45], str(down_time),
-                          str(time.time() - proc_start_time)
-                          )
-                  )
+        raise connect_error
+
+    def get_connection(self, scheme, netloc):
+        """Take an idle connection to a host, or open a new one"""
+
+        with self.lock:
+            idle = self.idle_connections.get((scheme, netloc))
+            if idle:
+                return idle.pop(), True  # reused
+        return self.new_connection(scheme, netloc), False
+
+    def put_connection(self, scheme, netloc, connection):
+        """Keep a connection for the next request to its host"""
+
+        with self.lock:
+            idle = self.idle_connections.setdefault((scheme, netloc), [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        """Close all idle connections"""
+
+        with self.lock:
+            for idle in self.idle_connections.values():
+                for connection in idle:
+                    connection.close()
+            self.idle_connections.clear()
+
+    def request_once(self, url, headers):
+        """GET a url without following redirects"""
 
+        split_url = urllib.parse.urlsplit(url)
+        scheme, netloc = split_url.scheme.lower(), split_url.netloc
+        if scheme not in ('http', 'https'):
+            raise ValueError('Unsupported URL scheme: \'' + url + '\'')
+        path = (split_url.path or '/') + \
+            ('?' + split_url.query if split_url.query else '')
+
+        def send(connection):
+            """Request on the connection, time first byte and transfer"""
+            start_time = time.perf_counter()
+            connection.request('GET', url if connection.via_http_proxy
+                               else path, headers=headers)
+            response = connection.getresponse()
+            headers_time = time.perf_counter()
+            body = response.read()
+            METRICS.observe('request_phase_seconds', headers_time - start_time,
+                            host=netloc, phase='ttfb')
+            METRICS.observe('request_phase_seconds',
+                            time.perf_counter() - headers_time,
+                            host=netloc, phase='transfer')
+            return response, body
+
+        connection, reused = self.get_connection(scheme, netloc)
+        try:
+            response, body = send(connection)
+        except (http.client.RemoteDisconnected, ConnectionError,
+                http.client.BadStatusLine):
+            connection.close()
+            if not reused:
+                raise
+            # The server closed the idle connection meanwhile: once more anew
+            connection = self.new_connection(scheme, netloc)
+            try:
+                response, body = send(connection)
+            except BaseException:
+                connection.close()  # not left open if that fails, too
+                raise
+        except BaseException:
+            connection.close()
+            raise
+
+        METRICS.count('requests_total', host=netloc, status=response.status)
+        METRICS.count('response_bytes_total', len(body), host=netloc)
+
+        # Keep connection open for the next page, unless the server closes it
+        if response.will_close:
+            connection.close()
         else:
-            # Process page content, one def per html style
-            if WHICH_SERIAL == 'Unsong':
-                # Remove clutter
-                (out_title, out_chap) = declutter_unsong(chap_title_tag,
-                                                         chap_cont_tag)
-
-                # Write to story or notes file?
-                if GET_NOTES == 'append' and is_note:
-                    write_to_file = NOTES_FILE
-                else:
-                    write_to_file = PAGES_FILE
+            self.put_connection(scheme, netloc, connection)
 
-            if WHICH_SERIAL == 'T5D':
-                # Remove clutter
-                (out_title, out_chap) = declutter_t5d(chap_title_tag,
-                                                      chap_cont_tag)
+        return HttpResponse(url, response.status, response.headers,
+                            decode_body(body, response.headers))
 
-            if WHICH_SERIAL == 'SICP':
-                # Remove clutter
-                out_chap = declutter_sicp(chap_cont_tag, next_link)
+    def request(self, url, headers=None):
+        """GET a url, follow redirects, return the final response"""
 
-            # Append chapter title and content strings to story or notes file
-            with open(write_to_file, 'a', encoding='UTF8') as output:
-                if TITLE_SEPARATE:
-                    output.write(out_title)
-                output.write(out_chap + '<p>&nbsp;</p>\n')  # Add blank line
+        request_headers = {'User-Agent': USER_AGENT,
+                           'Accept-Encoding': 'gzip, deflate',
+                           'Connection': 'keep-alive'}
+        request_headers.update(headers or {})
 
-            # Delete chapter file
-            os.remove(raw_html_file)
+        for _ in range(MAX_REDIRECTS + 1):
+            response = self.request_once(url, request_headers)
+            location = response.headers.get('Location')
+            if response.status not in REDIRECT_CODES or not location:
+                return response
+            url = urllib.parse.urljoin(url, location)
 
-            # User feedback, incl. processing time
-            trunc_title = (chap_title[:44] + (chap_title[44:] and '…'))
-            print('{: >5}   {: <45}   {:.5} sec.   {:.5} sec.'
-                  .format(page_count, trunc_title[:45], str(down_time),
-                          str(time.time() - proc_start_time))
-                  )
+        raise http.client.HTTPException('Too many redirects: \'' + url + '\'')
 
-        # if (page_count >= 4): next_link = ''  # Sample for testing
 
-        # Don't follow to epilogue, afterword, author's blog, next story, etc.
-        if WHICH_SERIAL in ():
-            if next_link in []:
-                next_link = ''
+def decode_body(body, headers):
+    """Undo gzip or deflate content encoding of a response body"""
 
-        # No circling back to visited pages
-        if next_link in prev_links:
-            next_link = ''
+    content_encoding = headers.get('Content-Encoding', '').lower()
 
-        time.sleep(WAIT_BETWEEN_REQUESTS)
+    if content_encoding in ('gzip', 'x-gzip'):
+        return zlib.decompress(body, 16 + zlib.MAX_WBITS)
+    if content_encoding == 'deflate':
+        try:  # zlib-wrapped, as it should be
+            return zlib.decompress(body)
+        except zlib.error:  # raw deflate, as some servers send it
+            return zlib.decompress(body, -zlib.MAX_WBITS)
 
+    return body
 
-def start_end_serial_download():
-    """Prepare download, call downloading & processing, complete page"""
 
-    # User feedback headline
-    print('Downloading \'' + PAGE_TITLE + '\' to file \'' + PAGES_FILE +
-          '\'...\nCount   Page Title' + ' ' * 37 + 'Downloading   Processing'
-          )
+# Shared by all fetches of this process, created on first use
+HTTP_POOL = None
+HTTP_POOL_LOCK = threading.Lock()
 
-    # Files to write; remove existing files
-    if os.path.isfile(PAGES_FILE):
-        os.remove(PAGES_FILE)
 
-    if GET_NOTES == 'append':
-        if os.path.isfile(NOTES_FILE):
-            os.remove(NOTES_FILE)
+def http_pool():
+    """Return the connection pool, create it with the run options' timeouts"""
 
-    # Output file to append content
-    write_to_file = PAGES_FILE
+    global HTTP_POOL
 
-    # Write html opening
-    with open(PAGES_FILE, 'a', encoding='UTF8') as output:
-        output.write('<html>\n<head>\n<title>' + PAGE_TITLE +
-                     '</title>\n<meta content=\'text/html; charset=UTF-8\' '
-                     'http-equiv=\'Content-Type\'>\n</head>\n<body>\n')
+    with HTTP_POOL_LOCK:
+        if HTTP_POOL is None:
+            HTTP_POOL = ConnectionPool(RUN_OPTIONS['connect-timeout'],
+                                       RUN_OPTIONS['read-timeout'])
+    return HTTP_POOL
 
-    # Call download loop, beginning with first page
-    process_page(FIRST_LINK, 0, write_to_file)  # initialize page_count
 
-    # Append Notes and closing
-    with open(PAGES_FILE, 'a', encoding='UTF8') as output:
+# Pages used (read from the cache) before their index entries are
+# updated, all at once; share of the size limit a full cache is cut down
+# to, so that it isn't compacted again with the next page stored
+CACHE_TOUCH_BATCH = 64
+CACHE_EVICT_TO = 0.75
 
-        # Append Notes if exist
-        if GET_NOTES == 'append' and os.path.isfile(NOTES_FILE):
-            proc_time = time.time()  # Start processing time for appending
-            for this_line in open(NOTES_FILE):  # only 1 line in memory
-                output.write(this_line)
-            # Delete chapter file
-            os.remove(NOTES_FILE)
-            # User feedback
-            print(('{: >5}   {: <45}' + ' ' * 16 + '{:.5} sec.')
-                  .format('—', '<Appending Notes to story>'[:45],
-                          str(time.time() - proc_time)
-                          )
-                  )
 
-        # HTML closing
-        output.write('\n</body>\n</html>')
+class PageCache:
+    """Raw pages on disk: content-addressed pack file plus url index"""
 
-    # User feedback
-    print('Serial \'' + PAGE_TITLE + '\' complete?\n'
-          'Could not find a link to a \'Next\'/\'Next Chapter\' page, '
-          'or stopped because link pointed to known non-story page (epilogue, '
-          'afterword, author\'s blog, another story, sequel, …).\n'
-          'Total time: {:.5} sec.'
-          .format(time.time() - START_TIME) + '\n'  # total time
-          )
+    # Files in the cache directory
+    pack_name = 'pages.pack'
+    index_name = 'index.jsonl'
 
+    def __init__(self, directory, max_bytes):
+        self.max_bytes = max_bytes
+        self.pack_file = os.path.join(directory, self.pack_name)
+        self.index_file = os.path.join(directory, self.index_name)
+        self.blobs = {}    # sha256 of body -> (offset, length) in pack file
+        self.entries = {}  # url -> {'sha', 'type', 'etag', 'modified', 'used'}
+        self.touched = set()  # urls used since their entries were logged
+        self.lock = threading.Lock()  # pages may be fetched by several threads
 
-if __name__ == '__main__':
-    """Set serial-specific parameters, initialize variables."""
+        os.makedirs(directory, exist_ok=True)
+        open(self.pack_file, 'ab').close()  # create if missing
 
-    """
-    For a new serial download source:
-    1. Add another 'elif'-block and set parameters:
-     sys.argv[1]       Command line argument that determines serial to download
-     GET_NOTES         Options for some serials
-     PAGES_FILE        File name of resulting HTML file
-     FIRST_LINK        URL of serial's first page
-     REL_LINK_BASE     Path prefix to convert relative to absolute links
-     TITLE_SEPARATE    Set to False if title and chapter are in the same tag
-     WAIT_BETWEEN_REQUESTS      Time in seconds to wait between page downloads
-     PARS              Parser used to find links, headlines, content
-                       Available parsers, select one that works well:
-                       • 'lxml' (fastest, lenient)
-                       • 'html.parser' (decent speed, lenient, Python built-in)
-                       • 'html5lib' (very slow, extremely lenient, parses pages
-                                  like a web browser does, creates valid HTML5)
+        # Index is a log of url entries; the last entry of a url is valid
+        with open(self.index_file, 'a+', encoding='utf-8') as index:
+            index.seek(0)
+            for this_line in index:
+                try:
+                    entry = json.loads(this_line)
+                except ValueError:  # cut off by a crash while writing
+                    continue
+                self.blobs[entry['sha']] = (entry['offset'], entry['length'])
+                self.entries[entry.pop('url')] = entry
 
-    2. Set other parameters in the if-branches in the script above:
-     In find_next_link(), if required:
-         A soup.find()     What defines a link to the next page
-     In get_wanted_content_tags(), if required:
-         chap_title_tag    What defines the tag holding the page headline
-         chap_cont_tag     What defines the tag holding the page content
-     Add a declutter_XXXXX(),
-         For any unwanted clutter to decompose and delete
+        self.pack = open(self.pack_file, 'r+b')
+        self.pack_map = None
+        self.index = open(self.index_file, 'a', encoding='utf-8')
 
-    3. Add argument to all appropriate '(WHICH_SERIAL [in | ==]' conditions
-    """
+        # Drop what exceeds the size limit from earlier runs
+        self.evict()
+
+    def index_line(self, url):
+        """Line of the index with the entry of a url"""
+
+        entry = dict(self.entries[url], url=url)
+        entry['offset'], entry['length'] = self.blobs[entry['sha']]
+        return json.dumps(entry) + '\n'
+
+    def log_entry(self, url):
+        """Append the entry of a url to the index"""
+
+        self.touched.discard(url)
+        self.index.write(self.index_line(url))
+        self.index.flush()
+
+    def log_touched(self):
+        """Append the entries of the urls used since, in one write"""
+
+        if not self.touched:
+            return
+        self.index.write(''.join(self.index_line(url) for url in self.touched
+                                 if url in self.entries))
+        self.index.flush()
+        self.touched.clear()
+
+    def validators(self, url):
+        """Headers for a conditional request of a cached page"""
+
+        with self.lock:
+            entry = self.entries.get(url)
+            if entry is None:
+                return {}
+            headers = {}
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry['modified']:
+                headers['If-Modified-Since'] = entry['modified']
+            return headers
+
+    def get(self, url):
+        """Return the cached body and content type of a url, or None"""
+
+        with self.lock:
+            entry = self.entries.get(url)
+            if entry is None:
+                return None
+            offset, length = self.blobs[entry['sha']]
+
+            # Map the pack file anew if it has grown since it was mapped
+            if self.pack_map is None or offset + length > len(self.pack_map):
+                if self.pack_map is not None:
+                    self.pack_map.close()
+                self.pack.flush()
+                self.pack_map = mmap.mmap(self.pack.fileno(), 0,
+                                          access=mmap.ACCESS_READ)
+
+            # Most recently used; noted in the index with others later
+            entry['used'] = time.time()
+            self.touched.add(url)
+            if len(self.touched) >= CACHE_TOUCH_BATCH:
+                self.log_touched()
+
+            return self.pack_map[offset:offset + length], entry.get('type')
+
+    def put(self, url, response):
+        """Store the body and validators of a response"""
+
+        self.store(url, response.body,
+                   {'type': response.headers.get('Content-Type'),
+                    'etag': response.headers.get('ETag'),
+                    'modified': response.headers.get('Last-Modified')})
+
+    def store(self, url, body, details):
+        """Store a body under a url, with details for its index entry"""
+
+        sha = hashlib.sha256(body).hexdigest()
+
+        with self.lock:
+            # Same content under any url is stored only once
+            pack_size = 0
+            if sha not in self.blobs:
+                self.pack.seek(0, os.SEEK_END)
+                self.blobs[sha] = (self.pack.tell(), len(body))
+                self.pack.write(body)
+                self.pack.flush()
+                pack_size = self.pack.tell()
+
+            self.entries[url] = dict(details, sha=sha, used=time.time())
+            self.log_entry(url)
+
+        # Grown beyond the size limit: drop least recently used pages now
+        if pack_size > self.max_bytes:
+            self.evict(self.max_bytes * CACHE_EVICT_TO)
+
+    def evict(self, keep_bytes=None):
+        """Drop least recently used pages beyond the size limit (or as
+        many as to keep keep_bytes), compact"""
+
+        if keep_bytes is None:
+            keep_bytes = self.max_bytes
+
+        with self.lock:
+            self.log_touched()
+            pack_size = os.path.getsize(self.pack_file)
+            index_size = os.path.getsize(self.index_file)
+            live_size = sum(self.blobs[sha][1] for sha in
+                            {entry['sha'] for entry in self.entries.values()})
+
+            # Nothing to drop, little to reclaim
+            if pack_size <= self.max_bytes and \
+                    index_size <= 1024 * 1024 + 256 * len(self.entries):
+                return
+
+            # Least recently used first, until the rest fits
+            for url in sorted(self.entries,
+                              key=lambda this_url:
+                              self.entries[this_url]['used']):
+                if live_size <= keep_bytes:
+                    break
+                sha = self.entries.pop(url)['sha']
+                if all(entry['sha'] != sha
+                       for entry in self.entries.values()):
+                    live_size -= self.blobs[sha][1]
+
+            # Copy the remaining pages to a new pack file and index
+            if self.pack_map is not None:
+                self.pack_map.close()
+                self.pack_map = None
+            old_blobs, self.blobs = self.blobs, {}
+            with open(self.pack_file + '.new', 'wb') as new_pack:
+                for entry in self.entries.values():
+                    if entry['sha'] in self.blobs:
+                        continue
+                    offset, length = old_blobs[entry['sha']]
+                    self.pack.seek(offset)
+                    self.blobs[entry['sha']] = (new_pack.tell(), length)
+                    new_pack.write(self.pack.read(length))
+            self.pack.close()
+            self.index.close()
+            with open(self.index_file + '.new', 'w',
+                      encoding='utf-8') as self.index:
+                for url in self.entries:
+                    self.log_entry(url)
+            os.replace(self.pack_file + '.new', self.pack_file)
+            os.replace(self.index_file + '.new', self.index_file)
+            self.pack = open(self.pack_file, 'r+b')
+            self.index = open(self.index_file, 'a', encoding='utf-8')
+
+    def close(self):
+        """Apply the size limit, close the files"""
+
+        self.evict()
+        with self.lock:
+            if self.pack_map is not None:
+                self.pack_map.close()
+                self.pack_map = None
+            self.pack.close()
+            self.index.close()
+
+
+class MemoStore(PageCache):
+    """Results of rendering pages, by page content and how it's rendered"""
+
+    # Files in the cache directory, next to the pages'
+    pack_name = 'memo.pack'
+    index_name = 'memo.jsonl'
+
+    def recall(self, key):
+        """Return the results stored under a key, or None"""
+
+        stored = self.get(key)
+        if stored is None:
+            return None
+        return json.loads(bytes(stored[0]).decode('utf-8'))
+
+    def remember(self, key, results):
+        """Store results under a key"""
+
+        self.store(key, json.dumps(results).encode('utf-8'), {})
+
+
+# Shared by all fetches of this process, opened on first use
+PAGE_CACHE = None
+MEMO_STORE = None
+
+
+def page_cache():
+    """Return the page cache of the run options, or None if not cached"""
+
+    global PAGE_CACHE
+
+    with HTTP_POOL_LOCK:
+        if PAGE_CACHE is None and RUN_OPTIONS['cache']:
+            PAGE_CACHE = PageCache(RUN_OPTIONS['cache'],
+                                   RUN_OPTIONS['cache-size'] * 1024 * 1024)
+    return PAGE_CACHE
+
+
+def memo_store():
+    """Return the memo store next to the page cache, or None if not kept"""
+
+    global MEMO_STORE
+
+    with HTTP_POOL_LOCK:
+        if MEMO_STORE is None and RUN_OPTIONS['cache'] and \
+                RUN_OPTIONS['memo-size'] > 0:
+            MEMO_STORE = MemoStore(RUN_OPTIONS['cache'],
+                                   RUN_OPTIONS['memo-size'] * 1024 * 1024)
+    return MEMO_STORE
+
+
+def close_shared():
+    """Done with the connections and the cache: close them (the size
+    limits applied); opened anew if used again"""
+
+    global PAGE_CACHE, MEMO_STORE
+
+    http_pool().close()
+    with HTTP_POOL_LOCK:
+        (caches, PAGE_CACHE, MEMO_STORE) = ((PAGE_CACHE, MEMO_STORE),
+                                            None, None)
+    for cache in caches:
+        if cache is not None:
+            cache.close()
 
-    # 'SICP' (Structure and Interpretation of Computer Programs)
-    if len(sys.argv) > 1 and sys.argv[1] == 'SICP':
-        PAGE_TITLE = 'Structure and Interpretation of Computer Programs'
-        PAGES_FILE = 'StructInterprCompProg.html'
-        FIRST_LINK = 'https://mitpress.mit.edu/sites/default/files/' \
-                     'sicp/full-text/book/book.html'
-        REL_LINK_BASE = 'https://mitpress.mit.edu/sites/default/files/' \
-                        'sicp/full-text/book/'
-        TITLE_SEPARATE = False  # header and chapter are the same tag
-        PARS = 'html5lib'  # the others don't handle this html style well
-
-    # 'T5D'
-    elif len(sys.argv) > 1 and sys.argv[1] == 'T5D':
-        PAGE_TITLE = 'The Fifth Defiance'
-        FIRST_LINK = 'https://thefifthdefiance.com/2015/11/02/introduction/'
-        PARS = 'lxml'
-
-    # 'Unsong'
-    elif len(sys.argv) > 1 and sys.argv[1] == 'Unsong':
-        PAGE_TITLE = 'Unsong'
-        FIRST_LINK = 'https://unsongbook.com/prologue-2/'
-        PARS = 'lxml'
-        GET_NOTES = 'chrono'  # Default: chronological order w/story pages
-        if len(sys.argv) > 2 and not str.startswith(sys.argv[2], 'http'):
-            if sys.argv[2] == '--omit' or sys.argv[2] is None:
-                GET_NOTES = 'omit'  # None
-                PAGES_FILE = PAGE_TITLE + '-Notes_omitted.html'
-            if sys.argv[2] == '--append':
-                GET_NOTES = 'append'  # Copy after story end
-                PAGES_FILE = PAGE_TITLE + '-Notes_appended.html'
-            if sys.argv[2] in ('--chronological', '--chrono'):
-                GET_NOTES = 'chrono'
-                PAGES_FILE = PAGE_TITLE + '-Notes_chronological.html'
+
+def fetch_url(url):
+    """GET a url, revalidate with and update the page cache, if any"""
+
+    cache = page_cache()
+
+    # Not cached: plain request
+    if cache is None:
+        return http_pool().request(url)
+
+    # Cached: ask the server whether it has changed
+    response = http_pool().request(url, cache.validators(url))
+
+    if response.status == 304:  # Not Modified
+        cached = cache.get(url)
+        if cached is not None:
+            (cached_body, content_type) = cached
+            if content_type and 'Content-Type' not in response.headers:
+                response.headers['Content-Type'] = content_type
+            return response._replace(status=200, body=cached_body)
+        response = http_pool().request(url)  # evicted meanwhile
+
+    if response.status == 200:
+        cache.put(url, response)
+
+    return response
+
+
+# Failed downloads worth trying again: server busy or down for a moment,
+# any 5xx (also a CDN's 520-524) but 501 and 505 (not supported at all)
+RETRY_STATUS_CODES = frozenset([429] + [status for status in range(500, 600)
+                                        if status not in (501, 505)])
+
+# Longest wait (seconds) between tries of a page; longest a server may ask
+# to wait (Retry-After) before the download stops instead
+RETRY_MAX_WAIT = 60.0
+RETRY_AFTER_LIMIT = 600.0
+
+
+# Pace of requests to a host that answers slowly or with errors: first
+# time between requests (seconds) when slowing down, and how much slower
+# than usual a response is slow
+PACE_MIN_STEP = 0.25
+PACE_SLOW_FACTOR = 3.0
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (seconds or date), or None"""
+
+    if not value:
+        return None
+    if value.strip().isdigit():
+        return float(value.strip())
+    try:
+        retry_time = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_time is None:
+        return None
+    return max(0.0, retry_time.timestamp() - time.time())
+
+
+class HostScheduler:
+    """Pace the requests to each host as fast as it takes them"""
+
+    def __init__(self):
+        self.paces = {}  # host -> 'interval', 'next_time', 'latency'
+        self.crawl_delays = {}  # host -> seconds, from its robots.txt
+        self.lock = threading.Lock()
+        self.robots_lock = threading.Lock()  # for robots_locks
+        self.robots_locks = {}  # host -> lock while its robots.txt is read
+
+    def crawl_delay(self, url):
+        """Crawl-delay in the robots.txt of the url's host, read once"""
+
+        split_url = urllib.parse.urlsplit(url)
+        host = split_url.netloc.lower()
+
+        # One lock per host: a slow robots.txt holds up only its own host
+        with self.robots_lock:
+            host_lock = self.robots_locks.setdefault(host, threading.Lock())
+        with host_lock:
+            if host not in self.crawl_delays:
+                self.crawl_delays[host] = (self.read_crawl_delay(split_url)
+                                           if RUN_OPTIONS['robots'] else 0.0)
+            return self.crawl_delays[host]
+
+    @staticmethod
+    def read_crawl_delay(split_url):
+        """Download and read the robots.txt of a host for its Crawl-delay
+        (or Request-rate), 0 if none"""
+
+        crawl_delay = 0.0
+        try:
+            response = http_pool().request(
+                split_url.scheme + '://' + split_url.netloc + '/robots.txt')
+            if response.status == 200:
+                robots = urllib.robotparser.RobotFileParser()
+                robots.parse(response.body.decode(
+                    'utf-8', 'replace').splitlines())
+                robots.modified()  # counts as read
+                crawl_delay = float(robots.crawl_delay(USER_AGENT) or 0)
+                request_rate = robots.request_rate(USER_AGENT)
+                if request_rate and request_rate.requests:
+                    crawl_delay = max(crawl_delay, request_rate.seconds /
+                                      request_rate.requests)
+        except (OSError, http.client.HTTPException, ValueError):
+            pass  # no robots.txt to be had: no crawl delay
+        return crawl_delay
+
+    def pace(self, host, least_interval):
+        """Pace of requests to a host (with the lock held)"""
+
+        pace = self.paces.setdefault(host, {'interval': least_interval,
+                                            'next_time': 0.0,
+                                            'latency': None})
+        pace['interval'] = max(pace['interval'], least_interval)
+        return pace
+
+    def wait_turn(self, url, delay):
+        """Wait until a request to the url's host is due, book the next"""
+
+        host = urllib.parse.urlsplit(url).netloc.lower()
+        least_interval = max(delay, self.crawl_delay(url))
+        with self.lock:
+            pace = self.pace(host, least_interval)
+            now = time.time()
+            request_time = max(now, pace['next_time'])
+            pace['next_time'] = request_time + pace['interval']
+
+        # Time spent on the request counts toward the interval
+        time.sleep(request_time - now)
+
+    def feedback(self, url, delay, seconds, status, retry_after=None):
+        """Slow down for a host that struggles, speed up again when not"""
+
+        host = urllib.parse.urlsplit(url).netloc.lower()
+        least_interval = max(delay, self.crawl_delays.get(host, 0.0))
+        with self.lock:
+            pace = self.pace(host, least_interval)
+
+            # No request before the time the server asks for
+            if retry_after is not None:
+                pace['next_time'] = max(pace['next_time'],
+                                        time.time() + retry_after)
+
+            # Error or much slower response than usual: half the rate
+            if status is None or status in RETRY_STATUS_CODES or \
+                    (pace['latency'] is not None and
+                     seconds > PACE_SLOW_FACTOR * pace['latency']):
+                pace['interval'] = min(RETRY_MAX_WAIT,
+                                       max(PACE_MIN_STEP,
+                                           2 * pace['interval']))
+
+            # Fine: a quarter faster, down to the least interval
+            else:
+                faster = pace['interval'] * 0.75
+                pace['interval'] = max(least_interval, faster
+                                       if faster >= PACE_MIN_STEP else 0.0)
+
+            # Usual response time, of the answers that came
+            if status is not None:
+                pace['latency'] = seconds if pace['latency'] is None \
+                    else 0.8 * pace['latency'] + 0.2 * seconds
+
+
+# Shared by all serials of this process
+HOST_SCHEDULER = HostScheduler()
+
+
+class DownloadStopped(Exception):
+    """A page could not be downloaded, the download stops there"""
+
+
+class RetryBudget:
+    """Tries again left for the run, shared by all pages and serials"""
+
+    def __init__(self):
+        self.used = 0
+        self.lock = threading.Lock()
+
+    def take(self):
+        """Use up one try again, if any left"""
+
+        with self.lock:
+            if self.used >= RUN_OPTIONS['retry-budget']:
+                return False
+            self.used += 1
+            return True
+
+
+# Shared by all serials of this process
+RETRY_BUDGET = RetryBudget()
+
+
+def download_page(next_link, delay=0, missing_ok=False):
+    """Download page, retry passing errors; return response, download time"""
+
+    tries = 0
+    while True:
+        # Politeness: time since the last request to the same host
+        HOST_SCHEDULER.wait_turn(next_link, delay)
+
+        # Timing
+        down_start_time = time.time()  # Start download time
+
+        # Retrieve html into memory; connection errors and timeouts may pass
+        # (OSError), as may a busy server's status
+        (response, failure) = (None, None)
+        try:
+            response = fetch_url(next_link)
+        except ssl.SSLCertVerificationError as this_exception:  # no passing
+            raise DownloadStopped(str(this_exception))
+        except (OSError, http.client.HTTPException) as this_exception:
+            failure = type(this_exception).__name__ + ': ' + \
+                str(this_exception)
+        except ValueError as this_exception:  # e.g. not a web address
+            raise DownloadStopped(str(this_exception))
+        down_time = time.time() - down_start_time
+
+        # Pace of the host from how it answered, and when it wants us back
+        retry_after = None
+        if response is not None and response.status in (429, 503):
+            retry_after = parse_retry_after(
+                response.headers.get('Retry-After'))
+        HOST_SCHEDULER.feedback(next_link, delay, down_time,
+                                None if response is None else response.status,
+                                retry_after)
+
+        if response is not None:
+            if response.status in RETRY_STATUS_CODES:
+                failure = 'HTTP Error ' + str(response.status)
+            elif response.status == 404 and missing_ok:
+                return response, down_time  # for the caller to handle
+            elif response.status >= 400:
+                raise DownloadStopped('HTTP Error ' + str(response.status) +
+                                      ' (not tried again)')
+
+        if failure is None:
+            return response, down_time  # Download time
+
+        # Give up when out of tries for the page or the run
+        tries += 1
+        if tries > RUN_OPTIONS['retries'] or not RETRY_BUDGET.take():
+            raise DownloadStopped(failure + ' (tried ' + str(tries) +
+                                  ' times)')
+        METRICS.count('retries_total',
+                      host=urllib.parse.urlsplit(next_link).netloc,
+                      reason=failure.split(':')[0])
+
+        # Back off: as long as the server asks (the host's turn waits for
+        # it), or up to twice as long each time, at random so that parallel
+        # downloads don't come back all at once
+        if retry_after is not None:
+            if retry_after > RETRY_AFTER_LIMIT:
+                raise DownloadStopped(failure + ', to try again in ' +
+                                      str(int(retry_after)) + ' sec.')
+            (wait, back_in) = (0.0, retry_after)
         else:
-            print('\nDefaulting to --chronological\n')
-            GET_NOTES = 'chrono'
-            PAGES_FILE = PAGE_TITLE + '-Notes_chronological.html'
+            wait = random.uniform(0, min(RETRY_MAX_WAIT,
+                                         RUN_OPTIONS['backoff'] *
+                                         2 ** (tries - 1)))
+            back_in = wait
+        print('{} – trying again in {:.1f} sec.: \'{}\''
+              .format(failure, back_in, next_link), file=sys.stderr)
+        time.sleep(wait)
 
-    # Any URL (no stated serial, thus none of preset decluttering)
-    # only accept http
-    elif len(sys.argv) > 1 and str.startswith(sys.argv[1], 'http'):
-        timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
-        PAGE_TITLE = 'Serial'
-        PAGES_FILE = 'Serial Downloaded ' + timestamp + '.html'
-        FIRST_LINK = sys.argv[1]  # start with the given URL
-        PARS = 'lxml'
-        print('\nIt is unlikely that ChapterChainer is already configured '
-              'to download the serial from this URL.\n'
-              'Please adapt the source code if the result of this run '
-              'is not satisfying.\n\n')
 
-    # No valid arguments
+def url_shape(url):
+    """Host and path of a url, numbers in its folders generalized"""
+
+    split_url = urllib.parse.urlsplit(url)
+    folders = split_url.path.strip('/').split('/')[:-1]
+    return (split_url.netloc.lower(),
+            tuple(re.sub(r'\d+', '#', folder) for folder in folders))
+
+
+def predict_by_number(page_link, next_link, count):
+    """Continue the step of the one number that changed between two urls"""
+
+    # 'book-Z-H-7.html' -> 'book-Z-H-8.html': 'book-Z-H-9.html', …
+    page_parts = re.split(r'(\d+)', page_link)
+    next_parts = re.split(r'(\d+)', next_link)
+    if len(page_parts) != len(next_parts):
+        return []
+    changed = [i for i in range(1, len(next_parts), 2)  # numbers only
+               if page_parts[i] != next_parts[i]]
+    if len(changed) != 1 or \
+            any(page_parts[i] != next_parts[i]
+                for i in range(0, len(next_parts), 2)):  # text unchanged
+        return []
+
+    number_at = changed[0]
+    step = int(next_parts[number_at]) - int(page_parts[number_at])
+    if step <= 0:
+        return []
+
+    guesses = []
+    for i in range(1, count + 1):
+        guessed_parts = list(next_parts)
+        guessed_parts[number_at] = str(int(next_parts[number_at]) + i * step)\
+            .zfill(len(next_parts[number_at]))  # keep leading zeros
+        guesses.append(''.join(guessed_parts))
+
+    return guesses
+
+
+class Prefetcher:
+    """Guess the urls of the next pages and download them ahead"""
+
+    def __init__(self, window, host_connections, delay, engine):
+        self.window = window  # pages to download ahead
+        self.host_connections = host_connections
+        self.delay = delay  # seconds between requests to a host
+        self.engine = engine  # the pages' parse engine, for their links
+        self.host_slots = {}  # host -> semaphore limiting its connections
+        self.slots_lock = threading.Lock()
+        self.executor = concurrent.futures.ThreadPoolExecutor(window)
+        self.guesses = collections.OrderedDict()  # url -> future, in order
+        self.seen_links = set()  # links of the chain's shape, from all pages
+
+    def host_slot(self, url):
+        """Semaphore limiting the downloads from the url's host"""
+
+        host = urllib.parse.urlsplit(url).netloc.lower()
+        with self.slots_lock:
+            if host not in self.host_slots:
+                self.host_slots[host] = \
+                    threading.BoundedSemaphore(self.host_connections)
+            return self.host_slots[host]
+
+    def fetch_guess(self, url):
+        """Download a guessed page; None if that fails"""
+
+        with self.host_slot(url):
+            HOST_SCHEDULER.wait_turn(url, self.delay)
+            down_start_time = time.time()
+            try:
+                response = fetch_url(url)
+            except Exception:  # wrong guess, or fails again when confirmed
+                response = None
+
+            # Guesses count for the host's pace, too
+            HOST_SCHEDULER.feedback(url, self.delay,
+                                    time.time() - down_start_time,
+                                    None if response is None
+                                    else response.status)
+            return response
+
+    def download(self, next_link):
+        """Download page or take it from the guesses, as download_page()"""
+
+        down_start_time = time.time()
+
+        # Guessed right: wait for the download, if still running
+        future = self.guesses.pop(next_link, None)
+        if future is not None:
+            response = future.result()
+            if response is not None and response.status < 400:
+                return response, time.time() - down_start_time
+
+        # Guessed wrong or failed: download in order
+        with self.host_slot(next_link):
+            return download_page(next_link, self.delay)
+
+    def predict(self, page_link, next_link, page, visited):
+        """Guess pages after the confirmed next link, drop wrong guesses"""
+
+        guesses = []
+        if next_link != '':
+
+            # Next page itself is certain
+            guesses.append(next_link)
+
+            # Number in the url counting up, e.g. SICP's 'book-Z-H-N.html'
+            guesses += predict_by_number(page_link, next_link, self.window)
+
+            # Dated links of the chain's shape (e.g. WordPress' '/YYYY/MM/DD/
+            # slug/') seen on pages so far, the ones after the next link
+            chain_shape = url_shape(next_link)
+            if page is not None and \
+                    any('#' in folder for folder in chain_shape[1]):
+                for href in self.engine.hrefs(page):
+                    link = urllib.parse.urljoin(page_link, href)
+                    link = urllib.parse.quote(link.split('#')[0],
+                                              safe='/:%?=&')
+                    if url_shape(link) == chain_shape:
+                        self.seen_links.add(link)
+                guesses += sorted(link for link in self.seen_links
+                                  if link > next_link)
+
+        # Known pages are not guessed; keep the window
+        guesses = [link for link in collections.OrderedDict.fromkeys(guesses)
+                   if link not in visited][:self.window]
+
+        # Drop guesses not made again, download new ones
+        for link in list(self.guesses):
+            if link not in guesses:
+                self.guesses.pop(link).cancel()
+        for link in guesses:
+            if link not in self.guesses:
+                self.guesses[link] = self.executor.submit(self.fetch_guess,
+                                                          link)
+
+    def close(self):
+        """Drop remaining guesses"""
+
+        for future in self.guesses.values():
+            future.cancel()
+        self.guesses.clear()
+        self.executor.shutdown(wait=False)
+
+
+def find_next_link(serial, page):
+    """Identify and return a link to the next page"""
+
+    # As the serial's pages link it
+    maybe_link = serial.adapter.next_link(serial, page)
+
+    # Store url if found (without the place in the page), replace broken
+    # links
+    if maybe_link is not None:
+        next_link = urllib.parse.quote(maybe_link.split('#')[0],
+                                       safe='/:%?=&')
     else:
-        print('\nSerial or URL incorrectly stated.\n'
-              'Usage:\nChapterChainer.py {SICP, T5D, '
-              'Unsong [--append | --chrono[logical] | --omit], URL}\n'
-              )
-        sys.exit()
+        next_link = ''
 
-    # Stated serial with start-URL ('serial URL' or 'serial option URL')
-    # overwrite the first page value with URL
-    if len(sys.argv) > 2 and str.startswith(sys.argv[2], 'http'):
-        FIRST_LINK = sys.argv[2]
-    if len(sys.argv) > 3 and str.startswith(sys.argv[3], 'http'):
-        FIRST_LINK = sys.argv[3]
-
-    # Constants not set before, including some defaults
-    WHICH_SERIAL = sys.argv[1]
-    if 'PAGES_FILE' not in locals():
-        PAGES_FILE = PAGE_TITLE + '.html'
-    if 'GET_NOTES' not in locals():
-        GET_NOTES = ''
-    if 'WAIT_BETWEEN_REQUESTS' not in locals():
-        WAIT_BETWEEN_REQUESTS = 0
-    if 'TITLE_SEPARATE' not in locals():
-        TITLE_SEPARATE = False
-    NOTES_FILE = PAGE_TITLE + '_temp.html'
-    START_TIME = time.time()  # For total time
+#    To work around links that slip detection or are broken,
+#    repeat for each link:
+#    1. duplicate commented explanation and 'if' block below,
+#    2. uncomment it, and
+#    3. insert page of broken link, broken link url, working url.
+#
+#     # Broken URL in The_broken_links_page
+#     if (next_link == 'Broken_link'):
+#        next_link = 'Working_link'
 
-    # Start actual processing
-    start_end_serial_download()
+    return next_link
+
+
+# Rule for clutter in a page's content: tag name, then (all optional) its
+# attributes ({name: space-separated values it must have, or True: just
+# present}), a regex for all of its text, a regex for the href of a link in
+# it, the name of the tag right before it, and what to do with it
+DeclutterRule = collections.namedtuple('DeclutterRule',
+                                       'name attrs text link after action')
+DeclutterRule.__new__.__defaults__ = (None, None, None, None, 'remove')
+
+# Relative link to a place in another page: the place ('#…') is local
+LOCAL_LINK = re.compile(r'^([^#]*)#(.+)$')
+
+
+class Declutter:
+    """Rules for a serial's clutter, applied in one pass over the tree"""
+
+    def __init__(self, rules, text_rules=()):
+        # As stated; compiled on first use, only for the serial downloaded
+        self.rule_list = list(rules)
+        self.text_rule_list = list(text_rules)
+        self.rules = None
+        self.text_rules = None
+
+        # Changes with any rule, for the memo keys
+        self.version = hashlib.sha256(
+            repr((self.rule_list, self.text_rule_list)).encode('utf-8')
+        ).hexdigest()
+
+    def compile(self):
+        """Compile the rules' regexes, sort the rules by tag name"""
+
+        # Rules by tag name, so each tag is checked only against its own
+        rules = {}
+        for rule in self.rule_list:
+            rules.setdefault(rule.name, []).append(rule._replace(
+                text=re.compile(rule.text, re.DOTALL) if rule.text else None,
+                link=re.compile(rule.link) if rule.link else None))
+
+        # Substitutions on the resulting html string: (regex, replacement)
+        self.text_rules = [(re.compile(pattern), replacement)
+                           for (pattern, replacement) in self.text_rule_list]
+        self.rules = rules  # last: others may go ahead once it is set
+
+    @staticmethod
+    def tag_before(tag):
+        """Tag right before this one (whitespace between), or None"""
+
+        sibling = tag.previous_sibling
+        while isinstance(sibling, bs4.NavigableString) and not sibling.strip():
+            sibling = sibling.previous_sibling
+        return sibling if isinstance(sibling, bs4.Tag) else None
+
+    def matches(self, rule, tag, facts):
+        """Check if a tag is the clutter the rule describes"""
+
+        for (attribute, values) in (rule.attrs or {}).items():
+            tag_values = tag.get(attribute)
+            if tag_values is None:
+                return False
+            if values is True:
+                continue
+            if isinstance(tag_values, str):
+                tag_values = tag_values.split()
+            if not set(values.split()) <= set(tag_values):
+                return False
+
+        # Text, links and tag before are looked up once per tag
+        if rule.text is not None:
+            if 'text' not in facts:
+                facts['text'] = tag.get_text().strip()
+            if not rule.text.fullmatch(facts['text']):
+                return False
+
+        if rule.link is not None:
+            if 'links' not in facts:
+                facts['links'] = [link_tag['href'] for link_tag
+                                  in tag.find_all('a', href=True)]
+                if tag.name == 'a' and tag.get('href') is not None:
+                    facts['links'].append(tag['href'])
+            if not any(rule.link.search(link) for link in facts['links']):
+                return False
+
+        if rule.after is not None:
+            if 'tag_before' not in facts:
+                facts['tag_before'] = self.tag_before(tag)
+            if facts['tag_before'] is None or \
+                    facts['tag_before'].name != rule.after:
+                return False
+
+        return True
+
+    def act(self, rule, tag, rel_link_base):
+        """Do what the rule says with the tag"""
+
+        # The tag (and its contents)
+        if rule.action == 'remove':
+            tag.decompose()
+
+        # The tag and a horizontal rule right before; the line break after
+        # stays (as the former '<hr/>\n<p>…</p>' regexes left it)
+        elif rule.action == 'remove with rule':
+            tag_before = self.tag_before(tag)
+            if tag_before is not None and tag_before.name == 'hr':
+                while tag.previous_sibling is not tag_before:
+                    tag.previous_sibling.extract()  # whitespace between
+                tag_before.decompose()
+            tag.decompose()
+
+        # The tag, with its line break
+        elif rule.action == 'remove line':
+            line_break = tag.next_sibling
+            if isinstance(line_break, bs4.NavigableString) and \
+                    line_break.startswith('\n'):
+                if line_break == '\n':
+                    line_break.extract()
+                else:
+                    line_break.replace_with(line_break[1:])
+            tag.decompose()
+
+        # Only the text before its first tag (e.g. before a '<br/>')
+        elif rule.action == 'leading text':
+            for child in list(tag.contents):
+                if isinstance(child, bs4.Tag) or \
+                        child is not tag.contents[0]:
+                    child.extract()
+
+        # Relative text link to a place within the output file
+        elif rule.action == 'local link':
+            if not tag['href'].startswith('http'):
+                tag['href'] = LOCAL_LINK.sub(r'#\2', tag['href'])
+
+        # Relative image source made absolute
+        elif rule.action == 'absolute src':
+            if not tag['src'].startswith('http'):
+                tag['src'] = rel_link_base + tag['src']
+
+    def apply(self, tag, rel_link_base=''):
+        """Remove the clutter from a tag, return it as html string"""
+
+        if self.rules is None:
+            self.compile()
+
+        # Tags in document order; skip ones gone with an earlier tag
+        for this_tag in tag.find_all(list(self.rules)):
+            if this_tag.parent is None:
+                continue
+            facts = {}
+            for rule in self.rules[this_tag.name]:
+                if this_tag.parent is None:  # removed by the rule before
+                    break
+                if self.matches(rule, this_tag, facts):
+                    self.act(rule, this_tag, rel_link_base)
+
+        # Tags to html string, then text substitutions
+        return self.substitute(str(tag))
+
+    def substitute(self, out_html):
+        """Apply the text substitutions to the html string"""
+
+        for (this_re, replacement) in self.text_rules:
+            out_html = this_re.sub(replacement, out_html)
+        return out_html
+
+    # The same for lxml elements (see LxmlEngine): text is an element's
+    # 'text' and the 'tail' after it, not tags of its own
+
+    @staticmethod
+    def element_before(element):
+        """Element right before this one (whitespace between), or None"""
+
+        sibling = element.getprevious()
+        while sibling is not None and not isinstance(sibling.tag, str) and \
+                not (sibling.text or '').strip():  # comment of whitespace
+            if sibling.tail is not None and sibling.tail.strip():
+                return None
+            sibling = sibling.getprevious()
+        if sibling is None or not isinstance(sibling.tag, str):
+            return None
+        if sibling.tail is not None and sibling.tail.strip():
+            return None  # text between
+        return sibling
+
+    def element_matches(self, rule, element, facts):
+        """Check if an element is the clutter the rule describes"""
+
+        for (attribute, values) in (rule.attrs or {}).items():
+            element_values = element.get(attribute)
+            if element_values is None:
+                return False
+            if values is True:
+                continue
+            if not set(values.split()) <= set(element_values.split()):
+                return False
+
+        # Text, links and element before are looked up once per element
+        if rule.text is not None:
+            if 'text' not in facts:
+                facts['text'] = element_text(element).strip()
+            if not rule.text.fullmatch(facts['text']):
+                return False
+
+        if rule.link is not None:
+            if 'links' not in facts:
+                facts['links'] = [link_element.get('href') for link_element
+                                  in element.iterdescendants('a')
+                                  if link_element.get('href') is not None]
+                if element.tag == 'a' and element.get('href') is not None:
+                    facts['links'].append(element.get('href'))
+            if not any(rule.link.search(link) for link in facts['links']):
+                return False
+
+        if rule.after is not None:
+            if 'element_before' not in facts:
+                facts['element_before'] = self.element_before(element)
+            if facts['element_before'] is None or \
+                    facts['element_before'].tag != rule.after:
+                return False
+
+        return True
+
+    def act_on_element(self, rule, element, rel_link_base):
+        """Do what the rule says with the element"""
+
+        # The element (and its contents); the text after it stays
+        if rule.action == 'remove':
+            drop_element(element)
+
+        # The element and a horizontal rule right before; the line break
+        # after stays, as act() leaves it
+        elif rule.action == 'remove with rule':
+            element_before = self.element_before(element)
+            if element_before is not None and element_before.tag == 'hr':
+                for between in list(element_before.itersiblings()):
+                    if between is element:
+                        break
+                    between.getparent().remove(between)  # with its tail
+                element_before.tail = None  # whitespace between
+                drop_element(element_before)
+            drop_element(element)
+
+        # The element, with its line break
+        elif rule.action == 'remove line':
+            if element.tail is not None and element.tail.startswith('\n'):
+                element.tail = element.tail[1:] or None
+            drop_element(element)
+
+        # Only the text before its first element (e.g. before a '<br/>');
+        # else the first text (or comment) after it, as act() keeps it
+        elif rule.action == 'leading text':
+            (kept_text, kept_comment) = (element.text, None)
+            if kept_text is None:
+                for child in element:
+                    if not isinstance(child.tag, str):
+                        kept_comment = child
+                        break
+                    if child.tail is not None:
+                        kept_text = child.tail
+                        break
+            for child in list(element):
+                if child is not kept_comment:
+                    element.remove(child)  # with its tail
+            if kept_comment is not None:
+                kept_comment.tail = None
+            element.text = kept_text
+
+        # Relative text link to a place within the output file
+        elif rule.action == 'local link':
+            if not element.get('href').startswith('http'):
+                element.set('href', LOCAL_LINK.sub(r'#\2',
+                                                   element.get('href')))
+
+        # Relative image source made absolute
+        elif rule.action == 'absolute src':
+            if not element.get('src').startswith('http'):
+                element.set('src', rel_link_base + element.get('src'))
+
+    def apply_element(self, element, rel_link_base=''):
+        """Remove the clutter from an lxml element, return it as html string
+        (as Beautiful Soup would write it)"""
+
+        if self.rules is None:
+            self.compile()
+
+        # Whitespace as Beautiful Soup keeps it, so the html is the same
+        normalize_whitespace(element)
+
+        # Elements in document order; skip ones gone with an earlier one
+        # (no rules: no elements, as iterdescendants() would give them all)
+        for this_element in (list(element.iterdescendants(*self.rules))
+                             if self.rules else []):
+            if this_element.getparent() is None:
+                continue
+            facts = {}
+            for rule in self.rules[this_element.tag]:
+                if this_element.getparent() is None:  # removed by the rule
+                    break
+                if self.element_matches(rule, this_element, facts):
+                    self.act_on_element(rule, this_element, rel_link_base)
+
+        # Elements to html string, then text substitutions
+        return self.substitute(soup_html(element))
+
+
+# Links to Unsong's Author's Notes, announcing them in chapters
+UNSONG_NOTES_LINK = r'^https?://unsongbook\.com/authors-note-'
+
+UNSONG_CLUTTER = Declutter([
+    # Navigation links
+    DeclutterRule('a', {'rel': 'prev'}),
+    DeclutterRule('a', {'rel': 'next'}),
+
+    # Social web
+    DeclutterRule('div', {'class': 'sharedaddy sd-sharing-enabled'}),
+
+    # 'End of Book…' Season's greetings
+    DeclutterRule('b', text=r'End of Book .*', action='leading text'),
+
+    # Author's Note announcements, after a rule or in '[…]' (but not
+    # '[Content warning:…]'), or centered
+    DeclutterRule('p', link=UNSONG_NOTES_LINK, after='hr',
+                  action='remove with rule'),
+    DeclutterRule('p', text=r'\[[^C].*', link=UNSONG_NOTES_LINK),
+    DeclutterRule('center', link=UNSONG_NOTES_LINK),
+
+    # Other announcements; not from Author's Notes
+    DeclutterRule('p', text=r'(Further information will be posted .+ '
+                            r'and with next week’s chapter\])|'
+                            r'(— 2 PM on Sunday April 17 at the CFAR.+ '
+                            r'Stanford, time and exact location tbd)|'
+                            r'(Thank you for reading Unsong\.)|'
+                            r'(I have a few extra things I need to .+'
+                            r'the box at the top right of the page\.)|'
+                            r'(I have gotten some very vague express.+ '
+                            r'thing, subscribe as mentioned above\.)|'
+                            r'(Thanks also to everyone who attended .+'
+                            r'ople who live there are very confused\.)|'
+                            r'(Most of you probably know this, but I.+'
+                            r'r/rational\.)|'
+                            r'(There.s a video of me reading the final.+'
+                            r'here \(thanks Ben.\))',
+                  action='remove line'),
+    DeclutterRule('p', text=r'\[If you like this story, please .+'
+                            r'spamming you with it every update\.\]'),
+    DeclutterRule('p', text=r'The final chapter will be posted next .+'
+                            r'on the linked Facebook pages for details\.',
+                  after='hr', action='remove with rule'),
+])
+
+T5D_CLUTTER = Declutter([
+    # Social web
+    DeclutterRule('div', {'class': 'sharedaddy sd-sharing-enabled'}),
+    DeclutterRule('div', {'class': 'sharedaddy sd-block sd-like '
+                                   'jetpack-likes-widget-wrapper '
+                                   'jetpack-likes-widget-unloaded'}),
+], [
+    # Collapse 2 to 4 whitespace after punctuation, non-space entities,
+    # tags that format rendered text
+    (r'([,.;:!?&…’”a-zA-Z0-9]|'  # literals
+     r'(&.{3,10}(?!sp);)|'  # entities not '&…sp;'
+     r'(</?(b|i|em|del|strong|span)>))'  # tags
+     r'(\s|&nbsp;){2,4}', r'\1 '),
+
+    # Whitespace not before AND after tags that format rendered text
+    (r'(\s|&nbsp;)'
+     r'(</?(b|i|em|del|strong|span)>)'
+     r'(\s|&nbsp;)', r'\2 '),
+
+    # No space after opening quotes
+    (r'(‘|“|&l[sd]quo;)(\s|&nbsp;)', r'\1'),
+])
+
+SICP_CLUTTER = Declutter([
+    # Navigation links
+    DeclutterRule('div', {'class': 'navigation'}),
+
+    # Point relative text links to within output file
+    DeclutterRule('a', {'href': True}, action='local link'),
+
+    # Make relative image sources absolute
+    DeclutterRule('img', {'src': True}, action='absolute src'),
+])
+
+GENERIC_CLUTTER = Declutter([
+    # Not text of the page
+    DeclutterRule('script'),
+    DeclutterRule('style'),
+    DeclutterRule('noscript'),
+    DeclutterRule('iframe'),
+    DeclutterRule('form'),
+])
+
+
+def declutter_unsong(serial, chap_title_tag, chap_cont_tag):
+    """Remove clutter from Unsong content, convert to strings"""
+
+    return (serial.engine.html(chap_title_tag),
+            serial.engine.declutter(UNSONG_CLUTTER, chap_cont_tag))
+
+
+def declutter_t5d(serial, chap_title_tag, chap_cont_tag):
+    """Remove clutter from The Fifth Defiance content, convert to strings"""
+
+    return (serial.engine.declutter(T5D_CLUTTER, chap_title_tag),
+            serial.engine.declutter(T5D_CLUTTER, chap_cont_tag))
+
+
+def declutter_sicp(serial, chap_cont_tag, next_link):
+    """Remove clutter from SICP content, convert to strings"""
+
+    out_chap = serial.engine.declutter(SICP_CLUTTER, chap_cont_tag,
+                                       serial.rel_link_base)
+
+    # No …</body><body>… at page borders
+    if next_link != ('https://mitpress.mit.edu/'
+                     'sicp/full-text/book/book.html'):
+        out_chap = out_chap.replace('<body>', '')  # not first: no <body>
+    if next_link != '':
+        out_chap = out_chap.replace('</body>', '')  # not last: no </body>
+
+    return out_chap
+
+
+def declutter_generic(serial, chap_cont_tag):
+    """Remove scripts, forms etc. from any page's content, convert to string"""
+
+    # The page's body becomes a division of the output file
+    serial.engine.rename(chap_cont_tag, 'div')
+
+    return serial.engine.declutter(GENERIC_CLUTTER, chap_cont_tag)
+
+
+# Link to the next page: by 'rel'='next', else by its text
+NEXT_LINK_REL = {'rel': 'next'}
+NEXT_LINK_TEXT = re.compile(r'(Next)(( |0xC2A0|&nbsp;)+Chapter)?')
+
+# Titles of Unsong's pages not part of the story
+UNSONG_NOTES_TITLE = re.compile(r'^(Author.s Note|Postscript)')
+
+# Link of a WordPress site's pages to its REST API, in their head (any
+# attribute order, any quotes) or 'Link' header
+WORDPRESS_API_REL = 'https://api.w.org/'
+WORDPRESS_API_LINK = re.compile(rb'<link\b[^>]*\srel=["\']https://api\.w\.org/'
+                                rb'["\']', re.IGNORECASE)
+
+
+class SerialAdapter:
+    """What sets a serial apart: its settings, pages' layout and clutter"""
+
+    # Settings the serial starts with (see configure_serial())
+    page_title = 'Serial'
+    pages_file = None
+    first_link = ''
+    rel_link_base = ''
+    title_separate = False
+    pars = 'lxml'
+    parse_targets = None
+
+    # Headline and content tags, as (name, attributes) for the engine's
+    # find(); the engine parsing and searching its pages (see PARSE_ENGINES)
+    title_tag = None
+    content_tag = None
+    engine = 'soup'
+
+    # Its Declutter (none: no clutter), and next links not to follow
+    # (epilogue, afterword, author's blog, next story, etc.)
+    clutter = Declutter([])
+    stop_links = frozenset()
+
+    # Hosted by WordPress: its posts can be taken in bulk ('--bulk')
+    wordpress = False
+
+    def configure(self, serial, arguments):
+        """Set the serial's parameters, given its command line arguments"""
+
+        serial.page_title = self.page_title
+        serial.pages_file = self.pages_file
+        serial.first_link = self.first_link
+        serial.rel_link_base = self.rel_link_base
+        serial.title_separate = self.title_separate
+        serial.pars = self.pars
+        serial.parse_targets = self.parse_targets
+
+        # Parser and engine as calibrated for the serial, if it was
+        # ('--calibrate')
+        engine_name = self.engine
+        calibrated = calibrated_parser(serial.which_serial)
+        if calibrated is not None:
+            (serial.pars, engine_name) = calibrated
+
+        # Engine as stated, else the serial's own (None: no such engine);
+        # pages not parsed with 'lxml' only by Beautiful Soup
+        serial.engine = PARSE_ENGINES.get(serial.options['engine'] or
+                                          engine_name)
+        if serial.engine is not None and serial.pars != 'lxml':
+            serial.engine = PARSE_ENGINES['soup']
+
+    def next_link(self, serial, page):
+        """Link to the next page as on the page, or None"""
+
+        link_tag = serial.engine.find(page, 'a', NEXT_LINK_REL)
+        if link_tag is None:
+            link_tag = serial.engine.find_by_string(page, 'a', NEXT_LINK_TEXT)
+        return serial.engine.href(link_tag) if link_tag is not None else None
+
+    def content_tags(self, serial, page):
+        """Tags holding the page's headline and content (None: not found)"""
+
+        return (serial.engine.find(page, *self.title_tag),
+                serial.engine.find(page, *self.content_tag))
+
+    def is_note(self, chap_title):
+        """Check if the page is a Notes page, by its title"""
+
+        return False
+
+    def is_wordpress(self, serial, start_link):
+        """Check if the serial's posts can be taken in bulk ('--bulk')"""
+
+        return self.wordpress
+
+    def declutter(self, serial, chap_title_tag, chap_cont_tag, next_link):
+        """Headline and content html, clutter removed (None: not written)"""
+
+        return tuple(serial.engine.declutter(self.clutter, tag)
+                     if tag is not None else None
+                     for tag in (chap_title_tag, chap_cont_tag))
+
+
+class SicpAdapter(SerialAdapter):
+    """Structure and Interpretation of Computer Programs"""
+
+    page_title = 'Structure and Interpretation of Computer Programs'
+    pages_file = 'StructInterprCompProg.html'
+    first_link = ('https://mitpress.mit.edu/sites/default/files/'
+                  'sicp/full-text/book/book.html')
+    rel_link_base = ('https://mitpress.mit.edu/sites/default/'
+                     'files/sicp/full-text/book/')
+    title_separate = False  # header and chapter are the same tag
+    pars = 'html5lib'  # the others don't handle this html style well
+    clutter = SICP_CLUTTER
+
+    def next_link(self, serial, page):
+        """Link with only 'next' as text, made absolute"""
+
+        link_tag = serial.engine.find_by_string(page, 'a', 'next')
+        if link_tag is None:
+            return None
+        return serial.rel_link_base + serial.engine.href(link_tag)
+
+    def content_tags(self, serial, page):
+        """First h1 (else h2, else None) as headline, the body as content"""
+
+        chap_title_tag = serial.engine.find(page, 'h1')
+        if chap_title_tag is None:
+            chap_title_tag = serial.engine.find(page, 'h2')
+        return chap_title_tag, serial.engine.find(page, 'body')
+
+    def declutter(self, serial, chap_title_tag, chap_cont_tag, next_link):
+        """Only the content; the headline is part of it"""
+
+        return None, declutter_sicp(serial, chap_cont_tag, next_link)
+
+
+class T5dAdapter(SerialAdapter):
+    """The Fifth Defiance"""
+
+    page_title = 'The Fifth Defiance'
+    first_link = 'https://thefifthdefiance.com/2015/11/02/introduction/'
+    parse_targets = [('h1', 'class', 'entry-title'),
+                     ('div', 'class', 'entry-content'),
+                     ('a', 'rel', 'next')]
+    title_tag = ('h1', {'class': 'entry-title'})
+    content_tag = ('div', {'class': 'entry-content'})
+    engine = 'lxml'
+    clutter = T5D_CLUTTER
+    wordpress = True
+
+    def declutter(self, serial, chap_title_tag, chap_cont_tag, next_link):
+        """Headline and content, whitespace tidied"""
+
+        return declutter_t5d(serial, chap_title_tag, chap_cont_tag)
+
+
+class UnsongAdapter(SerialAdapter):
+    """Unsong, with its Author's Notes omitted, appended or in between"""
+
+    page_title = 'Unsong'
+    first_link = 'https://unsongbook.com/prologue-2/'
+    parse_targets = [('h1', 'class', 'pjgm-posttitle'),
+                     ('div', 'class', 'pjgm-postcontent'),
+                     ('a', 'rel', 'next')]
+    title_tag = ('h1', {'class': 'pjgm-posttitle'})
+    content_tag = ('div', {'class': 'pjgm-postcontent'})
+    engine = 'lxml'
+    clutter = UNSONG_CLUTTER
+    wordpress = True
+
+    def configure(self, serial, arguments):
+        """Also what to do with the Notes pages, and the file named so"""
+
+        super().configure(serial, arguments)
+        serial.get_notes = 'chrono'  # Default: chronological w/story pages
+        if len(arguments) > 1 and not str.startswith(arguments[1], 'http'):
+            if arguments[1] == '--omit' or arguments[1] is None:
+                serial.get_notes = 'omit'  # None
+                serial.pages_file = serial.page_title + '-Notes_omitted.html'
+            if arguments[1] == '--append':
+                serial.get_notes = 'append'  # Copy after story end
+                serial.pages_file = serial.page_title + '-Notes_appended.html'
+            if arguments[1] in ('--chronological', '--chrono'):
+                serial.get_notes = 'chrono'
+                serial.pages_file = (serial.page_title +
+                                     '-Notes_chronological.html')
+        else:
+            serial.report('\nDefaulting to --chronological\n')
+            serial.get_notes = 'chrono'
+            serial.pages_file = serial.page_title + '-Notes_chronological.html'
+
+    def is_note(self, chap_title):
+        """Author's Notes and the Postscript are Notes pages"""
+
+        return UNSONG_NOTES_TITLE.search(chap_title) is not None
+
+    def declutter(self, serial, chap_title_tag, chap_cont_tag, next_link):
+        """Headline as is, content without announcements and navigation"""
+
+        return declutter_unsong(serial, chap_title_tag, chap_cont_tag)
+
+
+class GenericAdapter(SerialAdapter):
+    """Any URL: no stated serial, thus none of preset decluttering"""
+
+    clutter = GENERIC_CLUTTER
+
+    def configure(self, serial, arguments):
+        """Start with the given URL, a file named by the time"""
+
+        super().configure(serial, arguments)
+        timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
+        serial.pages_file = 'Serial Downloaded ' + timestamp + '.html'
+        serial.first_link = arguments[0]  # start with the given URL
+        serial.report('\nIt is unlikely that ChapterChainer is already '
+                      'configured to download the serial from this URL.\n'
+                      'Please adapt the source code if the result of this '
+                      'run is not satisfying.\n\n')
+
+    def is_wordpress(self, serial, start_link):
+        """Check if the start page links to WordPress's REST API (in its
+        head or 'Link' header); not to be had: not WordPress"""
+
+        probed = probe_page(serial, start_link)
+        if probed is None:
+            return False
+        (response, _) = probed
+        return (WORDPRESS_API_REL in ' '.join(
+                    response.headers.get_all('Link', [])) or
+                WORDPRESS_API_LINK.search(response.body) is not None)
+
+    def content_tags(self, serial, page):
+        """First h1 (else the page title) as headline, the body as content"""
+
+        chap_title_tag = serial.engine.find(page, 'h1')
+        if chap_title_tag is None:
+            chap_title_tag = serial.engine.find(page, 'title')
+        return chap_title_tag, serial.engine.find(page, 'body')
+
+    def declutter(self, serial, chap_title_tag, chap_cont_tag, next_link):
+        """The whole body (a page without one: nothing)"""
+
+        if chap_cont_tag is None:
+            return None, ''
+        return None, declutter_generic(serial, chap_cont_tag)
+
+
+# Builtin serials, by their title on the command line; any URL else is
+# downloaded with GENERIC_ADAPTER
+SERIAL_ADAPTERS = {'SICP': SicpAdapter(),
+                   'T5D': T5dAdapter(),
+                   'Unsong': UnsongAdapter()}
+GENERIC_ADAPTER = GenericAdapter()
+
+
+class ParseTargetTests:
+    """Let the parser build only the wanted tags (with all they contain)"""
+
+    def __init__(self, targets):
+        super().__init__()
+        self.targets = targets  # (tag name, attribute or None, value)
+
+    def is_target(self, name, attrs):
+        """Check if a tag about to be built is one of the targets"""
+
+        for (tag_name, attribute, value) in self.targets:
+            if name != tag_name:
+                continue
+            if attribute is None:  # any tag of that name
+                return True
+            attr_value = (attrs or {}).get(attribute) or ''
+            if not isinstance(attr_value, str):  # already split into a list
+                attr_value = ' '.join(attr_value)
+            if value in attr_value.split():
+                return True
+        return False
+
+    # Beautiful Soup 4.13 and later
+    def allow_tag_creation(self, nsprefix, name, attrs):
+        return self.is_target(name, attrs)
+
+    def allow_string_creation(self, string):
+        return False  # text outside the targets
+
+    # Beautiful Soup before 4.13
+    def search_tag(self, markup_name=None, markup_attrs={}):
+        return self.is_target(markup_name, markup_attrs)
+
+
+# Beautiful Soup's strainer with these tests; built by import_soup()
+ParseTargets = None
+
+
+def import_soup():
+    """Import Beautiful Soup on first use, return the module"""
+
+    global bs4, ParseTargets
+    if bs4 is None:
+        import bs4 as soup_module
+        ParseTargets = type('ParseTargets',
+                            (ParseTargetTests, soup_module.SoupStrainer), {})
+        bs4 = soup_module  # last: others may go ahead once it is set
+    return bs4
+
+
+def import_lxml():
+    """Import lxml's html and XML tools on first use, return the package"""
+
+    global lxml
+    if lxml is None:
+        # Used as lxml.etree, lxml.html; ignore code inspector's complaint
+        import lxml.etree as lxml_etree
+        import lxml.html as lxml_html
+        lxml = sys.modules['lxml']  # last: others may go ahead once it is set
+    return lxml
+
+
+class SoupEngine:
+    """Pages parsed and searched with Beautiful Soup, with any parser"""
+
+    name = 'soup'
+    partial = True  # can build only the tags wanted (parse targets)
+
+    def parse(self, serial, body, charset, parse_only=None, pars=None):
+        """Parse a page's html (only the parse targets, if given), with the
+        serial's parser or the one given"""
+
+        return import_soup().BeautifulSoup(body, pars or serial.pars,
+                                           from_encoding=charset,
+                                           parse_only=parse_only)
+
+    def find(self, page, name, attrs={}):
+        """First tag of that name with these attributes, or None"""
+
+        return page.find(name, attrs)
+
+    def find_by_string(self, page, name, string):
+        """First tag of that name with only that text (str or regex)"""
+
+        return page.find(name, string=string)
+
+    def href(self, tag):
+        """Link target of a tag"""
+
+        return tag['href']
+
+    def hrefs(self, page):
+        """Link targets of all links on the page"""
+
+        return [link_tag['href'] for link_tag in page.find_all('a', href=True)]
+
+    def text(self, tag):
+        """All text in a tag"""
+
+        return tag.get_text()
+
+    def html(self, tag):
+        """A tag as html string"""
+
+        return str(tag)
+
+    def declutter(self, clutter, tag, rel_link_base=''):
+        """Remove the clutter from a tag, return it as html string"""
+
+        return clutter.apply(tag, rel_link_base)
+
+    def rename(self, tag, name):
+        """Make a tag another one, without attributes"""
+
+        tag.name = name
+        tag.attrs = {}
+
+    def free(self, page):
+        """Done with the page: free its tree now"""
+
+        page.decompose()
+
+
+# Beautiful Soup's ways with html (see bs4.builder.HTMLTreeBuilder), as the
+# lxml engine follows them so its html is the same: a string of whitespace
+# only is kept as one line break or space (except in these tags), these
+# attributes have several values (per tag name, '*': any), written with a
+# space between, these tags' text is not part of get_text() or is not
+# escaped, and these tags are written as empty ('<br/>')
+ASCII_SPACES = '\x20\x0a\x09\x0c\x0d'
+WHITESPACE_PRESERVING_TAGS = frozenset(['pre', 'textarea'])
+MULTI_VALUED_ATTRIBUTES = {'*': frozenset(['class', 'accesskey', 'dropzone']),
+                           'a': frozenset(['rel', 'rev']),
+                           'link': frozenset(['rel', 'rev']),
+                           'td': frozenset(['headers']),
+                           'th': frozenset(['headers']),
+                           'form': frozenset(['accept-charset']),
+                           'object': frozenset(['archive']),
+                           'area': frozenset(['rel']),
+                           'icon': frozenset(['sizes']),
+                           'iframe': frozenset(['sandbox']),
+                           'output': frozenset(['for'])}
+NON_TEXT_TAGS = frozenset(['script', 'style', 'template', 'rt', 'rp'])
+UNESCAPED_TEXT_TAGS = frozenset(['script', 'style'])
+EMPTY_ELEMENT_TAGS = frozenset(['area', 'base', 'basefont', 'bgsound', 'br',
+                                'col', 'command', 'embed', 'frame', 'hr',
+                                'image', 'img', 'input', 'isindex', 'keygen',
+                                'link', 'menuitem', 'meta', 'nextid', 'param',
+                                'source', 'spacer', 'track', 'wbr'])
+HTML_ESCAPES = str.maketrans({'&': '&amp;', '<': '&lt;', '>': '&gt;'})
+
+
+def collapsed_whitespace(text):
+    """A string as Beautiful Soup keeps it: whitespace only becomes one"""
+
+    if text is not None and not text.strip(ASCII_SPACES):
+        return '\n' if '\n' in text else ' '
+    return text
+
+
+def normalize_whitespace(element):
+    """Collapse the strings of whitespace only in an lxml element (and the
+    comments of it), as Beautiful Soup does while parsing"""
+
+    if element.tag in WHITESPACE_PRESERVING_TAGS:
+        return
+    if element.text is not None:
+        element.text = collapsed_whitespace(element.text)
+    for child in element:
+        if isinstance(child.tag, str):
+            normalize_whitespace(child)
+        else:  # comment
+            child.text = collapsed_whitespace(child.text or '')
+        if child.tail is not None:
+            child.tail = collapsed_whitespace(child.tail)
+
+
+def drop_element(element):
+    """Remove an lxml element and its contents; the text after it stays"""
+
+    parent = element.getparent()
+    if element.tail:
+        previous = element.getprevious()
+        if previous is None:
+            parent.text = (parent.text or '') + element.tail
+        else:
+            previous.tail = (previous.tail or '') + element.tail
+    parent.remove(element)
+
+
+def element_text(element):
+    """All text in an lxml element, as Beautiful Soup's get_text() has it"""
+
+    texts = [element.text or '']
+    for child in element:
+        if isinstance(child.tag, str) and child.tag not in NON_TEXT_TAGS:
+            texts.append(element_text(child))
+        texts.append(child.tail or '')
+    return ''.join(texts)
+
+
+def element_string(element):
+    """The one string in an lxml element (maybe in its one element), else
+    None; as Beautiful Soup's '.string'"""
+
+    while True:
+        if element.text is not None:
+            return element.text if len(element) == 0 else None
+        if len(element) != 1 or element[0].tail is not None:
+            return None
+        element = element[0]
+        if not isinstance(element.tag, str):  # comment
+            return element.text
+
+
+def soup_html(element):
+    """An lxml element as html string, as Beautiful Soup writes a tag"""
+
+    parts = []
+    append = parts.append
+    any_multi_valued = MULTI_VALUED_ATTRIBUTES['*']
+
+    def write(element):
+        """Append an element's html: tag, attributes, contents"""
+        name = element.tag
+        multi_valued = MULTI_VALUED_ATTRIBUTES.get(name, ())
+        append('<' + name)
+        for (attribute, value) in sorted(element.attrib.items()):
+            if attribute in any_multi_valued or attribute in multi_valued:
+                value = ' '.join(value.split())
+            value = value.translate(HTML_ESCAPES)
+            quote = '"'
+            if '"' in value:
+                if "'" in value:
+                    value = value.replace('"', '&quot;')
+                else:
+                    quote = "'"
+            append(' ' + attribute + '=' + quote + value + quote)
+        if name in EMPTY_ELEMENT_TAGS and element.text is None and \
+                len(element) == 0:
+            append('/>')
+            return
+        append('>')
+
+        # Text and tails in it as they are in scripts and styles
+        escaped = name not in UNESCAPED_TEXT_TAGS
+        if element.text is not None:
+            append(element.text.translate(HTML_ESCAPES) if escaped
+                   else element.text)
+        for child in element:
+            if isinstance(child.tag, str):
+                write(child)
+            else:  # comment
+                append('<!--' + (child.text or '') + '-->')
+            if child.tail is not None:
+                append(child.tail.translate(HTML_ESCAPES) if escaped
+                       else child.tail)
+        append('</' + name + '>')
+
+    write(element)
+    return ''.join(parts)
+
+
+# Compiled XPath of each (tag name, attributes) the lxml engine looks for
+ELEMENT_PATHS = {}
+
+
+def element_path(name, attrs):
+    """Compiled XPath finding the first element of that name with these
+    attributes (as Beautiful Soup's find() does)"""
+
+    key = (name, tuple(sorted(attrs.items())))
+    path = ELEMENT_PATHS.get(key)
+    if path is None:
+        conditions = ''
+        for (attribute, value) in key[1]:
+            if value is True:
+                conditions += '[@' + attribute + ']'
+                continue
+            if attribute in MULTI_VALUED_ATTRIBUTES['*'] or \
+                    attribute in MULTI_VALUED_ATTRIBUTES.get(name, ()):
+                (attribute_value, value) = (
+                    "concat(' ', normalize-space(@" + attribute + "), ' ')",
+                    ' ' + value + ' ')
+                test = 'contains({}, {})'
+            else:
+                attribute_value = '@' + attribute
+                test = '{} = {}'
+            quote = '"' if "'" in value else "'"
+            conditions += '[' + test.format(attribute_value,
+                                            quote + value + quote) + ']'
+        path = import_lxml().etree.XPath(
+            '(descendant-or-self::' + name + conditions + ')[1]')
+        ELEMENT_PATHS[key] = path
+    return path
+
+
+# Byte order marks, and character sets declared in a page's start (an XML
+# declaration, or '<meta … charset=…>'), as Beautiful Soup looks for them
+BYTE_ORDER_MARKS = ((codecs.BOM_UTF8, 'utf-8'),
+                    (codecs.BOM_UTF16_BE, 'utf-16-be'),
+                    (codecs.BOM_UTF16_LE, 'utf-16-le'))
+DECLARED_CHARSET = re.compile(
+    rb'^\s*<\?.*encoding=[\'"](.*?)[\'"].*\?>|'
+    rb'<\s*meta[^>]+charset\s*=\s*["\']?([^>]*?)[ /;\'">]', re.IGNORECASE)
+
+
+def page_charset(body):
+    """Character set of a page the server didn't state: by its byte order
+    mark, else the one it declares (if known), else UTF-8; the first one
+    Beautiful Soup would try"""
+
+    for (byte_order_mark, charset) in BYTE_ORDER_MARKS:
+        if body.startswith(byte_order_mark):
+            return charset
+
+    declared = DECLARED_CHARSET.search(body, 0, max(2048, len(body) // 20))
+    if declared is not None:
+        charset = (declared.group(1) or declared.group(2)).decode(
+            'ascii', 'replace').strip().lower()
+        try:
+            codecs.lookup(charset)
+            return charset
+        except LookupError:  # as Beautiful Soup, on to the next guess
+            pass
+    return 'utf-8'
+
+
+class LxmlEngine:
+    """Pages parsed with lxml.html, searched with compiled XPath; builds no
+    Beautiful Soup tree, yet writes the same html as SoupEngine with 'lxml'
+    (see soup_html()). Known difference: boolean attributes ('checked')
+    have their name as value, not ''"""
+
+    name = 'lxml'
+    partial = False  # always the whole page, fast enough as it is
+
+    def parse(self, serial, body, charset, parse_only=None, pars=None):
+        """Parse a page's html, all of it; with html5lib building the tree,
+        if given (as lenient parser, see parse_page())"""
+
+        lxml_module = import_lxml()
+        if pars == 'html5lib':
+            import html5lib
+            return html5lib.parse(body, treebuilder='lxml',
+                                  namespaceHTMLElements=False,
+                                  transport_encoding=charset).getroot()
+
+        # Encoding as sent by the server, else the one the page has
+        if charset is None:
+            charset = page_charset(body)
+        try:
+            parser = lxml_module.html.HTMLParser(encoding=charset)
+        except LookupError:  # unknown encoding: lxml's own guess
+            parser = lxml_module.html.HTMLParser()
+
+        root = None
+        if body.strip():
+            root = lxml_module.etree.fromstring(body, parser)
+        if root is None:  # empty page
+            root = lxml_module.html.Element('html')
+        return root
+
+    def find(self, page, name, attrs={}):
+        """First element of that name with these attributes, or None"""
+
+        found = element_path(name, attrs)(page)
+        return found[0] if found else None
+
+    def find_by_string(self, page, name, string):
+        """First element of that name with only that text (str or regex)"""
+
+        for element in page.iter(name):
+            element_string_value = element_string(element)
+            if element_string_value is None:
+                continue
+            if isinstance(string, str):
+                if element_string_value == string:
+                    return element
+            elif string.search(element_string_value):
+                return element
+        return None
+
+    def href(self, element):
+        """Link target of an element"""
+
+        return element.attrib['href']
+
+    def hrefs(self, page):
+        """Link targets of all links on the page"""
+
+        return [link_element.get('href') for link_element in page.iter('a')
+                if link_element.get('href') is not None]
+
+    def text(self, element):
+        """All text in an element"""
+
+        normalize_whitespace(element)
+        return element_text(element)
+
+    def html(self, element):
+        """An element as html string"""
+
+        normalize_whitespace(element)
+        return soup_html(element)
+
+    def declutter(self, clutter, element, rel_link_base=''):
+        """Remove the clutter from an element, return it as html string"""
+
+        return clutter.apply_element(element, rel_link_base)
+
+    def rename(self, element, name):
+        """Make an element another one, without attributes"""
+
+        element.tag = name
+        element.attrib.clear()
+
+    def free(self, page):
+        """Nothing to do: the tree goes with the last reference to it"""
+
+
+# Parse engines, by name ('--engine'); lxml's only for pages parsed with
+# 'lxml', Beautiful Soup's for all
+PARSE_ENGINES = {'soup': SoupEngine(), 'lxml': LxmlEngine()}
+
+
+def fetch_page(serial, next_link, page_count, prefetcher=None):
+    """Download and parse page, find link to the next page; also return
+    the page's url after redirects"""
+
+    # Download page (or take it from the pages downloaded ahead)
+    if prefetcher is not None:
+        (response, down_time) = prefetcher.download(next_link)
+    else:
+        (response, down_time) = download_page(next_link,
+                                              serial.wait_between_requests)
+    METRICS.observe('stage_seconds', down_time, serial=serial.which_serial,
+                    stage='download')
+
+    # Start processing time
+    parse_start_time = time.time()
+
+    # Encoding as sent by the server; if none, the engine detects it
+    charset = response.headers.get_content_charset()
+
+    # Debugging: keep downloaded html as file, parse it from there
+    body = response.body
+    if serial.options['raw-files']:
+        raw_html_file = serial.page_title + '-' + str(page_count) + '.html'
+        with open(raw_html_file, 'wb') as out_file:
+            out_file.write(body)
+        with open(raw_html_file, 'rb') as raw_html:
+            body = raw_html.read()
+
+    # Rendered before from the same content: no need to parse it again
+    (page_memo_key, recalled) = recall_rendering(serial, body, charset)
+    if recalled is not None:
+        return (None, recalled['found_link'], down_time,
+                time.time() - parse_start_time, (page_memo_key, recalled),
+                response.url)
+
+    # Parse, with all links if next pages are guessed from them
+    (page, next_link) = parse_page(serial, body, charset,
+                                   all_links=prefetcher is not None)
+
+    return (page, next_link, down_time, time.time() - parse_start_time,
+            (page_memo_key, None), response.url)
+
+
+# Parser for pages the serial's parser finds no content in
+LENIENT_PARSER = 'html5lib'
+
+
+def parse_page(serial, body, charset, all_links=False):
+    """Parse a page's html, find link to the next page"""
+
+    engine = serial.engine
+
+    # Only the tags the serial needs, if it names them and the engine can
+    # build only these ('html5lib' can't)
+    parse_only = None
+    if serial.parse_targets is not None and engine.partial and \
+            serial.pars != 'html5lib':
+        import_soup()  # for ParseTargets
+        targets = list(serial.parse_targets)
+        if all_links:
+            targets.append(('a', None, None))
+        parse_only = ParseTargets(targets)
+
+    with METRICS.timer('stage_seconds', serial=serial.which_serial,
+                       stage='parse'):
+        page = engine.parse(serial, body, charset, parse_only)
+
+    # Get url of next chapter
+    with METRICS.timer('stage_seconds', serial=serial.which_serial,
+                       stage='find_next_link'):
+        next_link = find_next_link(serial, page)
+
+    # Something missing (e.g. changed page layout, last page): parse it all
+    (chap_title_tag, chap_cont_tag) = serial.adapter.content_tags(serial, page)
+    if parse_only is not None and (next_link == '' or chap_title_tag is None
+                                   or chap_cont_tag is None):
+        engine.free(page)
+        with METRICS.timer('stage_seconds', serial=serial.which_serial,
+                           stage='parse'):
+            page = engine.parse(serial, body, charset)
+        with METRICS.timer('stage_seconds', serial=serial.which_serial,
+                           stage='find_next_link'):
+            next_link = find_next_link(serial, page)
+        (chap_title_tag, chap_cont_tag) = serial.adapter.content_tags(serial,
+                                                                      page)
+
+    # No content at all (e.g. html a fast parser got wrong): once more with
+    # the most lenient parser
+    if chap_cont_tag is None and serial.pars != LENIENT_PARSER and \
+            parser_available(LENIENT_PARSER):
+        engine.free(page)
+        METRICS.count('parser_fallbacks_total', serial=serial.which_serial)
+        with METRICS.timer('stage_seconds', serial=serial.which_serial,
+                           stage='parse'):
+            page = engine.parse(serial, body, charset, pars=LENIENT_PARSER)
+        with METRICS.timer('stage_seconds', serial=serial.which_serial,
+                           stage='find_next_link'):
+            next_link = find_next_link(serial, page)
+
+    return page, next_link
+
+
+# Query parameters only telling where a visitor came from
+TRACKING_PARAMETERS = re.compile(r'utm_.*|fbclid|gclid|mc_cid|mc_eid',
+                                 re.IGNORECASE)
+
+# Characters left as they are in canonical paths, others %-escaped
+URL_PATH_SAFE = "/:@!$&'()*+,;=~"
+
+
+def canonical_url(url):
+    """Url as pages are told apart by: without scheme (http or https),
+    default port, trailing slash, tracking parameters and the place in
+    the page; host in lower case, escapes all the same"""
+
+    split_url = urllib.parse.urlsplit(url.strip())
+    host = (split_url.hostname or '').rstrip('.')
+    try:
+        if split_url.port not in (None, 80, 443):
+            host += ':' + str(split_url.port)
+    except ValueError:  # not a port number
+        host = split_url.netloc.lower()
+    path = urllib.parse.quote(urllib.parse.unquote(split_url.path),
+                              safe=URL_PATH_SAFE).rstrip('/')
+    query = urllib.parse.urlencode(sorted(
+        (name, value) for (name, value)
+        in urllib.parse.parse_qsl(split_url.query, keep_blank_values=True)
+        if not TRACKING_PARAMETERS.fullmatch(name)))
+
+    return host + path + ('?' + query if query else '')
+
+
+def url_key(url):
+    """Hash of a url's canonical form, as kept in the visited index"""
+
+    return hashlib.blake2b(canonical_url(url).encode('utf-8'),
+                           digest_size=16).digest()
+
+
+def content_fingerprint(out_title, out_chap):
+    """Fingerprint of a chapter's headline and content html, None if it
+    isn't written"""
+
+    if out_chap is None:
+        return None
+    return hashlib.blake2b(((out_title or '') + '\0' + out_chap)
+                           .encode('utf-8'), digest_size=16).hexdigest()
+
+
+class VisitedIndex:
+    """Pages of a download: hashes of their canonical urls (also of where
+    they redirected to), and fingerprints of the chapters written"""
+
+    def __init__(self, chapters=()):
+        self.url_keys = set()
+        self.fingerprints = set()
+
+        # Pages of an earlier run, as checkpointed in its journal
+        for chapter in chapters:
+            self.add(chapter['url'])
+            self.add(chapter.get('final_url', chapter['url']))
+            self.add_content(chapter.get('fingerprint'))
+
+    def __contains__(self, url):
+        return url_key(url) in self.url_keys
+
+    def add(self, url):
+        """Note a page's url as visited"""
+
+        self.url_keys.add(url_key(url))
+
+    def add_content(self, fingerprint):
+        """Note a chapter as written, by its fingerprint"""
+
+        if fingerprint is not None:
+            self.fingerprints.add(fingerprint)
+
+    def has_content(self, fingerprint):
+        """Whether the same chapter was written before"""
+
+        return fingerprint is not None and fingerprint in self.fingerprints
+
+
+def check_next_link(serial, next_link, visited):
+    """Return next link, or '' if it must not be followed"""
+
+    # Don't follow to epilogue, afterword, author's blog, next story, etc.
+    if next_link in serial.adapter.stop_links:
+        next_link = ''
+
+    # No circling back to visited pages, by whatever url
+    if next_link in visited:
+        next_link = ''
+
+    return next_link
+
+
+# Page as handed from fetching to processing: chapter count, url of the
+# page, its parsed page (the engine's tree; None if rendered before), the
+# link found on it, the link to follow after it ('' if none), the download
+# and parsing times, its memo key and results rendered before, and its url
+# after redirects
+FetchedPage = collections.namedtuple('FetchedPage',
+                                     'count link page found_link next_link '
+                                     'down_time parse_time memo final_url')
+
+
+def fetch_pages(serial, next_link, page_count, visited):
+    """Download and parse pages one after another, until no next link"""
+
+    # Guess and download next pages ahead, if wanted
+    prefetcher = None
+    if serial.options['prefetch'] > 0:
+        prefetcher = Prefetcher(serial.options['prefetch'],
+                                serial.options['host-connections'],
+                                serial.wait_between_requests, serial.engine)
+
+    try:
+        while next_link != '':
+
+            # Store link of this page for comparison
+            page_link = next_link
+            visited.add(page_link)
+
+            # Download and parse page, keep the found link for processing
+            (page, found_link, down_time, parse_time, memo, final_url)\
+                = fetch_page(serial, page_link, page_count, prefetcher)
+
+            # Redirected to a page visited before (e.g. a moved permalink):
+            # circled back, the chain ends; not to the same page by another
+            # url (http to https, a trailing slash added)
+            if canonical_url(final_url) != canonical_url(page_link) and \
+                    final_url in visited:
+                METRICS.count('duplicate_pages_total',
+                              serial=serial.which_serial, reason='redirect')
+                if page is not None:
+                    serial.engine.free(page)
+                return
+            visited.add(final_url)
+
+            # Increment Chapter count
+            page_count += 1
+
+            # if (page_count >= 4): found_link = ''  # Sample for testing
+
+            # Link to follow after this page
+            next_link = check_next_link(serial, found_link, visited)
+
+            # Confirm or drop guesses, guess anew from this page
+            if prefetcher is not None:
+                prefetcher.predict(page_link, next_link, page, visited)
+
+            yield FetchedPage(page_count, page_link, page, found_link,
+                              next_link, down_time, parse_time, memo,
+                              final_url)
+
+    finally:
+        if prefetcher is not None:
+            prefetcher.close()
+
+
+def fetch_pages_pipelined(serial, next_link, page_count, visited):
+    """Download and parse pages in background, hand them on in order"""
+
+    # Bounded, so the download stays at most a few pages ahead
+    fetched_pages = queue.Queue(
+        maxsize=max(1, serial.options['pipeline-depth']))
+    processing_stopped = threading.Event()  # no more pages wanted
+
+    def hand_on(item):
+        """Put an item in the queue, unless processing stopped meanwhile"""
+        while not processing_stopped.is_set():
+            try:
+                fetched_pages.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def fetcher():
+        """Put fetched pages in the queue, then None or the exception"""
+        try:
+            with contextlib.closing(fetch_pages(serial, next_link,
+                                                page_count, visited))\
+                    as pages:
+                for fetched_page in pages:
+                    if not hand_on(fetched_page):
+                        return
+            hand_on(None)
+        except BaseException as this_exception:  # incl. sys.exit()
+            hand_on(this_exception)
+
+    threading.Thread(target=fetcher, daemon=True).start()
+
+    # Pages come out in the order they were fetched, i.e. chapter order
+    try:
+        while True:
+            fetched_page = fetched_pages.get()
+            if fetched_page is None:
+                return
+            if isinstance(fetched_page, BaseException):
+                raise fetched_page  # stop processing as the fetcher did
+            yield fetched_page
+
+    # Also if processing stops early: the fetcher stops, too
+    finally:
+        processing_stopped.set()
+
+
+# Posts per request to a WordPress site's REST API (its most), and the
+# post fields needed
+WP_POSTS_PER_REQUEST = 100
+WP_POST_FIELDS = 'id,link,date,title,content'
+
+# Post content in a WordPress site's RSS feed
+RSS_CONTENT = '{http://purl.org/rss/1.0/modules/content/}encoded'
+
+
+def same_link(link, other_link):
+    """Check if two links are the same page (trailing '/' or not)"""
+
+    return link.rstrip('/') == other_link.rstrip('/')
+
+
+def wordpress_site(link):
+    """Address of the WordPress site a page is on, and the page's slug"""
+
+    parts = urllib.parse.urlsplit(link)
+    slug = parts.path.rstrip('/').rpartition('/')[2]
+    return parts.scheme + '://' + parts.netloc, slug
+
+
+def probe_page(serial, url):
+    """Download a page that may well not be there: the response and
+    download time, or None if not had (any status but 200)"""
+
+    try:
+        (response, down_time) = download_page(
+            url, serial.wait_between_requests, missing_ok=True)
+    except DownloadStopped:  # e.g. 401, 403, or a 5xx past the retries
+        return None
+    if response.status != 200:
+        return None
+    return response, down_time
+
+
+def wordpress_api_posts(serial, start_link):
+    """Posts from the one at start_link on, in date order, from the REST
+    API; None if the site has no API or not that post"""
+
+    (site, slug) = wordpress_site(start_link)
+    api = site + '/wp-json/wp/v2/posts'
+
+    # The post to start at, by its slug; no API to be had: not in bulk
+    probed = probe_page(serial, api + '?' + urllib.parse.urlencode(
+        {'slug': slug, '_fields': WP_POST_FIELDS}))
+    if probed is None:
+        return None
+    (response, start_down_time) = probed
+    try:
+        found_posts = json.loads(response.body)
+    except ValueError:  # not JSON: a page, not the API
+        return None
+    if not isinstance(found_posts, list):
+        return None
+    start_posts = [post for post in found_posts
+                   if same_link(post.get('link', ''), start_link)]
+    if not start_posts:
+        return None
+
+    # Posts after it: from a second before it ('after' is exclusive, and a
+    # post of the same second is not to be lost), but the start post (by
+    # its id, and its link)
+    try:
+        after = (datetime.datetime.fromisoformat(start_posts[0]['date']) -
+                 datetime.timedelta(seconds=1)).isoformat()
+    except (KeyError, TypeError, ValueError):
+        return None
+    query = {'after': after, 'orderby': 'date', 'order': 'asc',
+             'per_page': WP_POSTS_PER_REQUEST, '_fields': WP_POST_FIELDS}
+    if 'id' in start_posts[0]:
+        query['exclude'] = start_posts[0]['id']
+
+    def posts():
+        """The start post, then the posts after it, a page at a time"""
+        yield (start_posts[0]['link'], start_posts[0]['title']['rendered'],
+               start_posts[0]['content']['rendered'], start_down_time)
+        api_page = 1
+        while True:
+            (response, down_time) = download_page(
+                api + '?' + urllib.parse.urlencode(dict(query,
+                                                        page=api_page)),
+                serial.wait_between_requests)
+            try:
+                page_posts = json.loads(response.body)
+                for post in page_posts:
+                    if same_link(post['link'], start_link):
+                        continue
+                    yield (post['link'], post['title']['rendered'],
+                           post['content']['rendered'], down_time)
+                    down_time = 0.0  # the request's time with the first
+            except (ValueError, TypeError, KeyError) as this_exception:
+                raise DownloadStopped('Unexpected answer of WordPress API: ' +
+                                      repr(this_exception))
+
+            # Last page: the last the site counts, else one not full
+            total_pages = response.headers.get('X-WP-TotalPages', '')
+            if api_page >= int(total_pages) if total_pages.isdigit() \
+                    else len(page_posts) < WP_POSTS_PER_REQUEST:
+                return
+            api_page += 1
+
+    return posts()
+
+
+def wordpress_feed_posts(serial, start_link):
+    """Posts from the one at start_link on, in date order, from the RSS
+    feed; None if the site has no full-text feed or not that post"""
+
+    (site, _) = wordpress_site(start_link)
+
+    def feed_items():
+        """All items of the feed, oldest first, a feed page at a time"""
+        feed_page = 1
+        while True:
+            (response, down_time) = download_page(
+                site + '/feed/?' + urllib.parse.urlencode({
+                    'orderby': 'date', 'order': 'ASC', 'paged': feed_page}),
+                serial.wait_between_requests, missing_ok=True)
+            if response.status == 404:  # after the last page
+                return
+            if response.status != 200:
+                raise ValueError('feed answered ' + str(response.status))
+            items = xml.etree.ElementTree.fromstring(
+                response.body).findall('./channel/item')
+            if not items:
+                return
+            for item in items:
+                if item.find(RSS_CONTENT) is None:  # excerpts only
+                    raise ValueError('no full text in feed')
+                yield (item.findtext('link', ''),
+                       html.escape(item.findtext('title', '')),
+                       item.findtext(RSS_CONTENT, ''), down_time)
+                down_time = 0.0  # the request's time with the first
+            feed_page += 1
+
+    # Skip the posts before the start; no usable feed (e.g. not allowed,
+    # 401 or 403, or failing): not in bulk
+    items = feed_items()
+    try:
+        for start_item in items:
+            if same_link(start_item[0], start_link):
+                break
+        else:
+            return None
+    except (ValueError, xml.etree.ElementTree.ParseError, DownloadStopped):
+        return None
+
+    def posts():
+        """The start post, then the ones after it"""
+        yield start_item
+        try:
+            yield from items
+        except (ValueError, xml.etree.ElementTree.ParseError) \
+                as this_exception:
+            raise DownloadStopped('Unexpected answer of WordPress feed: ' +
+                                  repr(this_exception))
+
+    return posts()
+
+
+def wordpress_page(serial, title_html, content_html):
+    """Html page of a post, laid out as the serial's pages hold it"""
+
+    def element(name_attrs, default_name, inner_html):
+        """Tag as the serial's content_tags() finds it, around the html"""
+        (tag_name, attrs) = name_attrs or (default_name, {})
+        return '<{0}{1}>{2}</{0}>'.format(
+            tag_name, ''.join(' {}="{}"'.format(name, html.escape(value))
+                              for (name, value) in attrs.items()),
+            inner_html)
+
+    return ('<!DOCTYPE html>\n<html><head><meta charset="utf-8"></head>'
+            '<body>' +
+            element(serial.adapter.title_tag, 'h1', title_html) +
+            element(serial.adapter.content_tag, 'div', content_html) +
+            '</body></html>').encode('utf-8')
+
+
+def fetch_posts(serial, next_link, page_count, visited):
+    """Pages from a WordPress site's posts in bulk, in date order (as its
+    'Next' links go); None if neither its API nor its feed has them"""
+
+    posts = wordpress_api_posts(serial, next_link)
+    if posts is None:
+        posts = wordpress_feed_posts(serial, next_link)
+    if posts is None:
+        return None
+
+    def fetched_posts():
+        """Parse each post, with the link of the one after as next link"""
+        count = page_count
+        post = next(posts, None)
+        while post is not None:
+            following_post = next(posts, None)
+            (link, title_html, content_html, down_time) = post
+            visited.add(link)
+            count += 1
+
+            # Link to follow after this post
+            found_link = following_post[0] if following_post else ''
+            next_link = check_next_link(serial, found_link, visited)
+
+            # Parse it as a page, unless rendered before
+            parse_start_time = time.time()
+            body = wordpress_page(serial, title_html, content_html)
+            (page_memo_key, recalled) = recall_rendering(serial, body,
+                                                         'utf-8')
+            page = None
+            if recalled is None:
+                with METRICS.timer('stage_seconds',
+                                   serial=serial.which_serial,
+                                   stage='parse'):
+                    page = serial.engine.parse(serial, body, 'utf-8')
+
+            yield FetchedPage(count, link, page, found_link, next_link,
+                              down_time, time.time() - parse_start_time,
+                              (page_memo_key, recalled), link)
+            if next_link == '':
+                return
+            post = following_post
+
+    return fetched_posts()
+
+
+# Tags referring to assets in the chapters' html (as Beautiful Soup writes
+# it, values in double quotes): images, sources of pictures, stylesheet
+# links; and their attributes
+ASSET_TAG = re.compile(r'<(?:img|source)\b[^>]*>|'
+                       r'<link\b(?=[^>]*\srel="stylesheet")[^>]*>')
+ASSET_ATTRIBUTE = re.compile(r'\s([\w-]+)="([^"]*)"')
+
+# Attributes holding an asset's url (also lazy loading's), and ones with
+# other sizes of an image, dropped so that the local one is shown
+ASSET_URL_ATTRIBUTES = ('src', 'href', 'data-src')
+ASSET_SIZES_ATTRIBUTES = ('srcset', 'data-srcset', 'sizes')
+
+
+class AssetFetcher:
+    """Images and stylesheets of the chapters, for output that works offline"""
+
+    def __init__(self, serial, writer):
+        self.serial = serial
+        self.writer = writer
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max(1, serial.options['asset-connections']))
+        self.downloads = {}   # url -> future of (body, media type) or None
+        self.references = {}  # url -> reference in the output (or the url)
+
+    def download(self, url):
+        """Asset from the page cache if there, else downloaded; or None"""
+
+        cache = page_cache()
+        cached = cache.get(url) if cache is not None else None
+        if cached is not None:
+            (body, content_type) = cached
+            body = bytes(body)
+        else:
+            try:
+                (response, _) = download_page(
+                    url, self.serial.wait_between_requests)
+            except DownloadStopped as this_stop:
+                self.serial.report('Asset \'' + url + '\' stays remote: ' +
+                                   str(this_stop))
+                return None
+            (body, content_type) = (response.body,
+                                    response.headers.get('Content-Type'))
+
+        # Media type as sent, else as the url's extension says
+        media_type = (content_type or '').split(';')[0].strip().lower() or \
+            mimetypes.guess_type(urllib.parse.urlsplit(url).path)[0] or \
+            'application/octet-stream'
+        return body, media_type
+
+    def reference(self, url, asset):
+        """Reference to an asset: embedded, or its file in the output"""
+
+        if asset is None:
+            return url
+        (body, media_type) = asset
+
+        # Embedded as data, if wanted (or there are no files beside)
+        if self.serial.options['assets'] == 'embed' or \
+                not self.writer.keeps_assets():
+            return ('data:' + media_type + ';base64,' +
+                    base64.b64encode(body).decode('ascii'))
+
+        # File named by its content: stored once, however often used
+        extension = (mimetypes.guess_extension(media_type) or
+                     os.path.splitext(urllib.parse.urlsplit(url).path)[1])
+        return self.writer.put_asset(
+            hashlib.sha256(body).hexdigest() + extension, body, media_type)
+
+    def localize(self, chapter_html, page_url=''):
+        """Download the chapter's assets together, point to them locally"""
+
+        def asset_url(value):
+            """Url of an asset, absolute (relative to the chapter's page)"""
+            return urllib.parse.urljoin(page_url, html.unescape(value))
+
+        urls = [asset_url(value)
+                for asset_tag in ASSET_TAG.findall(chapter_html)
+                for (name, value) in ASSET_ATTRIBUTE.findall(asset_tag)
+                if name in ASSET_URL_ATTRIBUTES]
+        urls = [url for url in urls if url.startswith(('http:', 'https:'))]
+
+        # New assets all at once (as many at a time as allowed)
+        for url in urls:
+            if url not in self.downloads:
+                self.downloads[url] = self.executor.submit(self.download, url)
+        for url in urls:
+            if url not in self.references:
+                self.references[url] = self.reference(
+                    url, self.downloads[url].result())
+
+        def local(found):
+            """Attribute with the local asset, if any; no other sizes"""
+            (name, value) = found.groups()
+            if name in ASSET_SIZES_ATTRIBUTES:
+                return ''
+            if name not in ASSET_URL_ATTRIBUTES:
+                return found.group(0)
+            url = asset_url(value)
+            return ' ' + name + '="' + html.escape(
+                self.references.get(url, url)) + '"'
+
+        return ASSET_TAG.sub(
+            lambda found: ASSET_ATTRIBUTE.sub(local, found.group(0)),
+            chapter_html)
+
+    def close(self):
+        """Stop downloading"""
+
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Bytes of output collected in memory before they are written
+OUTPUT_BUFFER_SIZE = 1024 * 1024
+
+# Compressed output, by file name extension
+OUTPUT_COMPRESSIONS = {'.gz': gzip, '.bz2': bz2, '.xz': lzma}
+
+
+class OutputWriter:
+    """Output of a download as one HTML file, open throughout; spools notes"""
+
+    def __init__(self, serial, continued=False):
+        self.serial = serial
+        self.position = 0  # bytes written (chapters, for other formats)
+        self.open_output(continued)
+
+        # Notes to append after the story; on disk only beyond the spool size
+        spool_size = serial.options['spool-size'] * 1024 ** 2
+        self.notes = (tempfile.SpooledTemporaryFile(max_size=spool_size)
+                      if spool_size > 0 else tempfile.TemporaryFile())
+        self.note_sizes = []  # (title, bytes) of each note spooled
+
+        # Images and stylesheets fetched to go with the output, if wanted
+        self.assets = (AssetFetcher(serial, self)
+                       if serial.options['assets'] else None)
+
+    @staticmethod
+    def resumable(serial):
+        """Check if the output can be cut back to a checkpoint, continued"""
+
+        return serial.options['format'] == 'html' and \
+            serial.pages_file != '-' and \
+            os.path.splitext(serial.pages_file)[1].lower() \
+            not in OUTPUT_COMPRESSIONS
+
+    def open_output(self, continued):
+        """Open standard output, compressed stream, or plain file"""
+
+        output_file = self.serial.pages_file
+        compression = OUTPUT_COMPRESSIONS.get(
+            os.path.splitext(output_file)[1].lower())
+
+        self.to_stdout = output_file == '-'
+        if self.to_stdout:
+            self.output = sys.stdout.buffer
+        elif compression is not None:
+            self.output = compression.open(output_file, 'wb')
+        else:
+            self.output = open(output_file, 'ab' if continued else 'wb',
+                               buffering=OUTPUT_BUFFER_SIZE)
+        if continued:
+            self.position = self.output.tell()
+
+    def write(self, text):
+        """Write html to the output"""
+
+        html_bytes = text.encode('utf-8')
+        self.output.write(html_bytes)
+        self.position += len(html_bytes)
+
+    def begin(self):
+        """Write html opening"""
+
+        self.write('<html>\n<head>\n<title>' + self.serial.page_title +
+                   '</title>\n<meta content=\'text/html; charset=UTF-8\' '
+                   'http-equiv=\'Content-Type\'>\n</head>\n<body>\n')
+
+    def add_chapter(self, chap_title, chapter_html, to_notes=False,
+                    page_url=''):
+        """Add a chapter (from page_url) to the story, or to the notes to
+        append"""
+
+        if self.assets is not None:
+            with METRICS.timer('stage_seconds',
+                               serial=self.serial.which_serial,
+                               stage='assets'):
+                chapter_html = self.assets.localize(chapter_html, page_url)
+
+        if to_notes:
+            html_bytes = chapter_html.encode('utf-8')
+            self.notes.write(html_bytes)
+            self.note_sizes.append((chap_title, len(html_bytes)))
+        else:
+            self.put_chapter(chap_title, chapter_html)
+
+    def put_chapter(self, chap_title, chapter_html):
+        """Write a chapter to the output"""
+
+        self.write(chapter_html)
+
+    def keeps_assets(self):
+        """Check if assets can be files beside the output"""
+
+        return not self.to_stdout
+
+    def asset_directory(self):
+        """Directory of the assets, and how the output refers to it"""
+
+        files_directory = os.path.splitext(self.serial.pages_file)[0] + \
+            '_files'
+        return files_directory, os.path.basename(files_directory) + '/'
+
+    def put_asset(self, file_name, body, media_type):
+        """Store an asset beside the output (once), return its reference"""
+
+        (directory, reference_base) = self.asset_directory()
+        asset_file = os.path.join(directory, file_name)
+        if not os.path.isfile(asset_file):
+            os.makedirs(directory, exist_ok=True)
+            with open(asset_file + '.part', 'wb') as asset:
+                asset.write(body)
+            os.replace(asset_file + '.part', asset_file)
+        return reference_base + urllib.parse.quote(file_name)
+
+    def spooled_notes(self):
+        """Title and html of each spooled note, in order"""
+
+        self.notes.seek(0)
+        for (chap_title, size) in self.note_sizes:
+            yield (chap_title, self.notes.read(size).decode('utf-8'))
+
+    def checkpoint(self):
+        """Hand the output written so far to the system, return its size"""
+
+        self.output.flush()
+        return self.position
+
+    def append_notes(self):
+        """Copy the spooled notes to the output in one go, if any"""
+
+        notes_size = self.notes.tell()
+        self.notes.seek(0)
+        shutil.copyfileobj(self.notes, self.output, OUTPUT_BUFFER_SIZE)
+        self.position += notes_size
+        return notes_size > 0
+
+    def finish(self):
+        """Write html closing"""
+
+        self.write('\n</body>\n</html>')
+
+    def close(self):
+        """Write what's left, close the output (but not standard output)"""
+
+        self.notes.close()
+        if self.assets is not None:
+            self.assets.close()
+        if self.to_stdout:
+            self.output.flush()
+        else:
+            self.output.close()
+
+
+class SplitOutputWriter(OutputWriter):
+    """Output as a directory of chapter files and an index page"""
+
+    def open_output(self, continued):
+        """Make the directory; chapters are files in it"""
+
+        self.directory = self.serial.pages_file
+        os.makedirs(self.directory, exist_ok=True)
+        self.chapters = []    # (file name, title) of each chapter
+        self.pending = None   # Last chapter, written once the next is known
+
+    def chapter_file(self, chapter_number):
+        """Name of a chapter's file, counting from 1"""
+
+        return '{:04d}.html'.format(chapter_number)
+
+    def write_file(self, file_name, title, body_html):
+        """Write a whole HTML page to the directory"""
+
+        with open(os.path.join(self.directory, file_name), 'w',
+                  encoding='utf-8') as page:
+            page.write('<html>\n<head>\n<title>' + title + '</title>\n'
+                       '<meta content=\'text/html; charset=UTF-8\' '
+                       'http-equiv=\'Content-Type\'>\n</head>\n<body>\n' +
+                       body_html + '\n</body>\n</html>')
+
+    def write_pending(self, has_next):
+        """Write the last chapter, with links to the ones around it"""
+
+        if self.pending is None:
+            return
+        (chapter_number, chap_title, chapter_html) = self.pending
+        self.pending = None
+
+        links = []
+        if chapter_number > 1:
+            links.append('<a href="' + self.chapter_file(chapter_number - 1) +
+                         '">Previous</a>')
+        links.append('<a href="index.html">Contents</a>')
+        if has_next:
+            links.append('<a href="' + self.chapter_file(chapter_number + 1) +
+                         '">Next</a>')
+        navigation = '<p>' + ' | '.join(links) + '</p>\n'
+
+        self.write_file(self.chapter_file(chapter_number),
+                        html.escape(chap_title) + ' – ' +
+                        self.serial.page_title,
+                        navigation + chapter_html + navigation)
+
+    def write_index(self):
+        """Write the index page, listing the chapters written"""
+
+        self.write_file('index.html', self.serial.page_title,
+                        '<h1>' + self.serial.page_title + '</h1>\n<ol>\n' +
+                        ''.join('<li><a href="' + file_name + '">' +
+                                html.escape(chap_title) + '</a></li>\n'
+                                for (file_name, chap_title) in self.chapters) +
+                        '</ol>')
+
+    def keeps_assets(self):
+        """Assets are files in the directory"""
+
+        return True
+
+    def asset_directory(self):
+        """Directory of the assets, and how the chapters refer to it"""
+
+        return os.path.join(self.directory, 'assets'), 'assets/'
+
+    def begin(self):
+        """Nothing to write before the first chapter"""
+
+    def put_chapter(self, chap_title, chapter_html):
+        """Keep the chapter until the next is known, write the one before"""
+
+        self.write_pending(has_next=True)
+        self.chapters.append((self.chapter_file(len(self.chapters) + 1),
+                              chap_title))
+        self.pending = (len(self.chapters), chap_title, chapter_html)
+        self.position = len(self.chapters)
+
+    def checkpoint(self):
+        """Chapters so far (written when the next one comes)"""
+
+        return self.position
+
+    def append_notes(self):
+        """Add each spooled note as a chapter, if any"""
+
+        for (chap_title, chapter_html) in self.spooled_notes():
+            self.put_chapter(chap_title, chapter_html)
+        return bool(self.note_sizes)
+
+    def finish(self):
+        """Nothing to write after the last chapter"""
+
+    def close(self):
+        """Write the last chapter and the index, also if stopped"""
+
+        self.notes.close()
+        if self.assets is not None:
+            self.assets.close()
+        self.write_pending(has_next=False)
+        self.write_index()
+
+
+# EPUB container: which file is the package document
+EPUB_CONTAINER = ('<?xml version="1.0" encoding="utf-8"?>\n'
+                  '<container version="1.0" xmlns="urn:oasis:names:tc:'
+                  'opendocument:xmlns:container">\n<rootfiles>\n'
+                  '<rootfile full-path="OEBPS/content.opf" '
+                  'media-type="application/oebps-package+xml"/>\n'
+                  '</rootfiles>\n</container>\n')
+
+# EPUB page (chapter or navigation), XHTML
+EPUB_PAGE = ('<?xml version="1.0" encoding="utf-8"?>\n<!DOCTYPE html>\n'
+             '<html xmlns="http://www.w3.org/1999/xhtml" '
+             'xmlns:epub="http://www.idpf.org/2007/ops" lang="en">\n'
+             '<head>\n<title>{title}</title>\n</head>\n<body>\n{body}\n'
+             '</body>\n</html>\n')
+
+
+class EpubOutputWriter(OutputWriter):
+    """Output as an EPUB book, each chapter added to the zip when done"""
+
+    def open_output(self, continued):
+        """Start the zip: mimetype first and stored, then the container"""
+
+        self.output = zipfile.ZipFile(sys.stdout.buffer
+                                      if self.serial.pages_file == '-'
+                                      else self.serial.pages_file,
+                                      'w', zipfile.ZIP_DEFLATED)
+        self.output.writestr(zipfile.ZipInfo('mimetype'),
+                             'application/epub+zip',
+                             compress_type=zipfile.ZIP_STORED)
+        self.output.writestr('META-INF/container.xml', EPUB_CONTAINER)
+        self.chapters = []  # (file name, title) of each chapter
+        self.asset_files = {}  # file name -> media type, of assets added
+
+    def keeps_assets(self):
+        """Assets are files in the book"""
+
+        return True
+
+    def put_asset(self, file_name, body, media_type):
+        """Add an asset to the book (once), return its reference"""
+
+        if file_name not in self.asset_files:
+            self.output.writestr('OEBPS/assets/' + file_name, body)
+            self.asset_files[file_name] = media_type
+        return 'assets/' + file_name
+
+    def begin(self):
+        """Nothing to write before the first chapter"""
+
+    def put_chapter(self, chap_title, chapter_html):
+        """Add the chapter as an XHTML page to the zip"""
+
+        # Chapter html reparsed, to write it well-formed
+        lxml_module = import_lxml()
+        chapter_tree = lxml_module.html.fragment_fromstring(
+            chapter_html, create_parent='div')
+        chapter_xhtml = lxml_module.etree.tostring(
+            chapter_tree, encoding='unicode', method='xml')
+
+        file_name = 'chapter-{:04d}.xhtml'.format(len(self.chapters) + 1)
+        self.output.writestr('OEBPS/' + file_name,
+                             EPUB_PAGE.format(title=html.escape(chap_title),
+                                              body=chapter_xhtml))
+        self.chapters.append((file_name, chap_title))
+        self.position = len(self.chapters)
+
+    def checkpoint(self):
+        """Chapters so far (each added to the zip in full)"""
+
+        return self.position
+
+    def append_notes(self):
+        """Add each spooled note as a chapter, if any"""
+
+        for (chap_title, chapter_html) in self.spooled_notes():
+            self.put_chapter(chap_title, chapter_html)
+        return bool(self.note_sizes)
+
+    def finish(self):
+        """Nothing to write after the last chapter"""
+
+    def close(self):
+        """Add navigation and package document, also if stopped; close zip"""
+
+        self.notes.close()
+        if self.assets is not None:
+            self.assets.close()
+        title = html.escape(self.serial.page_title)
+
+        # Table of contents from the chapter titles
+        self.output.writestr('OEBPS/nav.xhtml', EPUB_PAGE.format(
+            title=title,
+            body='<nav epub:type="toc" id="toc">\n<h1>' + title +
+                 '</h1>\n<ol>\n' +
+                 ''.join('<li><a href="' + file_name + '">' +
+                         html.escape(chap_title) + '</a></li>\n'
+                         for (file_name, chap_title) in self.chapters) +
+                 '</ol>\n</nav>'))
+
+        # Package document: metadata, all files, reading order
+        book_id = uuid.uuid5(uuid.NAMESPACE_URL, self.serial.first_link)
+        self.output.writestr('OEBPS/content.opf', (
+            '<?xml version="1.0" encoding="utf-8"?>\n'
+            '<package xmlns="http://www.idpf.org/2007/opf" version="3.0" '
+            'unique-identifier="book-id">\n'
+            '<metadata xmlns:dc="http://purl.org/dc/elements/1.1/">\n'
+            '<dc:identifier id="book-id">urn:uuid:' + str(book_id) +
+            '</dc:identifier>\n<dc:title>' + title + '</dc:title>\n'
+            '<dc:language>en</dc:language>\n'
+            '<meta property="dcterms:modified">' +
+            time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()) +
+            '</meta>\n</metadata>\n<manifest>\n'
+            '<item id="nav" href="nav.xhtml" '
+            'media-type="application/xhtml+xml" properties="nav"/>\n' +
+            ''.join('<item id="{0}" href="{1}" media-type="application/'
+                    'xhtml+xml"/>\n'.format(file_name[:-6], file_name)
+                    for (file_name, _) in self.chapters) +
+            ''.join('<item id="asset-{0}" href="assets/{1}" media-type="{2}"'
+                    '/>\n'.format(asset_number, file_name, media_type)
+                    for (asset_number, (file_name, media_type))
+                    in enumerate(sorted(self.asset_files.items()), 1)) +
+            '</manifest>\n<spine>\n' +
+            ''.join('<itemref idref="{}"/>\n'.format(file_name[:-6])
+                    for (file_name, _) in self.chapters) +
+            '</spine>\n</package>\n'))
+
+        self.output.close()
+
+
+# Output writers, by run option 'format'
+OUTPUT_FORMATS = {'html': OutputWriter,
+                  'split': SplitOutputWriter,
+                  'epub': EpubOutputWriter}
+
+
+def decluttered_html(serial, out_title, out_chap):
+    """Chapter html: its content, after its headline if that is separate"""
+
+    return (out_title if serial.title_separate else '') + out_chap
+
+
+def write_chapter(serial, writer, chap_title, out_title, out_chap,
+                  to_notes=False, page_url=''):
+    """Append chapter title and content strings to story or notes"""
+
+    chapter_html = (decluttered_html(serial, out_title, out_chap) +
+                    '<p>&nbsp;</p>\n')  # Add blank line
+    writer.add_chapter(chap_title, chapter_html, to_notes, page_url)
+
+    return chapter_html
+
+
+# Version of the rendering code, part of the memo keys; count up when
+# changing how pages are rendered (rule changes are seen by themselves)
+MEMO_VERSION = 1
+
+
+def memo_key(serial, body, charset):
+    """Key of a page's rendering: its content, and all that renders it"""
+
+    profile = json.dumps([MEMO_VERSION, serial.which_serial, serial.get_notes,
+                          serial.pars, serial.engine.name,
+                          serial.rel_link_base, charset,
+                          serial.adapter.clutter.version])
+    return (hashlib.sha256(body).hexdigest() + '-' +
+            hashlib.sha256(profile.encode('utf-8')).hexdigest()[:16])
+
+
+def recall_rendering(serial, body, charset):
+    """Memo key of a page and its results rendered before, if any"""
+
+    memo = memo_store()
+    if memo is None:
+        return None, None
+
+    page_memo_key = memo_key(serial, body, charset)
+    recalled = memo.recall(page_memo_key)
+    METRICS.count('memo_lookups_total', serial=serial.which_serial,
+                  result='miss' if recalled is None else 'hit')
+    return page_memo_key, recalled
+
+
+def remember_rendering(page_memo_key, found_link, rendered):
+    """Store a page's results in the memo store, if kept"""
+
+    if page_memo_key is not None:
+        (chap_title, is_note, out_title, out_chap) = rendered
+        memo_store().remember(page_memo_key, {'found_link': found_link,
+                                              'chap_title': chap_title,
+                                              'is_note': is_note,
+                                              'out_title': out_title,
+                                              'out_chap': out_chap})
+
+
+def recalled_page(recalled):
+    """Rendering results as render_page() returns them, from the memo"""
+
+    return (recalled['chap_title'], recalled['is_note'],
+            recalled['out_title'], recalled['out_chap'])
+
+
+# Whitespace (also as entity) in a row, in headlines
+WHITESPACE_RUN = re.compile(r'(\s|&nbsp;)+')
+
+
+def render_page(serial, page, next_link):
+    """Find headline and content of a parsed page, remove clutter"""
+
+    adapter = serial.adapter
+
+    # Get tags holding headline and content
+    with METRICS.timer('stage_seconds', serial=serial.which_serial,
+                       stage='content_tags'):
+        (chap_title_tag, chap_cont_tag) = adapter.content_tags(serial, page)
+
+    # Get page title and clean some multiple whitespace
+    if chap_title_tag is not None:
+        chap_title = WHITESPACE_RUN.sub(
+            ' ', serial.engine.text(chap_title_tag)).strip()
+    else:
+        chap_title = '<No Page Headline>'
+
+    # Check if Notes page
+    is_note = adapter.is_note(chap_title)
+
+    # If Notes page to omit: no content to process
+    if serial.get_notes == 'omit' and is_note:
+        return chap_title, is_note, None, None
+
+    # Process page content, the serial's way
+    with METRICS.timer('stage_seconds', serial=serial.which_serial,
+                       stage='declutter'):
+        (out_title, out_chap) = adapter.declutter(serial, chap_title_tag,
+                                                  chap_cont_tag, next_link)
+
+    return chap_title, is_note, out_title, out_chap
+
+
+# Page as handed from rendering to writing: chapter count, url of the page,
+# the link found on it, the link to follow after it, the download and
+# processing times, its title, whether it's a Notes page, its headline and
+# content html (None if not written), its url after redirects, and the
+# fingerprint of the chapter (None if not written)
+RenderedPage = collections.namedtuple('RenderedPage',
+                                      'count link found_link next_link '
+                                      'down_time proc_time chap_title '
+                                      'is_note out_title out_chap '
+                                      'final_url fingerprint')
+
+
+def render_pages(serial, fetched_pages, visited):
+    """Render fetched pages one after another, in this process"""
+
+    for fetched_page in fetched_pages:
+        render_start_time = time.time()
+        (page_memo_key, recalled) = fetched_page.memo
+
+        # Rendered before, or render now and keep the results
+        if recalled is not None:
+            rendered = recalled_page(recalled)
+        else:
+            rendered = render_page(serial, fetched_page.page,
+                                   fetched_page.found_link)
+            remember_rendering(page_memo_key, fetched_page.found_link,
+                               rendered)
+
+            # Done with the page: free its tree now, not some pages later
+            serial.engine.free(fetched_page.page)
+
+        # Chapter written before (from another url): not written again
+        fingerprint = content_fingerprint(*rendered[2:])
+        if visited.has_content(fingerprint):
+            METRICS.count('duplicate_pages_total', serial=serial.which_serial,
+                          reason='content')
+            (rendered, fingerprint) = (rendered[:2] + (None, None), None)
+        visited.add_content(fingerprint)
+
+        yield RenderedPage(fetched_page.count, fetched_page.link,
+                           fetched_page.found_link, fetched_page.next_link,
+                           fetched_page.down_time,
+                           fetched_page.parse_time +
+                           time.time() - render_start_time, *rendered,
+                           fetched_page.final_url, fingerprint)
+
+
+def download_pages(serial, next_link, page_count, visited):
+    """Download and render pages, one after another or pipelined"""
+
+    # In bulk from a WordPress site, if wanted and it has them
+    if serial.options['bulk'] and \
+            serial.adapter.is_wordpress(serial, next_link):
+        fetched_pages = fetch_posts(serial, next_link, page_count, visited)
+        if fetched_pages is not None:
+            return render_pages(serial, fetched_pages, visited)
+
+    if serial.options['pipeline']:
+        return render_pages(serial, fetch_pages_pipelined(
+            serial, next_link, page_count, visited), visited)
+    return render_pages(serial, fetch_pages(serial, next_link, page_count,
+                                            visited), visited)
+
+
+def rerender_page(serial, body, charset):
+    """Parse and render a stored page (in a worker process)"""
+
+    proc_start_time = time.time()
+    (page, found_link) = parse_page(serial, body, charset)
+    rendered = render_page(serial, page, found_link)
+    serial.engine.free(page)
+
+    return (found_link, time.time() - proc_start_time) + rendered
+
+
+def rerender_chain(serial):
+    """Pages of the last download, in chain order, and if it was complete"""
+
+    if serial.options['resume'] or serial.options['update']:
+        serial.report('\nRe-render with \'--rerender\' alone, then resume '
+                      'or update.\n')
+        sys.exit()
+
+    # The journal of the serial's HTML file has the chain of pages: the
+    # output file, else the HTML file of its name
+    html_file = serial.pages_file
+    if serial.options['format'] != 'html':
+        html_file = os.path.splitext(serial.pages_file)[0] + '.html'
+    journal = Journal(journal_file(html_file))
+    journal.close()
+    if not journal.records or \
+            journal.records[0].get('serial') != serial.which_serial or \
+            journal.records[0].get('get_notes') != serial.get_notes:
+        serial.report('\nNo download of \'' + serial.page_title +
+                      '\' to re-render; download it to an HTML file '
+                      'first.\n')
+        sys.exit()
+
+    # Its pages are taken from the page cache
+    if page_cache() is None:
+        serial.report('\nRe-rendering needs the page cache the pages were '
+                      'downloaded to (\'--cache\').\n')
+        sys.exit()
+
+    chapters = [record for record in journal.records if 'url' in record]
+    return chapters, 'closing' in journal.records[-1]
+
+
+def rerender_pages(serial, chapters):
+    """Render stored pages in worker processes, hand them on in order"""
+
+    cache = page_cache()
+    workers = serial.options['workers'] or os.cpu_count() or 1
+    # (chapter, memo key, future or results rendered before), chain order
+    rendering = collections.deque()
+
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        chapter_records = iter(chapters)
+        while True:
+
+            # Keep all workers busy, a few pages ahead
+            for chapter in chapter_records:
+                cached = cache.get(chapter['url'])
+                if cached is None:
+                    serial.report('\nPage \'' + chapter['url'] + '\' is not '
+                                  'in the page cache, can\'t re-render.\n')
+                    sys.exit()
+                (body, content_type) = cached
+                body = bytes(body)
+                content_headers = http.client.HTTPMessage()
+                if content_type:
+                    content_headers['Content-Type'] = content_type
+                charset = content_headers.get_content_charset()
+
+                # Rendered before in the same way, or by a worker now
+                (page_memo_key, recalled) = recall_rendering(serial, body,
+                                                             charset)
+                rendering.append((chapter, page_memo_key, recalled
+                                  if recalled is not None else
+                                  executor.submit(rerender_page, serial,
+                                                  body, charset)))
+                if len(rendering) >= 4 * workers:
+                    break
+            if not rendering:
+                return
+
+            # Pages come out in chain order, whichever worker is done first
+            (chapter, page_memo_key, rendering_page) = rendering.popleft()
+            if isinstance(rendering_page, dict):
+                (found_link, proc_time, rendered) = \
+                    (rendering_page['found_link'], 0.0,
+                     recalled_page(rendering_page))
+            else:
+                (found_link, proc_time, *rendered) = rendering_page.result()
+                remember_rendering(page_memo_key, found_link, rendered)
+            yield RenderedPage(chapter['page'], chapter['url'], found_link,
+                               chapter['next_link'], 0.0, proc_time,
+                               *rendered,
+                               chapter.get('final_url', chapter['url']),
+                               content_fingerprint(*rendered[2:]))
+
+
+# Parsers calibration tries, each with the engine to use it with (lxml's
+# only parses with 'lxml', see PARSE_ENGINES)
+CALIBRATION_CANDIDATES = [('lxml', 'lxml'), ('lxml', 'soup'),
+                          ('html.parser', 'soup'), ('html5lib', 'soup')]
+
+# Times each sample page is parsed and rendered; the fastest time counts
+CALIBRATION_REPEATS = 3
+
+# Parsers chosen by calibration, by serial (title or start URL); in the
+# working directory, read whenever a serial is configured
+CALIBRATION_FILE = 'ChapterChainer.calibration.json'
+
+# Whitespace in a row, and preformatted blocks (where it shows), in html
+HTML_WHITESPACE_RUN = re.compile('[' + ASCII_SPACES + ']+')
+PRE_BLOCK = re.compile(r'(<pre\b.*?</pre>)', re.DOTALL | re.IGNORECASE)
+
+
+def calibrated_parser(which_serial):
+    """Parser and engine calibration chose for a serial, or None"""
+
+    try:
+        with open(CALIBRATION_FILE, encoding='utf-8') as calibration_file:
+            calibration = json.load(calibration_file).get(which_serial)
+    except (OSError, ValueError):  # none yet, or not readable
+        return None
+    if calibration is None or not parser_available(calibration['pars']):
+        return None
+    return calibration['pars'], calibration['engine']
+
+
+def save_calibration(which_serial, calibration):
+    """Store a serial's calibration, keep the other serials' ones"""
+
+    try:
+        with open(CALIBRATION_FILE, encoding='utf-8') as calibration_file:
+            calibrations = json.load(calibration_file)
+    except (OSError, ValueError):
+        calibrations = {}
+    calibrations[which_serial] = calibration
+    with open(CALIBRATION_FILE + '.part', 'w', encoding='utf-8') \
+            as calibration_file:
+        json.dump(calibrations, calibration_file, indent=2, sort_keys=True)
+    os.replace(CALIBRATION_FILE + '.part', CALIBRATION_FILE)
+
+
+def parser_available(pars):
+    """Check if Beautiful Soup has the parser (i.e. it is installed)"""
+
+    return import_soup().builder.builder_registry.lookup(pars) is not None
+
+
+def serial_parsed_with(serial, pars, engine_name):
+    """Copy of the serial, parsing with that parser and engine"""
+
+    parsed_with = copy.copy(serial)
+    parsed_with.pars = pars
+    parsed_with.engine = PARSE_ENGINES[engine_name if pars == 'lxml'
+                                       else 'soup']
+    return parsed_with
+
+
+def sample_pages(serial, sample_count):
+    """Html and encoding of the serial's first pages, as the chain goes"""
+
+    samples = []
+    (next_link, visited) = (serial.first_link, VisitedIndex())
+    while next_link != '' and len(samples) < sample_count:
+        visited.add(next_link)
+        (response, _) = download_page(next_link, serial.wait_between_requests)
+        charset = response.headers.get_content_charset()
+        samples.append((response.body, charset))
+
+        (page, found_link) = parse_page(serial, response.body, charset)
+        serial.engine.free(page)
+        next_link = check_next_link(serial, found_link, visited)
+
+    return samples
+
+
+def render_samples(serial, samples):
+    """Renderings of the sample pages (next link first), and the seconds
+    it takes to parse and render them all"""
+
+    renderings = []
+    seconds = 0.0
+    for (body, charset) in samples:
+        times = []
+        for _ in range(CALIBRATION_REPEATS):
+            start_time = time.perf_counter()
+            (page, found_link) = parse_page(serial, body, charset)
+            rendering = (found_link,) + render_page(serial, page, found_link)
+            serial.engine.free(page)
+            times.append(time.perf_counter() - start_time)
+        renderings.append(rendering)
+        seconds += min(times)
+
+    return renderings, seconds
+
+
+def html_shown(out_html):
+    """Html as a browser shows it: whitespace in a row as one space (but
+    in <pre> blocks)"""
+
+    if out_html is None:
+        return None
+    parts = PRE_BLOCK.split(out_html)
+    parts[::2] = [HTML_WHITESPACE_RUN.sub(' ', part) for part in parts[::2]]
+    return ''.join(parts)
+
+
+def same_rendering(rendering, other_rendering):
+    """Check if two renderings of a page (next link, title, if a Notes page,
+    headline and content html) show the same"""
+
+    return rendering[:3] == other_rendering[:3] and \
+        all(html_shown(out_html) == html_shown(other_html)
+            for (out_html, other_html) in zip(rendering[3:],
+                                              other_rendering[3:]))
+
+
+def calibrate_parsers(serial):
+    """Render sample pages with each parser; keep the fastest that renders
+    them as the serial's own parser does"""
+
+    # The serial's own parser (as its adapter sets it) renders them right
+    adapter = serial.adapter
+    reference = serial_parsed_with(serial, adapter.pars, adapter.engine)
+    serial.report('Calibrating parsers for \'' + serial.page_title +
+                  '\' on up to ' + str(serial.options['calibrate']) +
+                  ' pages...')
+    samples = sample_pages(reference, serial.options['calibrate'])
+    if not samples:
+        serial.report('No pages to calibrate on.')
+        return
+    (reference_renderings, _) = render_samples(reference, samples)
+
+    # Each parser available on the same pages: its time, and if it is right
+    results = {}
+    serial.report('Parser       Engine   Time per page')
+    for (pars, engine_name) in CALIBRATION_CANDIDATES:
+        if not parser_available(pars):
+            continue
+        (renderings, seconds) = render_samples(
+            serial_parsed_with(serial, pars, engine_name), samples)
+        same = all(map(same_rendering, reference_renderings, renderings))
+        results[(pars, engine_name)] = (seconds / len(samples), same)
+        serial.report('{: <12} {: <6} {: >10.2f} ms   {}'.format(
+            pars, engine_name, seconds / len(samples) * 1000,
+            'same' if same else 'differs'))
+
+    # Fastest of the right ones (the serial's own is right, at least)
+    (pars, engine_name) = min((choice for choice in results
+                               if results[choice][1]),
+                              key=lambda choice: results[choice][0])
+    save_calibration(serial.which_serial, {
+        'pars': pars, 'engine': engine_name,
+        'sample_pages': len(samples),
+        'ms_per_page': {choice[0] + ' ' + choice[1]:
+                        round(result[0] * 1000, 3)
+                        for (choice, result) in results.items()},
+        'calibrated': time.strftime('%Y-%m-%d %H:%M:%S')})
+    serial.report('\'' + pars + '\' with engine \'' + engine_name +
+                  '\' is the fastest of the same results; saved to \'' +
+                  CALIBRATION_FILE + '\'.\n')
+
+
+def process_page(serial, rendered_pages, writer, journal):
+    """Write & checkpoint each rendered page, until no next link"""
+
+    for rendered_page in rendered_pages:
+        (page_count, chap_title, out_title, out_chap)\
+            = (rendered_page.count, rendered_page.chap_title,
+               rendered_page.out_title, rendered_page.out_chap)
+        to_notes = False  # Notes to append after the story
+        chapter_html = None
+
+        # Start writing time (processing time so far is added)
+        proc_start_time = time.time() - rendered_page.proc_time
+
+        # If Notes page to omit (or a chapter written before): skip
+        # appending to output
+        if rendered_page.out_chap is None:
+
+            # User feedback, incl. processing time
+            trunc_title = ('<Skipping> ' + chap_title[:33] +
+                           (chap_title[33:] and '…')  # 'and', not '+' ==> bool
+                           )
+
+        else:
+            # Write to story or notes?
+            to_notes = serial.get_notes == 'append' and rendered_page.is_note
+
+            # Append chapter title and content strings to story or notes
+            with METRICS.timer('stage_seconds', serial=serial.which_serial,
+                               stage='write'):
+                chapter_html = write_chapter(serial, writer, chap_title,
+                                             out_title, out_chap, to_notes,
+                                             rendered_page.final_url)
+
+            trunc_title = (chap_title[:44] + (chap_title[44:] and '…'))
+
+        # User feedback, incl. processing time
+        serial.report('{: >5}   {: <45}   {:.3f} sec.   {:.3f} sec.'
+                      .format(page_count, trunc_title[:45],
+                              rendered_page.down_time,
+                              time.time() - proc_start_time))
+
+        # Checkpoint: page done, output so far, where to go on; the html of
+        # notes to append, as they are only spooled until the end
+        checkpoint = {'page': page_count,
+                      'url': rendered_page.link,
+                      'title': chap_title,
+                      'note': rendered_page.is_note,
+                      'next_link': rendered_page.next_link,
+                      'final_url': rendered_page.final_url,
+                      'fingerprint': rendered_page.fingerprint,
+                      'offset': writer.checkpoint()}
+        if to_notes:
+            checkpoint['note_html'] = chapter_html
+        journal.add(checkpoint)
+        serial.progress = (page_count, chap_title)
+
+        # One more page for the metrics
+        METRICS.count('pages_total', serial=serial.which_serial)
+
+        # Told to stop (a worker that lost its job), with the output closed
+        if serial.cancel is not None:
+            raise DownloadStopped(serial.cancel)
+
+
+def journal_file(pages_file):
+    """Journal of an HTML output file: its name, '.journal' appended"""
+
+    return pages_file + '.journal'
+
+
+class Journal:
+    """Checkpoints of a download, to resume it or to add new chapters"""
+
+    def __init__(self, journal_file):
+        self.journal_file = journal_file  # None: output can't be continued
+        self.records = []
+        self.journal = None  # Open for appending, once written to
+
+        # Earlier checkpoints, if any
+        if journal_file is not None and os.path.isfile(journal_file):
+            with open(journal_file, encoding='utf-8') as journal:
+                for this_line in journal:
+                    try:
+                        self.records.append(json.loads(this_line))
+                    except ValueError:  # cut off by a crash while writing
+                        break
+
+    def write_all(self):
+        """Write the journal anew with the records kept"""
+
+        self.close()
+        if self.journal_file is None:
+            return
+        self.journal = open(self.journal_file, 'w', encoding='utf-8')
+        for record in self.records:
+            self.journal.write(json.dumps(record) + '\n')
+        self.journal.flush()
+
+    def start(self, header):
+        """Begin a new journal with the download's settings"""
+
+        self.records = [header]
+        self.write_all()
+
+    def add(self, record):
+        """Append a checkpoint"""
+
+        self.records.append(record)
+        if self.journal_file is None:
+            return
+        if self.journal is None:
+            self.journal = open(self.journal_file, 'a', encoding='utf-8')
+        self.journal.write(json.dumps(record) + '\n')
+        self.journal.flush()  # a crash loses at most the page being done
+
+    def rewind(self, keep_count):
+        """Drop all but the first checkpoints"""
+
+        self.records = self.records[:keep_count]
+        self.write_all()
+
+    def close(self):
+        """Close the journal file, if open"""
+
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+
+def resume_download(serial, journal):
+    """Cut output back to a checkpoint, return where to continue from"""
+
+    # Only a plain file can be cut back and continued
+    if not OutputWriter.resumable(serial):
+        serial.report('\nOutput to \'' + serial.pages_file + '\' can\'t be '
+                      'continued; resume or update a plain HTML file.\n')
+        sys.exit()
+
+    # A journal of this serial, with the same output, is needed
+    if not journal.records or not os.path.isfile(serial.pages_file) or \
+            journal.records[0].get('serial') != serial.which_serial or \
+            journal.records[0].get('get_notes') != serial.get_notes:
+        serial.report('\nNo download of \'' + serial.page_title +
+                      '\' to file \'' + serial.pages_file +
+                      '\' to continue.\n')
+        sys.exit()
+
+    header = journal.records[0]
+    chapters = [record for record in journal.records if 'url' in record]
+    closing = journal.records[-1] if 'closing' in journal.records[-1] else None
+
+    if serial.options['update']:
+        if closing is None:
+            serial.report('\nLast download is not complete, '
+                          'use \'--resume\'.\n')
+            sys.exit()
+
+        # Last page again, to see if it links to a new one now
+        kept_chapters = chapters[:-1]
+        next_link = chapters[-1]['url'] if chapters else header['first_link']
+
+    else:
+        if closing is not None:
+            serial.report('\nLast download is complete, use \'--update\' to '
+                          'add new chapters.\n')
+            sys.exit()
+
+        # Go on from the last page written
+        kept_chapters = chapters
+        next_link = (chapters[-1]['next_link'] if chapters
+                     else header['first_link'])
+
+    # Output up to the last kept page
+    with open(serial.pages_file, 'r+b') as pages:
+        pages.truncate(kept_chapters[-1]['offset'] if kept_chapters
+                       else header['offset'])
+    journal.rewind(1 + len(kept_chapters))
+
+    # Pages and chapters done are not downloaded or written again
+    return (next_link, kept_chapters[-1]['page'] if kept_chapters else 0,
+            VisitedIndex(kept_chapters))
+
+
+def start_end_serial_download(serial):
+    """Prepare download, call downloading & processing, complete page"""
+
+    # Returns why the download stopped before the end (DownloadStopped), or
+    # None
+
+    # Only choose the serial's parser, if wanted
+    if serial.options['calibrate']:
+        calibrate_parsers(serial)
+        return None
+
+    # User feedback headline
+    serial.report(('Updating' if serial.options['update'] else
+                   'Resuming' if serial.options['resume'] else
+                   'Re-rendering' if serial.options['rerender'] else
+                   'Downloading') +
+                  ' \'' + serial.page_title + '\' to file \'' +
+                  serial.pages_file + '\'...\nCount   Page Title' + ' ' * 37 +
+                  'Downloading   Processing'
+                  )
+
+    # Checkpoints of this download, next to the output file (if a file)
+    journal = Journal(journal_file(serial.pages_file)
+                      if OutputWriter.resumable(serial) else None)
+    output_writer = OUTPUT_FORMATS[serial.options['format']]
+
+    # Re-render: the pages of the last download, from the page cache
+    if serial.options['rerender']:
+        (chapters, chain_complete) = rerender_chain(serial)
+
+    # Continue from a checkpoint
+    if serial.options['resume'] or serial.options['update']:
+        (next_link, page_count, visited) = resume_download(serial, journal)
+        writer = output_writer(serial, continued=True)
+
+        # Notes to append, as spooled before
+        for record in journal.records:
+            if 'note_html' in record:
+                writer.add_chapter(record['title'], record['note_html'],
+                                   to_notes=True,
+                                   page_url=record.get('final_url',
+                                                       record['url']))
+
+    # Start from first page
+    else:
+        writer = output_writer(serial)
+
+        # Write html opening
+        writer.begin()
+
+        journal.start({'serial': serial.which_serial,
+                       'get_notes': serial.get_notes,
+                       'first_link': serial.first_link,
+                       'offset': writer.checkpoint()})
+        (next_link, page_count, visited) = (serial.first_link, 0,
+                                            VisitedIndex())
+
+    stopped = None  # Why the download stopped before the end, if it did
+    try:
+        # Render stored pages in worker processes, or pages as downloaded
+        # (in bulk, the posts are asked for right away); call download
+        # loop. A page that can't be downloaded stops it, but the output is
+        # completed all the same
+        try:
+            if serial.options['rerender']:
+                rendered_pages = rerender_pages(serial, chapters)
+            else:
+                rendered_pages = download_pages(serial, next_link,
+                                                page_count, visited)
+            process_page(serial, rendered_pages, writer, journal)
+        except DownloadStopped as this_stop:
+            stopped = this_stop
+
+        # Re-rendered download that was not complete stops where it did
+        if serial.options['rerender'] and not chain_complete:
+            stopped = DownloadStopped('last download stopped there')
+
+        # End of story, for an update to find appended Notes
+        story_end = writer.checkpoint()
+
+        # Append Notes if exist
+        proc_time = time.time()  # Start processing time for appending
+        if writer.append_notes():
+            serial.report(('{: >5}   {: <45}' + ' ' * 16 + '{:.3f} sec.')
+                          .format('—', '<Appending Notes to story>'[:45],
+                                  time.time() - proc_time))
+
+        # HTML closing
+        closing = writer.checkpoint()
+        writer.finish()
+
+    # Output so far is kept, also if the download stopped
+    finally:
+        writer.close()
+        journal.close()
+
+    # Stopped: no checkpoint of a complete download, so that '--resume'
+    # cuts off the closing and goes on from the last page
+    if stopped is not None:
+        chapters = [record for record in journal.records if 'url' in record]
+        serial.report('\nStopped after page {}{}.\nCould not retrieve the '
+                      'next page \'{}\': {}\nThe output is complete up to '
+                      'there{}.\nTotal time: {:.3f} sec.\n'
+                      .format(chapters[-1]['page'] if chapters else 0,
+                              ', \'' + chapters[-1]['title'] + '\''
+                              if chapters else '',
+                              chapters[-1]['next_link'] if chapters
+                              else serial.first_link,
+                              stopped,
+                              '; use \'--resume\' to go on'
+                              if journal.journal_file is not None else '',
+                              time.time() - serial.start_time))
+        return stopped
+
+    # Checkpoint: download complete
+    journal.add({'story_end': story_end, 'closing': closing})
+    journal.close()
+
+    # User feedback
+    serial.report('Serial \'' + serial.page_title + '\' complete?\n'
+                  'Could not find a link to a \'Next\'/\'Next Chapter\' '
+                  'page, or stopped because link pointed to known non-story '
+                  'page (epilogue, afterword, author\'s blog, another story, '
+                  'sequel, …).\n'
+                  'Total time: {:.3f} sec.'
+                  .format(time.time() - serial.start_time) + '\n'  # total
+                  )
+    return None
+
+
+# Feedback of all serials goes out one report at a time
+REPORT_LOCK = threading.Lock()
+
+
+class Serial:
+    """Settings of one serial's download, and its user feedback"""
+
+    def __init__(self, which_serial, run_options):
+        self.which_serial = which_serial  # Builtin title or start URL
+        self.adapter = None  # SerialAdapter: pages' layout, clutter etc.
+        self.options = run_options        # Run options for this download
+        self.page_title = 'Serial'
+        self.pages_file = None
+        self.first_link = ''
+        self.rel_link_base = ''
+        self.title_separate = False
+        self.wait_between_requests = run_options['delay']
+        self.pars = 'lxml'
+        self.parse_targets = None  # Tags to parse; None: the whole page
+        self.engine = None  # Parse engine (see PARSE_ENGINES)
+        self.get_notes = ''
+        self.report_prefix = ''  # Marks feedback lines in batch mode
+        self.quiet = False  # No feedback (library use)
+        self.progress = (0, '')  # Count and title of the last page done
+        self.cancel = None  # Why to stop after the page in progress, if told
+        self.start_time = time.time()  # For total time
+
+    def report(self, text):
+        """Print user feedback (not amidst the output on standard output)"""
+
+        if self.quiet:
+            return
+
+        # In one write, one serial at a time: serials of a batch report
+        # from their own threads, their lines not to run into each other
+        stream = sys.stderr if self.pages_file == '-' else sys.stdout
+        with REPORT_LOCK:
+            stream.write(''.join(self.report_prefix + this_line + '\n'
+                                 for this_line in text.split('\n')))
+            stream.flush()
+
+
+def find_adapter(which_serial):
+    """Adapter of a builtin serial, or of any URL (only http), else None"""
+
+    if which_serial in SERIAL_ADAPTERS:
+        return SERIAL_ADAPTERS[which_serial]
+    if str.startswith(which_serial, 'http'):
+        return GENERIC_ADAPTER
+    return None
+
+
+def configure_serial(arguments):
+    """Set serial-specific parameters from the command line arguments"""
+
+    """
+    For a new serial download source:
+    1. Add a SerialAdapter subclass, and set as class attributes:
+     page_title        Title of the serial
+     pages_file        File name of resulting HTML file (None: by the title)
+     first_link        URL of serial's first page
+     rel_link_base     Path prefix to convert relative to absolute links
+     title_separate    Set to False if title and chapter are in the same tag
+     pars              Parser used to find links, headlines, content
+                       Available parsers, select one that works well:
+                       • 'lxml' (fastest, lenient)
+                       • 'html.parser' (decent speed, lenient, Python built-in)
+                       • 'html5lib' (very slow, extremely lenient, parses pages
+                                  like a web browser does, creates valid HTML5)
+                       ('--calibrate' may find a faster one that gives the
+                       same results, used instead from then on)
+     parse_targets     Tags holding headline, content and next link, as
+                       (tag name, attribute, value) tuples; only these are
+                       parsed (not with 'html5lib'). None parses the whole page
+     title_tag         What defines the tag holding the page headline
+     content_tag       What defines the tag holding the page content
+                       (both as (tag name, {attribute: value}))
+     engine            Engine parsing and searching the pages (with 'lxml'):
+                       • 'soup' (Beautiful Soup, default)
+                       • 'lxml' (lxml alone, faster; the same html results,
+                                 check with benchmark/engines.py)
+     clutter           XXXXX_CLUTTER = Declutter([DeclutterRule(…), …]),
+                       for any unwanted clutter to decompose and delete
+     stop_links        Next links not to follow
+
+    2. Override its methods, if required:
+     configure()       Options for some serials (get_notes), other settings
+     next_link()       What defines a link to the next page (default:
+                       'rel'='next', or 'Next' / 'Next Chapter' as text)
+     content_tags()    Headline and content tags found otherwise
+     is_note()         What makes a page a Notes page
+     declutter()       Headline and content html, e.g. by a declutter_XXXXX()
+                       applying the serial's clutter rules
+
+    3. Register an instance of it in SERIAL_ADAPTERS, by the command line
+       argument that determines the serial to download
+    """
+
+    # Run options apply to any serial; leave only the serial's arguments
+    (run_options, arguments) = split_run_options(arguments)
+    serial = Serial(arguments[0] if arguments else '', run_options)
+
+    # Builtin serial, or any URL (no stated serial)
+    serial.adapter = find_adapter(arguments[0] if arguments else '')
+
+    # No valid arguments
+    if serial.adapter is None:
+        print('\nSerial or URL incorrectly stated.\n'
+              'Usage:\nChapterChainer.py {SICP, T5D, '
+              'Unsong [--append | --chrono[logical] | --omit], URL}\n'
+              'ChapterChainer.py --batch=FILE\n'
+              )
+        sys.exit()
+
+    # The serial's parameters, as its adapter sets them
+    serial.adapter.configure(serial, arguments)
+    if serial.engine is None:
+        print('\nInvalid value for option \'--engine\': \'' +
+              serial.options['engine'] + '\' (soup or lxml)\n')
+        sys.exit()
+
+    # Stated serial with start-URL ('serial URL' or 'serial option URL')
+    # overwrite the first page value with URL
+    if len(arguments) > 1 and str.startswith(arguments[1], 'http'):
+        serial.first_link = arguments[1]
+    if len(arguments) > 2 and str.startswith(arguments[2], 'http'):
+        serial.first_link = arguments[2]
+
+    # Parameters not set before
+    if serial.pages_file is None:
+        serial.pages_file = serial.page_title + '.html'
+
+    # Chapter files go to a directory, a book to an '.epub' file
+    if serial.options['format'] not in OUTPUT_FORMATS:
+        print('\nInvalid value for option \'--format\': \'' +
+              serial.options['format'] + '\' (html, split or epub)\n')
+        sys.exit()
+    if serial.options['assets'] not in ('', 'local', 'embed'):
+        print('\nInvalid value for option \'--assets\': \'' +
+              serial.options['assets'] + '\' (local or embed)\n')
+        sys.exit()
+    if serial.options['format'] == 'split':
+        serial.pages_file = os.path.splitext(serial.pages_file)[0]
+    elif serial.options['format'] == 'epub':
+        serial.pages_file = os.path.splitext(serial.pages_file)[0] + '.epub'
+
+    # Output elsewhere, if stated
+    if serial.options['output']:
+        serial.pages_file = serial.options['output']
+
+    return serial
+
+
+def listed_serials(batch_file):
+    """Arguments of the serials listed in a file, one serial per line as on
+    the command line; run options for the whole process stop it here"""
+
+    with open(batch_file, encoding='utf-8') as batch:
+        for (line_number, this_line) in enumerate(batch, 1):
+            arguments = shlex.split(this_line, comments=True)
+            process_options = [this_arg.partition('=')[0]
+                               for this_arg in arguments
+                               if this_arg.startswith('--') and
+                               this_arg[2:].partition('=')[0]
+                               in PROCESS_RUN_OPTIONS]
+            if process_options:
+                print('\nRun options for all serials on line ' +
+                      str(line_number) + ' of \'' + batch_file + '\': ' +
+                      ', '.join(process_options) + ' (give them on the '
+                      'command line)\n')
+                sys.exit()
+            if arguments:
+                yield arguments
+
+
+def batch_download(batch_file):
+    """Download the serials listed in a file, all at the same time"""
+
+    # One serial per line, with arguments as on the command line
+    serials = [configure_serial(arguments)
+               for arguments in listed_serials(batch_file)]
+
+    # Own output files for each serial, numbered feedback lines
+    pages_files = set()
+    for serial_number, serial in enumerate(serials, 1):
+        (file_name, extension) = os.path.splitext(serial.pages_file)
+        copy_number = 1
+        while serial.pages_file in pages_files:
+            copy_number += 1
+            serial.pages_file = (file_name + ' (' + str(copy_number) + ')' +
+                                 extension)
+        pages_files.add(serial.pages_file)
+        serial.report_prefix = '[{}] '.format(serial_number)
+        serial.report('\'' + serial.page_title + '\' to file \'' +
+                      serial.pages_file + '\'')
+
+    # Each serial in its own thread; hosts' delays kept by HOST_SCHEDULER
+    with concurrent.futures.ThreadPoolExecutor(max(1, len(serials)))\
+            as executor:
+        downloads = [(serial, executor.submit(start_end_serial_download,
+                                              serial))
+                     for serial in serials]
+
+        # A serial that stops doesn't stop the others
+        for serial, download in downloads:
+            try:
+                download.result()
+            except SystemExit:
+                serial.report('Stopped.')
+            except Exception as this_exception:  # debug info
+                serial.report('Stopped: ' + repr(this_exception))
+
+
+# Work queue: jobs (a serial's arguments) shared by worker processes, maybe
+# on several machines, in an SQLite file. A worker leases a job and the host
+# of its first page; a lease not renewed in time lets another worker take
+# the job over, going on from the output's journal
+QUEUE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    arguments TEXT NOT NULL UNIQUE,     -- JSON list, as on the command line
+    host TEXT NOT NULL,                 -- of the first page
+    state TEXT NOT NULL,                -- queued, running, done, stopped
+    worker TEXT,                        -- holding the lease, while running
+    lease_until REAL,
+    tries INTEGER NOT NULL DEFAULT 0,
+    pages INTEGER NOT NULL DEFAULT 0,   -- done so far
+    progress TEXT NOT NULL DEFAULT '',  -- last page's title, or why stopped
+    updated REAL);
+CREATE TABLE IF NOT EXISTS host_locks (
+    host TEXT PRIMARY KEY,
+    worker TEXT NOT NULL,
+    job INTEGER NOT NULL,
+    lease_until REAL NOT NULL);
+"""
+
+# Workers a job may be lost with (lease run out) before it is stopped; most
+# seconds between looks for a job while all queued ones' hosts are leased
+QUEUE_MAX_TRIES = 3
+QUEUE_POLL = 5.0
+
+
+class WorkQueue:
+    """Jobs in an SQLite file, leased by workers together with their hosts"""
+
+    def __init__(self, queue_file):
+        import sqlite3  # only for the work queue
+
+        # This worker, among all on all machines
+        self.worker = socket.gethostname() + ':' + str(os.getpid())
+
+        # Transactions begun as stated, waiting for other workers' to end;
+        # also used by the heartbeat thread, one at a time
+        self.connection = sqlite3.connect(queue_file, timeout=60.0,
+                                          isolation_level=None,
+                                          check_same_thread=False)
+        self.lock = threading.Lock()
+        self.connection.executescript(QUEUE_SCHEMA)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Queue locked for writing, committed at the end (if no error)"""
+
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                yield self.connection
+            except BaseException:
+                self.connection.execute('ROLLBACK')
+                raise
+            self.connection.execute('COMMIT')
+
+    def add(self, arguments, host):
+        """Queue a job, again if done or stopped; False if already queued"""
+
+        with self.transaction() as database:
+            return database.execute(
+                "INSERT INTO jobs (arguments, host, state, updated) "
+                "VALUES (?, ?, 'queued', ?) "
+                "ON CONFLICT (arguments) DO UPDATE SET state = 'queued', "
+                "host = excluded.host, tries = 0, pages = 0, progress = '', "
+                "updated = excluded.updated "
+                "WHERE state IN ('done', 'stopped')",
+                (json.dumps(arguments), host, time.time())).rowcount > 0
+
+    def claim(self, lease):
+        """Lease the first queued job whose host is free, or None if none"""
+
+        now = time.time()
+        with self.transaction() as database:
+
+            # Leases run out: their workers are gone, a job goes back to
+            # the queue unless lost too often
+            database.execute('DELETE FROM host_locks WHERE lease_until < ?',
+                             (now,))
+            database.execute(
+                "UPDATE jobs SET state = 'stopped', worker = NULL, "
+                "progress = 'worker lost ' || tries || ' times' "
+                "WHERE state = 'running' AND lease_until < ? AND tries >= ?",
+                (now, QUEUE_MAX_TRIES))
+            database.execute(
+                "UPDATE jobs SET state = 'queued', worker = NULL "
+                "WHERE state = 'running' AND lease_until < ?", (now,))
+
+            # First job of a host no worker holds, with its host
+            job = database.execute(
+                "SELECT id, arguments, host, tries FROM jobs "
+                "WHERE state = 'queued' "
+                "AND host NOT IN (SELECT host FROM host_locks) "
+                "ORDER BY id LIMIT 1").fetchone()
+            if job is None:
+                return None
+            database.execute(
+                "UPDATE jobs SET state = 'running', worker = ?, "
+                "lease_until = ?, tries = tries + 1, updated = ? "
+                "WHERE id = ?", (self.worker, now + lease, now, job[0]))
+            database.execute('INSERT INTO host_locks VALUES (?, ?, ?, ?)',
+                             (job[2], self.worker, job[0], now + lease))
+        return job
+
+    def renew(self, job, lease, progress):
+        """Extend the leases of a job and its host, note the pages done;
+        False if the job was lost to another worker"""
+
+        now = time.time()
+        with self.transaction() as database:
+            renewed = database.execute(
+                "UPDATE jobs SET lease_until = ?, pages = ?, progress = ?, "
+                "updated = ? WHERE id = ? AND worker = ? "
+                "AND state = 'running'",
+                (now + lease, progress[0], progress[1], now, job[0],
+                 self.worker)).rowcount
+            database.execute('UPDATE host_locks SET lease_until = ? '
+                             'WHERE host = ? AND worker = ?',
+                             (now + lease, job[2], self.worker))
+        return renewed > 0
+
+    def finish(self, job, state, pages, progress):
+        """End the leases of a job and its host, leaving the job in state"""
+
+        with self.transaction() as database:
+            database.execute(
+                "UPDATE jobs SET state = ?, worker = NULL, "
+                "lease_until = NULL, pages = ?, progress = ?, updated = ? "
+                "WHERE id = ? AND worker = ?",
+                (state, pages, progress, time.time(), job[0], self.worker))
+            database.execute('DELETE FROM host_locks '
+                             'WHERE host = ? AND worker = ?',
+                             (job[2], self.worker))
+
+    def pending(self):
+        """Number of jobs queued or running"""
+
+        with self.lock:
+            return self.connection.execute(
+                "SELECT COUNT(*) FROM jobs "
+                "WHERE state IN ('queued', 'running')").fetchone()[0]
+
+    def jobs(self):
+        """All jobs: id, arguments, state, tries, pages, worker, progress"""
+
+        with self.lock:
+            return self.connection.execute(
+                'SELECT id, arguments, state, tries, pages, worker, progress '
+                'FROM jobs ORDER BY id').fetchall()
+
+    def close(self):
+        """Close the queue file"""
+
+        self.connection.close()
+
+
+def enqueue_serials(work_queue, batch_file):
+    """Add the serials listed in a file (as for '--batch') as jobs"""
+
+    for arguments in list(listed_serials(batch_file)):
+
+        # Invalid arguments stop here, not at a worker later
+        serial = configure_serial(arguments)
+        host = urllib.parse.urlsplit(serial.first_link).netloc.lower()
+        print(('Queued: ' if work_queue.add(arguments, host) else
+               'Queued or running already: ') + ' '.join(arguments))
+
+
+def job_continuation(serial):
+    """Run option to go on from the last download to the serial's output
+    ('resume' if not complete, else 'update'), or None to start anew"""
+
+    if not OutputWriter.resumable(serial) or \
+            not os.path.isfile(serial.pages_file):
+        return None
+    journal = Journal(journal_file(serial.pages_file))
+    if not journal.records or \
+            journal.records[0].get('serial') != serial.which_serial or \
+            journal.records[0].get('get_notes') != serial.get_notes:
+        return None
+    return 'update' if 'closing' in journal.records[-1] else 'resume'
+
+
+def run_job(work_queue, job, lease):
+    """Download a leased job's serial, renewing the leases meanwhile"""
+
+    (job_id, arguments) = job[:2]
+    serial = None
+    (state, why) = ('stopped', '')
+
+    # Heartbeat: leases renewed, progress noted, a third of a lease apart;
+    # a job lost meanwhile (lease run out) stops after the page in progress
+    heartbeat_stop = threading.Event()
+
+    def heartbeat():
+        """Renew the leases until the job ends"""
+        while not heartbeat_stop.wait(lease / 3):
+            progress = serial.progress if serial is not None else (0, '')
+            if not work_queue.renew(job, lease, progress) and \
+                    serial is not None:
+                serial.cancel = 'job lost to another worker'
+
+    heartbeat_thread = threading.Thread(target=heartbeat, daemon=True)
+    heartbeat_thread.start()
+    try:
+        serial = configure_serial(json.loads(arguments))
+        serial.report_prefix = '[job {}] '.format(job_id)
+
+        # Go on from the last download to the same output: a worker's that
+        # was lost, or the last refresh, unless stated otherwise
+        continuation = job_continuation(serial)
+        if continuation is not None and not serial.options['resume'] and \
+                not serial.options['update'] and \
+                not serial.options['rerender']:
+            serial.options[continuation] = True
+
+        stopped = start_end_serial_download(serial)
+        (state, why) = ('done', '') if stopped is None else \
+            ('stopped', str(stopped))
+
+    # A job that stops doesn't stop the worker; interrupted, it's queued again
+    except SystemExit as this_exit:
+        why = 'exited' if this_exit.code is None else str(this_exit.code)
+    except Exception as this_exception:  # debug info
+        why = repr(this_exception)
+        print('[job {}] Stopped: {}'.format(job_id, why))
+    except KeyboardInterrupt:
+        state = 'queued'
+        raise
+    finally:
+        heartbeat_stop.set()
+        heartbeat_thread.join()
+        (pages, title) = serial.progress if serial is not None else (0, '')
+        work_queue.finish(job, state, pages, why or title)
+
+
+def run_worker(work_queue, lease):
+    """Download the queue's jobs one after another, until none are left"""
+
+    print('Worker \'' + work_queue.worker + '\' started.')
+    while True:
+        job = work_queue.claim(lease)
+
+        # None to take for now: wait for hosts to be free, or for lost
+        # jobs to come back; done when no job is left queued or running
+        if job is None:
+            if not work_queue.pending():
+                break
+            time.sleep(min(QUEUE_POLL, lease / 3))
+            continue
+
+        run_job(work_queue, job, lease)
+    print('Worker \'' + work_queue.worker + '\' done: no jobs left.')
+
+
+def show_queue(work_queue):
+    """Print the jobs of the queue, with their state and progress"""
+
+    jobs = work_queue.jobs()
+    print('{: >5}   {: <8}   {: >5}   {: >5}   {}'.format(
+        'Job', 'State', 'Tries', 'Pages', 'Serial'))
+    for (job_id, arguments, state, tries, pages, worker, progress) in jobs:
+        print('{: >5}   {: <8}   {: >5}   {: >5}   {}'.format(
+            job_id, state, tries, pages, ' '.join(json.loads(arguments))) +
+            (' (' + worker + ')' if worker else '') +
+            ('\n' + ' ' * 39 + progress[:60] if progress else ''))
+    states = collections.Counter(job[2] for job in jobs)
+    print('\n' + ', '.join('{} {}'.format(states[state], state)
+                           for state in ('queued', 'running', 'done',
+                                         'stopped')))
+
+
+def queue_download(queue_file):
+    """Add jobs to the work queue, work on them, or show them"""
+
+    if RUN_OPTIONS['lease'] <= 0:
+        print('\nInvalid value for option \'--lease\': \'' +
+              str(RUN_OPTIONS['lease']) + '\' (seconds, more than 0)\n')
+        sys.exit()
+
+    work_queue = WorkQueue(queue_file)
+    try:
+        if RUN_OPTIONS['enqueue']:
+            enqueue_serials(work_queue, RUN_OPTIONS['enqueue'])
+        if RUN_OPTIONS['work']:
+            run_worker(work_queue, RUN_OPTIONS['lease'])
+        if not RUN_OPTIONS['enqueue'] and not RUN_OPTIONS['work']:
+            show_queue(work_queue)
+    finally:
+        work_queue.close()
+
+
+# Chapter as the library hands it on: chapter count, url of the page, its
+# title, whether it's a Notes page, its decluttered html (None if a Notes
+# page to omit, or a chapter handed on before from another url), the link
+# to follow after it ('' if none), and the download and processing times
+Chapter = collections.namedtuple('Chapter',
+                                 'count url title is_note html next_link '
+                                 'down_time proc_time')
+
+# Notes options of the library, as the command line switches
+LIBRARY_NOTES = {'chrono': '--chrono', 'append': '--append', 'omit': '--omit'}
+
+# Run options of the output file and what else a download writes; a
+# library download has none
+OUTPUT_RUN_OPTIONS = frozenset([
+    'output', 'format', 'spool-size', 'assets', 'asset-connections',
+    'resume', 'update', 'rerender', 'calibrate', 'raw-files'])
+
+# Library downloads in progress; the last one done closes the connections
+# and the cache
+LIBRARY_DOWNLOADS = 0
+LIBRARY_DOWNLOADS_LOCK = threading.Lock()
+
+# Switches' values as text, for run options given as keywords
+SWITCH_VALUES = {'true': True, 'yes': True, 'on': True, '1': True,
+                 'false': False, 'no': False, 'off': False, '0': False}
+
+
+def library_serial(profile, start_url, notes, run_options):
+    """Serial to download for the library, raise ValueError if not valid"""
+
+    # Run options as keywords, '_' for '-'; the rest as by default
+    options = dict(RUN_OPTIONS)
+    for (keyword, value) in run_options.items():
+        option_name = keyword.replace('_', '-')
+        if option_name not in RUN_OPTIONS:
+            raise ValueError('Unknown run option: \'' + keyword + '\'')
+        if option_name in PROCESS_RUN_OPTIONS:
+            raise ValueError('Run option for the whole process: \'' +
+                             keyword + '\' (set RUN_OPTIONS instead)')
+        if option_name in OUTPUT_RUN_OPTIONS:
+            raise ValueError('Run option of the output file, none here: \'' +
+                             keyword + '\'')
+
+        # Switches only True or False (or as text), no truth of any value
+        if isinstance(RUN_OPTIONS[option_name], bool):
+            if isinstance(value, str):
+                value = SWITCH_VALUES.get(value.lower(), value)
+            if not isinstance(value, bool):
+                raise ValueError('Invalid value for run option \'' + keyword +
+                                 '\': ' + repr(value) + ' (True or False)')
+            options[option_name] = value
+            continue
+        try:
+            options[option_name] = type(RUN_OPTIONS[option_name])(value)
+        except (TypeError, ValueError):
+            raise ValueError('Invalid value for run option \'' + keyword +
+                             '\': ' + repr(value))
+
+    serial = Serial(profile, options)
+    serial.quiet = True
+    serial.adapter = find_adapter(profile)
+    if serial.adapter is None:
+        raise ValueError('Not a builtin serial or URL: \'' + profile + '\'')
+    if notes not in LIBRARY_NOTES:
+        raise ValueError('Unknown notes option: \'' + str(notes) + '\' '
+                         '(chrono, append or omit)')
+
+    # As configured on the command line, maybe from another first page
+    serial.adapter.configure(serial, [profile, LIBRARY_NOTES[notes]])
+    if serial.engine is None:
+        raise ValueError('Unknown engine: \'' + options['engine'] + '\' '
+                         '(soup or lxml)')
+    if start_url:
+        serial.first_link = start_url
+
+    return serial
+
+
+def iter_chapters(profile, start_url=None, notes='chrono', **run_options):
+    """Download a serial lazily: a generator of its chapters, in order"""
+
+    """
+    For use as a library: 'profile' is a builtin serial's title or any URL,
+    'start_url' a page to start at instead of the serial's first one.
+    'notes' is what to do with Notes pages ('chrono', 'append': handed on,
+    'omit': without html). Run options are keywords ('host_connections=4');
+    the ones for the whole process (cache, timeouts, retries, robots) are
+    read from RUN_OPTIONS and raise ValueError as keywords, as do options
+    of the output file. The last download done closes the connections and
+    the cache.
+
+    Each chapter is handed on as soon as it is decluttered (a Chapter), one
+    page at a time; closing the generator stops the download. Nothing is
+    printed or written; a page that can't be downloaded raises
+    DownloadStopped, invalid arguments raise ValueError right away.
+    """
+
+    serial = library_serial(profile, start_url, notes, run_options)
+
+    def chapters():
+        """Chapters as the pages are rendered"""
+        global LIBRARY_DOWNLOADS
+        with LIBRARY_DOWNLOADS_LOCK:
+            LIBRARY_DOWNLOADS += 1
+        try:
+            with contextlib.closing(download_pages(
+                    serial, serial.first_link, 0, VisitedIndex()))\
+                    as rendered_pages:
+                for rendered_page in rendered_pages:
+                    yield Chapter(rendered_page.count, rendered_page.link,
+                                  rendered_page.chap_title,
+                                  rendered_page.is_note,
+                                  None if rendered_page.out_chap is None
+                                  else decluttered_html(
+                                      serial, rendered_page.out_title,
+                                      rendered_page.out_chap),
+                                  rendered_page.next_link,
+                                  rendered_page.down_time,
+                                  rendered_page.proc_time)
+
+        # Exhausted, closed or stopped: the last one closes what's shared
+        finally:
+            with LIBRARY_DOWNLOADS_LOCK:
+                LIBRARY_DOWNLOADS -= 1
+                if LIBRARY_DOWNLOADS == 0:
+                    close_shared()
+
+    return chapters()
+
+
+async def aiter_chapters(profile, start_url=None, notes='chrono',
+                         **run_options):
+    """iter_chapters() for asyncio, downloading in a thread of its own"""
+
+    import asyncio  # only for this, not at every start
+
+    chapters = iter_chapters(profile, start_url, notes, **run_options)
+    loop = asyncio.get_running_loop()
+
+    # One thread, so that closing waits for the page in progress
+    download_thread = concurrent.futures.ThreadPoolExecutor(1)
+    try:
+        while True:
+            chapter = await loop.run_in_executor(download_thread, next,
+                                                 chapters, None)
+            if chapter is None:
+                return
+            yield chapter
+    finally:
+        download_thread.submit(chapters.close)
+        download_thread.shutdown(wait=False)
+
+
+if __name__ == '__main__':
+    """Read run options, start the download(s)"""
+
+    # Run options for all serials
+    (run_options, serial_arguments) = split_run_options(sys.argv[1:])
+    RUN_OPTIONS.update(run_options)
+
+    # Profile the whole run, if wanted
+    profiler = start_profiling(RUN_OPTIONS['profile'])
+
+    # Start actual processing
+    try:
+        if RUN_OPTIONS['queue']:
+            queue_download(RUN_OPTIONS['queue'])
+        elif RUN_OPTIONS['batch']:
+            batch_download(RUN_OPTIONS['batch'])
+        else:
+            start_end_serial_download(configure_serial(serial_arguments))
+
+    # Where the time went, also if the download stopped
+    finally:
+        stop_profiling(RUN_OPTIONS['profile'], profiler)
+        if RUN_OPTIONS['metrics']:
+            METRICS.export(RUN_OPTIONS['metrics'])
 
+    # Done with the connections and the cache
+    close_shared()
@@ -0,0 +1,329 @@
+#!python3
+# -*- coding: utf-8 -*-
+"""
+Offline benchmark of ChapterChainer: downloads the builtin serials from the
+recorded pages in 'fixtures', served by a local stand-in (see standin.py),
+and reports pages per second, the time per page of each stage, and peak
+memory. The results are compared with 'baseline.json'; the run fails if a
+serial got slower or bigger by more than the tolerance.
+
+Usage:
+    bench.py [--serials=SICP,T5D,Unsong] [--repeat=N] [--laps=N]
+             [--latency=SECONDS] [--bandwidth=BYTES_PER_SEC]
+             [--errors=FRACTION] [--tolerance=FRACTION] [--save-baseline]
+             [ChapterChainer run options, e.g. --pipeline]
+
+Each run of a serial is a fresh process that downloads it '--laps' times
+(default: 5), so peak memory is its own; of '--repeat' runs (default: 3)
+the best result of each measure counts. '--save-baseline' stores the
+results as the new baseline (for this machine, as timings depend on it).
+"""
+
+
+import collections
+import contextlib
+import functools
+import io
+import json
+import os
+import os.path
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    import resource  # peak memory; not on Windows
+except ImportError:
+    resource = None
+
+from standin import StandIn
+
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_FILE = os.path.join(BENCHMARK_DIR, 'baseline.json')
+
+# Benchmark settings ('--name=value'), with their defaults; other options
+# are ChapterChainer's run options
+SETTINGS = {
+    'serials': 'SICP,T5D,Unsong',
+    'repeat': 3,            # Runs per serial, the best results count
+    'laps': 5,              # Downloads of the serial in each run
+    'latency': 0.0,         # Seconds before each response of the stand-in
+    'bandwidth': 0,         # Bytes per second from the stand-in (0: no limit)
+    'errors': 0.0,          # Fraction of requests failing with 503
+    'tolerance': 0.25,      # Fraction a result may be worse than baseline
+    'save-baseline': False,
+}
+
+# Stages to time, and the functions (or methods) of ChapterChainer in them;
+# time in a stage's inner stages isn't counted for it
+STAGES = collections.OrderedDict([
+    ('fetch', ['download_page', 'Prefetcher.download']),
+    ('parse', ['fetch_page']),
+    ('find_next_link', ['find_next_link']),
+    ('declutter', ['declutter_sicp', 'declutter_t5d', 'declutter_unsong']),
+    ('write', ['write_chapter']),
+])
+
+# Stage times per page that differ less than this (seconds) are noise
+STAGE_NOISE = 0.0005
+
+
+class StageTimer:
+    """Time spent in each stage, less the time in stages called from it"""
+
+    def __init__(self):
+        self.totals = collections.Counter()  # stage -> seconds
+        self.calls = collections.Counter()   # stage -> number of calls
+        self.lock = threading.Lock()
+        self.local = threading.local()  # per thread: stack of inner times
+
+    def wrap(self, stage, function):
+        """Function that does the same, timed as the stage"""
+
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            stack = self.local.__dict__.setdefault('stack', [])
+            stack.append(0.0)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                inner = stack.pop()
+                if stack:
+                    stack[-1] += elapsed  # for the calling stage
+                with self.lock:
+                    self.totals[stage] += elapsed - inner
+                    self.calls[stage] += 1
+
+        return timed
+
+    def install(self, module):
+        """Time the stages' functions of the module from now on"""
+
+        for (stage, names) in STAGES.items():
+            for name in names:
+                (owner_name, _, function_name) = name.rpartition('.')
+                owner = getattr(module, owner_name) if owner_name else module
+                setattr(owner, function_name,
+                        self.wrap(stage, getattr(owner, function_name)))
+
+
+def peak_memory_mb():
+    """Peak memory (resident set) of this process in MB, or None"""
+
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return peak / 1024 ** 2  # bytes
+    return peak / 1024  # kilobytes
+
+
+def run_serial(which_serial, base, laps, run_arguments):
+    """Download one serial from the stand-in, return its results"""
+
+    sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+    import ChapterChainer as chainer
+
+    timer = StageTimer()
+    timer.install(chainer)
+
+    # Run options as on the command line
+    (run_options, _) = chainer.split_run_options(run_arguments)
+    chainer.RUN_OPTIONS.update(run_options)
+
+    completed = True
+    seconds = 0.0
+    for _ in range(laps):
+        with contextlib.redirect_stdout(io.StringIO()):  # feedback not shown
+            serial = chainer.configure_serial([which_serial] + run_arguments)
+
+        # The serial's site is the stand-in
+        serial.first_link = base + '/' + serial.first_link.split('://', 1)[-1]
+        if serial.rel_link_base:
+            serial.rel_link_base = (base + '/' +
+                                    serial.rel_link_base.split('://', 1)[-1])
+
+        # Download to a scratch directory
+        with tempfile.TemporaryDirectory() as scratch_dir:
+            os.chdir(scratch_dir)
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                # A download that stopped returns why (DownloadStopped)
+                completed = chainer.start_end_serial_download(serial) is None
+            seconds += time.perf_counter() - start
+            os.chdir(BENCHMARK_DIR)
+
+        if not completed:
+            break
+
+    pages = timer.calls['parse']
+    return {'serial': which_serial,
+            'completed': completed,
+            'pages': pages // laps if completed else pages,
+            'seconds': seconds,
+            'pages_per_sec': pages / seconds if seconds else 0.0,
+            'stages': {stage: timer.totals[stage] / pages if pages else 0.0
+                       for stage in STAGES},
+            'peak_memory_mb': peak_memory_mb()}
+
+
+def run_serial_process(which_serial, base, laps, run_arguments):
+    """Run one serial in a fresh process, return its results"""
+
+    process = subprocess.run(
+        [sys.executable, os.path.abspath(__file__),
+         '--child=' + which_serial, '--base=' + base, '--laps=' + str(laps)]
+        + run_arguments,
+        stdout=subprocess.PIPE, universal_newlines=True, cwd=BENCHMARK_DIR)
+    if process.returncode != 0 or not process.stdout.strip():
+        sys.exit('\nBenchmark of ' + which_serial + ' failed.\n')
+    return json.loads(process.stdout.strip().split('\n')[-1])
+
+
+def best_results(runs):
+    """Best result of each measure over runs of a serial"""
+
+    best = dict(max(runs, key=lambda run: run['pages_per_sec']))
+    best['stages'] = {stage: min(run['stages'][stage] for run in runs)
+                      for stage in STAGES}
+    if all(run['peak_memory_mb'] for run in runs):
+        best['peak_memory_mb'] = min(run['peak_memory_mb'] for run in runs)
+    best['completed'] = all(run['completed'] for run in runs)
+
+    return best
+
+
+def compare(results, baseline, tolerance):
+    """Regressions of the results against the baseline, as text lines"""
+
+    regressions = []
+    for result in results:
+        base_result = baseline.get(result['serial'])
+        if base_result is None:
+            continue
+        name = result['serial']
+
+        if not result['completed']:
+            regressions.append(name + ': download did not complete')
+        if result['pages'] != base_result['pages']:
+            regressions.append('{}: {} pages, baseline {}'.format(
+                name, result['pages'], base_result['pages']))
+        if result['pages_per_sec'] < \
+                base_result['pages_per_sec'] * (1 - tolerance):
+            regressions.append('{}: {:.1f} pages/sec, baseline {:.1f}'.format(
+                name, result['pages_per_sec'], base_result['pages_per_sec']))
+        for (stage, seconds) in result['stages'].items():
+            base_seconds = base_result['stages'].get(stage, 0.0)
+            if seconds > base_seconds * (1 + tolerance) and \
+                    seconds - base_seconds > STAGE_NOISE:
+                regressions.append('{}: {} {:.2f} ms/page, baseline {:.2f}'
+                                   .format(name, stage, seconds * 1000,
+                                           base_seconds * 1000))
+        if result['peak_memory_mb'] and base_result['peak_memory_mb'] and \
+                result['peak_memory_mb'] > \
+                base_result['peak_memory_mb'] * (1 + tolerance):
+            regressions.append('{}: peak memory {:.1f} MB, baseline {:.1f}'
+                               .format(name, result['peak_memory_mb'],
+                                       base_result['peak_memory_mb']))
+
+    return regressions
+
+
+def report(results):
+    """Print the results as a table"""
+
+    print('{: <8} {: >5} {: >9} '.format('Serial', 'Pages', 'Pages/s') +
+          ' '.join('{: >14}'.format(stage[:14]) for stage in STAGES) +
+          ' {: >9}'.format('Peak MB'))
+    for result in results:
+        print('{: <8} {: >5} {: >9.1f} '.format(result['serial'],
+                                                result['pages'],
+                                                result['pages_per_sec']) +
+              ' '.join('{: >11.2f} ms'.format(result['stages'][stage] * 1000)
+                       for stage in STAGES) +
+              ' {: >9}'.format('{:.1f}'.format(result['peak_memory_mb'])
+                               if result['peak_memory_mb'] else '-') +
+              ('' if result['completed'] else '   (stopped)'))
+
+
+def main(arguments):
+    """Benchmark the serials, compare with and maybe save the baseline"""
+
+    # Benchmark settings; the rest are run options for ChapterChainer
+    settings = dict(SETTINGS)
+    run_arguments = []
+    for this_arg in arguments:
+        setting_name, has_value, setting_value = this_arg[2:].partition('=')
+        if not this_arg.startswith('--') or setting_name not in SETTINGS:
+            run_arguments.append(this_arg)
+        elif isinstance(SETTINGS[setting_name], bool):
+            settings[setting_name] = True
+        else:
+            settings[setting_name] = \
+                type(SETTINGS[setting_name])(setting_value)
+
+    stand_in = StandIn(latency=settings['latency'],
+                       bandwidth=settings['bandwidth'],
+                       errors=settings['errors'])
+    base = stand_in.start()
+
+    # Best results of each serial's runs
+    results = []
+    for which_serial in settings['serials'].split(','):
+        runs = [run_serial_process(which_serial, base,
+                                   max(1, settings['laps']), run_arguments)
+                for _ in range(max(1, settings['repeat']))]
+        results.append(best_results(runs))
+    stand_in.shutdown()
+
+    report(results)
+
+    # Results are only comparable with the same settings
+    conditions = {'latency': settings['latency'],
+                  'bandwidth': settings['bandwidth'],
+                  'errors': settings['errors'],
+                  'laps': settings['laps'],
+                  'run_options': run_arguments}
+    exit_code = 0
+    if os.path.isfile(BASELINE_FILE):
+        with open(BASELINE_FILE, encoding='utf-8') as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline['conditions'] != conditions:
+            print('\nBaseline was taken with other settings, not compared.')
+        else:
+            regressions = compare(results, baseline['serials'],
+                                  settings['tolerance'])
+            if regressions:
+                print('\nRegressions against baseline:\n  ' +
+                      '\n  '.join(regressions))
+                exit_code = 1
+            else:
+                print('\nNo regressions against baseline.')
+
+    if settings['save-baseline']:
+        with open(BASELINE_FILE, 'w', encoding='utf-8') as baseline_file:
+            json.dump({'conditions': conditions,
+                       'serials': {result['serial']: result
+                                   for result in results}},
+                      baseline_file, indent=2, sort_keys=True)
+            baseline_file.write('\n')
+        print('Baseline saved.')
+
+    return exit_code
+
+
+if __name__ == '__main__':
+    """Benchmark, or be one run of a serial (started by the benchmark)"""
+
+    if sys.argv[1:2] and sys.argv[1].startswith('--child='):
+        print(json.dumps(run_serial(sys.argv[1][len('--child='):],
+                                    sys.argv[2][len('--base='):],
+                                    int(sys.argv[3][len('--laps='):]),
+                                    sys.argv[4:])))
+    else:
+        sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,389 @@
+#!python3
+# -*- coding: utf-8 -*-
+"""
+Checks of ChapterChainer's behaviour where the sites don't go as planned,
+against the local stand-in (see standin.py) with the recorded pages in
+'fixtures'. Each check prints 'ok' or what went wrong; the run fails if
+any check does.
+
+Usage:
+    checks.py [--checks=NAME,...]
+"""
+
+
+import base64
+import contextlib
+import io
+import os
+import os.path
+import re
+import sys
+import tempfile
+
+from standin import StandIn, StandInHandler
+
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Output of the serials from the recorded pages as the script wrote it
+# before any of the speedups ('{base}' for the stand-in's address), by file
+# name in 'expected', with the arguments they are downloaded with
+EXPECTED_DIR = os.path.join(BENCHMARK_DIR, 'expected')
+EXPECTED_OUTPUTS = {'SICP.html': ['SICP'],
+                    'T5D.html': ['T5D'],
+                    'Unsong-chrono.html': ['Unsong', '--chrono'],
+                    'Unsong-append.html': ['Unsong', '--append'],
+                    'Unsong-omit.html': ['Unsong', '--omit']}
+
+
+class NoWordPressApiHandler(StandInHandler):
+    """Stand-in of a hardened WordPress site: REST API and feed forbidden"""
+
+    def do_GET(self):
+        if self.path.startswith('/wp-json') or self.path.startswith('/feed'):
+            self.send_error(403)
+            return
+        super().do_GET()
+
+
+class ApiLinkHandler(StandInHandler):
+    """Stand-in noting the paths asked for; its pages link to a WordPress
+    REST API (that isn't there) if the server's api_link is set"""
+
+    def do_GET(self):
+        self.server.paths.append(self.path)
+        super().do_GET()
+
+    def end_headers(self):
+        if self.server.api_link:
+            self.send_header('Link', '<{}/wp-json/>; rel="https://api.w.org/"'
+                             .format(self.server.base))
+        super().end_headers()
+
+
+class RedirectingHandler(StandInHandler):
+    """Stand-in redirecting each page to its url with a trailing slash,
+    then with a tracking parameter: the same page, by another url"""
+
+    def do_GET(self):
+        (path, _, query) = self.path.partition('?')
+        if not path.endswith('/') and not os.path.splitext(path)[1]:
+            location = path + '/' + ('?' + query if query else '')
+        elif not query:
+            location = path + '?utm_source=stand-in'
+        else:
+            super().do_GET()
+            return
+        self.send_response(301)
+        self.send_header('Location', location)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+class CdnErrorHandler(StandInHandler):
+    """Stand-in behind a CDN that can't reach the site at first: 522 to the
+    first request of each page"""
+
+    def do_GET(self):
+        if self.path not in self.server.paths:
+            self.server.paths.add(self.path)
+            self.send_error(522)
+            return
+        super().do_GET()
+
+
+# Chapter of a site with images as WordPress writes them: relative,
+# protocol-relative, with other sizes in 'srcset'
+ASSET_PAGE = ('<html><body><h1 class="entry-title">Pictures</h1>'
+              '<div class="entry-content"><p>Two pictures.</p>'
+              '<img src="../img/relative.png" '
+              'srcset="../img/relative-2x.png 2x" sizes="100vw">'
+              '<img src="//{host}/img/protocol.png"></div></body></html>')
+PNG = base64.b64decode('iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlE'
+                       'QVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg==')
+
+
+class AssetSiteHandler(StandInHandler):
+    """Stand-in of a site with one chapter ('/site/chapter/') and images"""
+
+    def do_GET(self):
+        if self.path == '/site/chapter/':
+            (body, content_type) = (ASSET_PAGE.format(
+                host=self.headers['Host']).encode('utf-8'),
+                'text/html; charset=UTF-8')
+        elif self.path.endswith('.png'):
+            (body, content_type) = (PNG, 'image/png')
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def download(chainer, arguments, output, base=None):
+    """Download a serial (from the stand-in at base, if given) to a file,
+    return why it stopped (None if complete) and the file's content"""
+
+    with contextlib.redirect_stdout(io.StringIO()):  # feedback not shown
+        serial = chainer.configure_serial(arguments + ['--output=' + output])
+        if base is not None:
+            serial.first_link = (base + '/' +
+                                 serial.first_link.split('://', 1)[-1])
+            if serial.rel_link_base:
+                serial.rel_link_base = (
+                    base + '/' + serial.rel_link_base.split('://', 1)[-1])
+        stopped = chainer.start_end_serial_download(serial)
+    with open(output, 'rb') as output_file:
+        return stopped, output_file.read()
+
+
+def check_output_bytes(chainer, scratch_dir):
+    """Each serial's output is byte for byte the one before the speedups"""
+
+    stand_in = StandIn()
+    base = stand_in.start()
+    try:
+        for (file_name, arguments) in EXPECTED_OUTPUTS.items():
+            (stopped, output_html) = download(
+                chainer, arguments, os.path.join(scratch_dir, file_name),
+                base)
+            if stopped is not None:
+                return file_name + ' stopped: ' + str(stopped)
+            with open(os.path.join(EXPECTED_DIR, file_name), 'rb') \
+                    as expected_file:
+                expected_html = expected_file.read()
+            output_html = output_html.replace(base.encode('utf-8'),
+                                              b'{base}')
+            if output_html != expected_html:
+                return '{} differs ({} bytes, not {})'.format(
+                    file_name, len(output_html), len(expected_html))
+    finally:
+        stand_in.shutdown()
+    return None
+
+
+def check_bulk_api_forbidden(chainer, scratch_dir):
+    """'--bulk' on a site that forbids its API and feed follows the chain"""
+
+    stand_in = StandIn(handler=NoWordPressApiHandler)
+    base = stand_in.start()
+    try:
+        (stopped, bulk_html) = download(
+            chainer, ['Unsong', '--bulk'],
+            os.path.join(scratch_dir, 'bulk.html'), base)
+        (_, chain_html) = download(chainer, ['Unsong'],
+                                   os.path.join(scratch_dir, 'chain.html'),
+                                   base)
+    finally:
+        stand_in.shutdown()
+
+    if stopped is not None:
+        return 'stopped: ' + str(stopped)
+    if bulk_html != chain_html:
+        return 'output differs from following the chain'
+    return None
+
+
+def check_bulk_generic_wordpress(chainer, scratch_dir):
+    """'--bulk' on any URL asks for the REST API only if the site's pages
+    link to it"""
+
+    stand_in = StandIn(handler=ApiLinkHandler)
+    base = stand_in.start()
+    start_link = base + '/thefifthdefiance.com/2015/11/02/introduction/'
+    asked = {}
+    try:
+        for stand_in.api_link in (False, True):
+            stand_in.paths = []
+            (stopped, _) = download(
+                chainer, [start_link, '--bulk'],
+                os.path.join(scratch_dir, 'generic.html'))
+            if stopped is not None:
+                return 'stopped: ' + str(stopped)
+            asked[stand_in.api_link] = any(
+                path.startswith('/wp-json') for path in stand_in.paths)
+    finally:
+        stand_in.shutdown()
+
+    if asked[False]:
+        return 'REST API asked for on a site without one'
+    if not asked[True]:
+        return 'REST API not asked for on a site linking to it'
+    return None
+
+
+def check_redirects_same_page(chainer, scratch_dir):
+    """Redirects to the same page by another url (trailing slash, tracking
+    parameter) are followed, not taken for circling back"""
+
+    stand_in = StandIn()
+    base = stand_in.start()
+    try:
+        (_, chain_html) = download(chainer, ['T5D'],
+                                   os.path.join(scratch_dir, 'chain.html'),
+                                   base)
+    finally:
+        stand_in.shutdown()
+
+    stand_in = StandIn(handler=RedirectingHandler)
+    base = stand_in.start()
+    try:
+        (stopped, redirected_html) = download(
+            chainer, ['T5D', base + '/thefifthdefiance.com/2015/11/02/'
+                      'introduction'],
+            os.path.join(scratch_dir, 'redirected.html'))
+    finally:
+        stand_in.shutdown()
+
+    if stopped is not None:
+        return 'stopped: ' + str(stopped)
+    if redirected_html != chain_html:
+        return 'output differs from the download without redirects ({} ' \
+               'bytes, not {})'.format(len(redirected_html), len(chain_html))
+    return None
+
+
+def check_retry_cdn_error(chainer, scratch_dir):
+    """A CDN's 5xx (522: site not reached) is tried again, like a 503"""
+
+    backoff = chainer.RUN_OPTIONS['backoff']
+    chainer.RUN_OPTIONS['backoff'] = 0.01  # not to wait for the check
+    stand_in = StandIn(handler=CdnErrorHandler)
+    stand_in.paths = set()
+    base = stand_in.start()
+    try:
+        (stopped, _) = download(chainer, ['T5D'],
+                                os.path.join(scratch_dir, 'cdn.html'), base)
+    finally:
+        stand_in.shutdown()
+        chainer.RUN_OPTIONS['backoff'] = backoff
+
+    if stopped is not None:
+        return 'stopped: ' + str(stopped)
+    return None
+
+
+def check_assets_relative(chainer, scratch_dir):
+    """'--assets=local' stores relative and protocol-relative images, and
+    drops the other sizes ('srcset') that would load from the site"""
+
+    stand_in = StandIn(handler=AssetSiteHandler)
+    base = stand_in.start()
+    try:
+        (stopped, chapter_html) = download(
+            chainer, [base + '/site/chapter/', '--assets=local'],
+            os.path.join(scratch_dir, 'pictures.html'))
+    finally:
+        stand_in.shutdown()
+
+    if stopped is not None:
+        return 'stopped: ' + str(stopped)
+    images = re.findall(rb'<img\b[^>]*>', chapter_html)
+    if len(images) != 2:
+        return '{} images in the output, not 2'.format(len(images))
+    for image in images:
+        if b'srcset=' in image or b'sizes=' in image:
+            return 'other sizes kept: ' + image.decode('utf-8')
+        source = re.search(rb'\ssrc="([^"]*)"', image).group(1).decode('utf-8')
+        if not os.path.isfile(os.path.join(scratch_dir, source)):
+            return 'image not stored locally: ' + image.decode('utf-8')
+    return None
+
+
+def check_library_switches(chainer, scratch_dir):
+    """Switches as library keywords take True/False or their text, and
+    nothing else ('false' is not true)"""
+
+    for (value, expected) in ((True, True), (False, False), ('false', False),
+                              ('Off', False), ('0', False), ('yes', True),
+                              ('maybe', ValueError), (0, ValueError),
+                              (None, ValueError)):
+        try:
+            serial = chainer.library_serial('T5D', None, 'chrono',
+                                            {'bulk': value})
+            result = serial.options['bulk']
+        except ValueError:
+            result = ValueError
+        if result is not expected:
+            return 'bulk={!r} gave {!r}, not {!r}'.format(value, result,
+                                                          expected)
+
+    # Not of one serial or no output: not taken, rather than ignored
+    for keywords in ({'host_connections': 'two'}, {'cache': scratch_dir},
+                     {'output': 'x.html'}, {'format': 'epub'}):
+        try:
+            chainer.library_serial('T5D', None, 'chrono', keywords)
+        except ValueError:
+            continue
+        return '{!r} taken'.format(keywords)
+    return None
+
+
+def check_library_closes(chainer, scratch_dir):
+    """A library download closes the page cache when done with it, the
+    size limit applied, and a later one opens it anew"""
+
+    cache_dir = os.path.join(scratch_dir, 'cache')
+    run_options = dict(chainer.RUN_OPTIONS)
+    chainer.RUN_OPTIONS.update({'cache': cache_dir, 'cache-size': 0})
+    stand_in = StandIn()
+    base = stand_in.start()
+    try:
+        for _ in range(2):
+            chapters = chainer.iter_chapters(
+                'T5D', base + '/thefifthdefiance.com/2015/11/02/'
+                'introduction/')
+            next(chapters)
+            chapters.close()
+            if chainer.PAGE_CACHE is not None:
+                return 'page cache left open'
+            if os.path.getsize(os.path.join(cache_dir, 'pages.pack')) > 0:
+                return 'size limit not applied on closing'
+    finally:
+        stand_in.shutdown()
+        chainer.RUN_OPTIONS.clear()
+        chainer.RUN_OPTIONS.update(run_options)
+    return None
+
+
+# Checks, by name
+CHECKS = {'output-bytes': check_output_bytes,
+          'bulk-api-forbidden': check_bulk_api_forbidden,
+          'bulk-generic-wordpress': check_bulk_generic_wordpress,
+          'redirects-same-page': check_redirects_same_page,
+          'retry-cdn-error': check_retry_cdn_error,
+          'assets-relative': check_assets_relative,
+          'library-switches': check_library_switches,
+          'library-closes': check_library_closes}
+
+
+def main(arguments):
+    """Run the checks, report each"""
+
+    names = list(CHECKS)
+    for this_arg in arguments:
+        if not this_arg.startswith('--checks='):
+            sys.exit(__doc__)
+        names = this_arg[len('--checks='):].split(',')
+        if not set(names) <= set(CHECKS):
+            sys.exit(__doc__)
+
+    sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+    import ChapterChainer as chainer
+
+    failed = 0
+    for name in names:
+        with tempfile.TemporaryDirectory() as scratch_dir:
+            failure = CHECKS[name](chainer, scratch_dir)
+        print('{: <24} {}'.format(name, 'ok' if failure is None
+                                  else 'FAILED: ' + failure))
+        failed += failure is not None
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
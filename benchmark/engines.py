@@ -0,0 +1,148 @@
+#!python3
+# -*- coding: utf-8 -*-
+"""
+Checks that ChapterChainer's parse engines render the recorded pages in
+'fixtures' the same: for each page, the next link, headline and content html
+of the lxml engine must be byte for byte those of Beautiful Soup's. Also
+reports the time per page (parse, find next link, render) of each engine.
+
+Usage:
+    engines.py [--serials=T5D,Unsong,URL] [--repeat=N] [--charset=NAME]
+
+'URL' renders all recorded pages as any URL (no stated serial) would be.
+Of '--repeat' renders of each page (default: 5) the fastest counts. The
+pages are given the '--charset' the stand-in sends (default: utf-8; 'none'
+lets the engines detect it). The check fails if any page differs.
+"""
+
+
+import contextlib
+import io
+import os
+import os.path
+import sys
+import time
+
+from standin import FIXTURES
+
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Settings ('--name=value'), with their defaults
+SETTINGS = {
+    'serials': 'T5D,Unsong,URL',
+    'repeat': 5,
+    'charset': 'utf-8',
+}
+
+# Recorded pages of each serial, by the folder of its host; any URL: all
+SERIAL_HOSTS = {'T5D': 'thefifthdefiance.com',
+                'Unsong': 'unsongbook.com',
+                'URL': ''}
+
+# Stand-in address the pages' links point to
+BASE = 'http://127.0.0.1:8000'
+
+
+def fixture_pages(host):
+    """Recorded pages of a host (all hosts if ''), as (url, body)"""
+
+    pages = []
+    for (directory, _, file_names) in sorted(os.walk(os.path.join(FIXTURES,
+                                                                  host))):
+        for file_name in sorted(file_names):
+            page_file = os.path.join(directory, file_name)
+            with open(page_file, encoding='utf-8') as page:
+                body = page.read().replace('{base}', BASE).encode('utf-8')
+            pages.append((os.path.relpath(page_file, FIXTURES), body))
+    return pages
+
+
+def render(chainer, serial, body, charset):
+    """Parse and render a page as ChapterChainer does, and the time taken"""
+
+    start = time.perf_counter()
+    (page, found_link) = chainer.parse_page(serial, body, charset)
+    rendered = chainer.render_page(serial, page, found_link)
+    serial.engine.free(page)
+    return (found_link,) + rendered, time.perf_counter() - start
+
+
+def first_difference(soup_result, lxml_result):
+    """Where two results of a page differ, as text"""
+
+    names = ('next link', 'title', 'is note', 'headline html', 'content html')
+    for (name, soup_value, lxml_value) in zip(names, soup_result,
+                                              lxml_result):
+        if soup_value == lxml_value:
+            continue
+        if not isinstance(soup_value, str) or \
+                not isinstance(lxml_value, str):
+            return '{}: {!r} != {!r}'.format(name, soup_value, lxml_value)
+        position = next((index for (index, (soup_char, lxml_char))
+                         in enumerate(zip(soup_value, lxml_value))
+                         if soup_char != lxml_char),
+                        min(len(soup_value), len(lxml_value)))
+        return '{} at {}: {!r} != {!r}'.format(
+            name, position, soup_value[max(0, position - 30):position + 30],
+            lxml_value[max(0, position - 30):position + 30])
+    return None
+
+
+def main(arguments):
+    """Render the pages with both engines, compare, report the times"""
+
+    settings = dict(SETTINGS)
+    for this_arg in arguments:
+        setting_name, _, setting_value = this_arg[2:].partition('=')
+        if not this_arg.startswith('--') or setting_name not in SETTINGS:
+            sys.exit(__doc__)
+        settings[setting_name] = type(SETTINGS[setting_name])(setting_value)
+    charset = None if settings['charset'] == 'none' else settings['charset']
+
+    sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+    import ChapterChainer as chainer
+
+    differences = []
+    print('{: <8} {: >5} {: >12} {: >12} {: >8}'.format(
+        'Serial', 'Pages', 'soup', 'lxml', 'Speedup'))
+    for which_serial in settings['serials'].split(','):
+        profile = BASE + '/' if which_serial == 'URL' else which_serial
+        serials = {}
+        for engine in ('soup', 'lxml'):
+            with contextlib.redirect_stdout(io.StringIO()):
+                serials[engine] = chainer.configure_serial(
+                    [profile, '--engine=' + engine])
+
+        # Each page with each engine; the fastest of the repeats counts
+        pages = fixture_pages(SERIAL_HOSTS[which_serial])
+        seconds = {'soup': 0.0, 'lxml': 0.0}
+        for (page_name, body) in pages:
+            results = {}
+            for (engine, serial) in serials.items():
+                times = []
+                for _ in range(max(1, settings['repeat'])):
+                    (results[engine], page_seconds) = render(chainer, serial,
+                                                             body, charset)
+                    times.append(page_seconds)
+                seconds[engine] += min(times)
+            difference = first_difference(results['soup'], results['lxml'])
+            if difference is not None:
+                differences.append(which_serial + ' ' + page_name + ': ' +
+                                   difference)
+
+        print('{: <8} {: >5} {: >9.2f} ms {: >9.2f} ms {: >7.1f}x'.format(
+            which_serial, len(pages),
+            seconds['soup'] / len(pages) * 1000,
+            seconds['lxml'] / len(pages) * 1000,
+            seconds['soup'] / seconds['lxml'] if seconds['lxml'] else 0.0))
+
+    if differences:
+        print('\nPages rendered differently:\n  ' + '\n  '.join(differences))
+        return 1
+    print('\nAll pages rendered the same.')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
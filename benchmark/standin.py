@@ -0,0 +1,132 @@
+#!python3
+# -*- coding: utf-8 -*-
+"""
+Local stand-in for the serials' web sites, serving the recorded pages in
+'fixtures' (one folder per host, 'index.html' for urls ending in '/').
+
+'{base}' in a page is replaced by the stand-in's own address, so links
+between the pages point back to it. Latency, bandwidth and errors can be
+set to mimic a slow or flaky site.
+
+Usage:
+    standin.py [--port=N] [--latency=SECONDS] [--bandwidth=BYTES_PER_SEC]
+               [--errors=FRACTION]
+"""
+
+
+import hashlib
+import http.server
+import os.path
+import random
+import socket
+import sys
+import threading
+import time
+
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'fixtures')
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    """Answer a GET with a recorded page, slowly or failing if set so"""
+
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real sites
+
+    def setup(self):
+        super().setup()
+        # Send small responses right away, no waiting for delayed ACKs
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        pass  # quiet
+
+    def do_GET(self):
+        server = self.server
+        time.sleep(server.latency)
+
+        # Injected error, as a site under load would send
+        if server.errors > 0 and server.random.random() < server.errors:
+            self.send_error(503, 'Stand-in error')
+            return
+
+        # Recorded page for the url, with links pointing to the stand-in
+        path = self.path.split('?')[0].split('#')[0]
+        page_file = os.path.normpath(os.path.join(FIXTURES, path.lstrip('/')))
+        if path.endswith('/'):
+            page_file = os.path.join(page_file, 'index.html')
+        if not page_file.startswith(FIXTURES) or \
+                not os.path.isfile(page_file):
+            self.send_error(404)
+            return
+        with open(page_file, encoding='utf-8') as page:
+            body = page.read().replace('{base}', server.base).encode('utf-8')
+
+        # Unchanged page, for conditional requests from the page cache
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+
+        # Body in chunks at the set bandwidth, or all at once
+        if server.bandwidth <= 0:
+            self.wfile.write(body)
+            return
+        chunk_size = max(1, int(server.bandwidth / 20))  # 20 chunks a second
+        for start in range(0, len(body), chunk_size):
+            self.wfile.write(body[start:start + chunk_size])
+            self.wfile.flush()
+            time.sleep(len(body[start:start + chunk_size]) / server.bandwidth)
+
+
+class StandIn(http.server.ThreadingHTTPServer):
+    """Stand-in server, run in a background thread"""
+
+    daemon_threads = True
+
+    def __init__(self, port=0, latency=0.0, bandwidth=0, errors=0.0, seed=0,
+                 handler=StandInHandler):
+        super().__init__(('127.0.0.1', port), handler)
+        self.latency = latency      # seconds before each response
+        self.bandwidth = bandwidth  # bytes per second (0: unlimited)
+        self.errors = errors        # fraction of requests failing with 503
+        self.random = random.Random(seed)  # same errors in every run
+        self.base = 'http://127.0.0.1:' + str(self.server_address[1])
+
+    def start(self):
+        """Serve in a background thread, return the base url"""
+
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self.base
+
+    def url(self, site_url):
+        """Stand-in url for a url of one of the recorded sites"""
+
+        return self.base + '/' + site_url.split('://', 1)[-1]
+
+
+if __name__ == '__main__':
+    """Serve the recorded pages until interrupted"""
+
+    settings = {'port': 8000, 'latency': 0.0, 'bandwidth': 0, 'errors': 0.0}
+    for this_arg in sys.argv[1:]:
+        setting_name, _, setting_value = this_arg[2:].partition('=')
+        if setting_name not in settings:
+            sys.exit(__doc__)
+        settings[setting_name] = type(settings[setting_name])(setting_value)
+
+    stand_in = StandIn(**settings)
+    print('Serving ' + FIXTURES + ' at ' + stand_in.base)
+    try:
+        stand_in.serve_forever()
+    except KeyboardInterrupt:
+        pass